@@ -1,3 +1,8 @@
 from .analysis import *
 from .toolbox import *
 from . import utils
+from . import topology
+from . import shapefile
+from . import geometry
+from . import backends
+from . import cache
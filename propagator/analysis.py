@@ -13,16 +13,25 @@ Written by Paul Hobson (phobson@geosyntec.com)
 
 
 from functools import partial
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
+from concurrent import futures
 import warnings
+import operator
 
 import numpy
 from numpy.lib import recfunctions
 
-import arcpy
+try:
+    import arcpy
+except ImportError:  # pragma: no cover
+    arcpy = None
 
 from . import utils
 from . import validate
+from . import topology
+from . import backends
+from . import geometry
+from . import shapefile
 
 
 AGG_METHOD_DICT = OrderedDict()
@@ -40,13 +49,73 @@ AGG_METHOD_DICT['last'] = lambda x: x[-1]
 AGG_METHOD_DICT['sum'] = numpy.sum
 AGG_METHOD_DICT['weighted_average'] = utils.weighted_average
 
+# methods whose upstream results can be built up from the results of
+# the immediately upstream subcatchments (see `accumulate_upstream`)
+DECOMPOSABLE_METHODS = ('sum', 'count', 'minimum', 'maximum', 'average',
+                        'weighted_average')
+
+
+class Scenario(namedtuple("Scenario", ("name", "value_columns", "ml_filter", "ml_filter_cols"))):
+    """ One set of choices for aggregating and propagating the water
+    quality data (see :func:`propagator.toolbox.propagate_scenarios`).
+
+    Parameters
+    ----------
+    name : str
+        Short label of the scenario used to name its outputs.
+    value_columns : list of str or tuples
+        The water quality fields and their aggregation methods, as
+        passed to :func:`preprocess_wq`.
+    ml_filter : callable, optional
+        Function used to exclude (remove) monitoring locations from
+        from aggregation/propagation.
+    ml_filter_cols : str or list of str, optional
+        Names of any additional columns in the monitoring locations
+        that are required to use ``ml_filter``.
+
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, name, value_columns, ml_filter=None, ml_filter_cols=None):
+        return super(Scenario, cls).__new__(cls, name, value_columns,
+                                            ml_filter, ml_filter_cols)
+
+    def column(self, rescol):
+        """ The name of the result column ``rescol`` when it is stored
+        alongside the results of other scenarios. """
+        return '{}_{}'.format(rescol, self.name)
+
+
+def _compile_graph(subcatchment_array, id_col, ds_col, graph=None):
+    """
+    Builds a ``WatershedGraph`` for ``subcatchment_array`` unless a
+    compatible one was provided.
+    """
+
+    if graph is None:
+        graph = topology.WatershedGraph(subcatchment_array, id_col=id_col, ds_col=ds_col)
+    elif graph.size != subcatchment_array.shape[0]:
+        raise ValueError("`graph` was not built from `subcatchment_array`")
+    return graph
+
+
+def _map_partitions(fxn, jobs, n_workers):
+    """
+    Runs ``fxn`` on each of the ``jobs`` in a pool of ``n_workers``
+    processes, returning the results in the order of the jobs.
+    """
+
+    with futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(fxn, jobs))
+
 
 @utils.update_status()
 def trace_upstream(subcatchment_array, subcatchment_ID, id_col='ID',
-                   ds_col='DS_ID', include_base=False, downstream=None):
+                   ds_col='DS_ID', include_base=False, graph=None,
+                   ordered=None):
     """
-    Recursively traces an upstream path of subcatchments through a
-    watetershed.
+    Traces an upstream path of subcatchments through a watetershed.
 
     Parameters
     ----------
@@ -65,47 +134,51 @@ def trace_upstream(subcatchment_array, subcatchment_ID, id_col='ID',
     include_base : bool, optional
         Toggles the inclusion of target subcatchment itself in upstream
         subcatchment list.
-
-        .. note ::
-           This should *always* be False in the *recursive* calls the
-           function.
-
-    downstream : list, optional
-        A list of already known downstream catchments in the trace.
-
-        .. warning ::
-           This is *only* to be used in the recursive calls to this
-           function. You should never provide this value.
+    graph : topology.WatershedGraph, optional
+        The compiled topology of ``subcatchment_array``. If not
+        provided, one is built from ``id_col`` and ``ds_col``.
+    ordered : numpy.recarray, optional
+        ``subcatchment_array`` put in depth-first order by
+        ``graph.reorder``. When provided, the upstream subcatchments
+        are returned as a view into it instead of a copy. Only worth
+        it when tracing many subcatchments with the same graph.
 
     Returns
     -------
     upstream : numpy.recarry
         A record array of all of the upstream subcatchments. This will
-        have the same schema as ``subcatchment_array``
+        have the same schema as ``subcatchment_array``, with the
+        subcatchments in depth-first order.
+
+    Notes
+    -----
+    The upstream subcatchments are found without any traversal (see
+    :meth:`topology.WatershedGraph.upstream`). Finding ``k`` upstream
+    subcatchments costs O(k), plus a one-time O(n) pass per graph, and
+    never recurses, so arbitrarily deep watersheds can be traced.
 
     """
-    if downstream is None:
-        downstream = []
 
-    # If needed, add the bottom subcatchment to the output list
-    if include_base:
-        base_row = utils.find_row_in_array(subcatchment_array, id_col, subcatchment_ID)
-        downstream.append(base_row)
+    graph = _compile_graph(subcatchment_array, id_col, ds_col, graph=graph)
+    base = graph.code(subcatchment_ID)
 
-    _neighbors = filter(lambda row: row[ds_col] == subcatchment_ID, subcatchment_array)
+    if base >= 0 and ordered is not None:
+        return ordered[graph.upstream_slice(base, include_base=include_base)]
 
-    for n in _neighbors:
-        downstream.append(n)
-        trace_upstream(subcatchment_array, n[id_col],
-                       id_col=id_col, ds_col=ds_col,
-                       include_base=False,
-                       downstream=downstream)
+    elif base >= 0:
+        rows = graph.upstream(base, include_base=include_base)
 
-    return numpy.array(downstream, dtype=subcatchment_array.dtype)
+    # pseudo-catchments (e.g., the ocean) are not part of the graph,
+    # so their neighbors can only be found by searching the table.
+    else:
+        neighbors = numpy.flatnonzero(subcatchment_array[ds_col] == subcatchment_ID)
+        rows = graph.upstream(neighbors, include_base=True)
+
+    return numpy.array(subcatchment_array[rows], dtype=subcatchment_array.dtype)
 
 
 @utils.update_status()
-def find_edges(subcatchment_array, edge_ID='bottom', ds_col='DS_ID'):
+def find_edges(subcatchment_array, edge_ID='bottom', ds_col='DS_ID', graph=None):
     """
     Finds the lowest, non-ocean subcatchments in a watershed.
 
@@ -120,6 +193,9 @@ def find_edges(subcatchment_array, edge_ID='bottom', ds_col='DS_ID'):
     ds_col : str, optional
         The name of the column that identifies the downstream
         subcatchment.
+    graph : topology.WatershedGraph, optional
+        The compiled topology of ``subcatchment_array``. When provided,
+        only the outlets of the graph are checked.
 
     Returns
     -------
@@ -129,12 +205,17 @@ def find_edges(subcatchment_array, edge_ID='bottom', ds_col='DS_ID'):
 
     """
 
-    bottoms = filter(lambda row: row[ds_col] == edge_ID, subcatchment_array)
-    return numpy.array(list(bottoms), dtype=subcatchment_array.dtype)
+    if graph is None:
+        rows = numpy.flatnonzero(subcatchment_array[ds_col] == edge_ID)
+    else:
+        rows = _compile_graph(subcatchment_array, graph.id_col, ds_col, graph=graph).outlets
+        rows = rows[subcatchment_array[ds_col][rows] == edge_ID]
+
+    return numpy.array(subcatchment_array[rows], dtype=subcatchment_array.dtype)
 
 
 @utils.update_status()
-def find_tops(subcatchment_array, id_col='ID', ds_col='DS_ID'):
+def find_tops(subcatchment_array, id_col='ID', ds_col='DS_ID', graph=None):
     """
     Finds the the subcatchments in a watershed that do not accept
     any upstrea tributary flow.
@@ -153,6 +234,9 @@ def find_tops(subcatchment_array, id_col='ID', ds_col='DS_ID'):
     ds_col : str, optional
         The name of the column that identifies the downstream
         subcatchment.
+    graph : topology.WatershedGraph, optional
+        The compiled topology of ``subcatchment_array``. If not
+        provided, one is built from ``id_col`` and ``ds_col``.
 
     Returns
     -------
@@ -161,16 +245,22 @@ def find_tops(subcatchment_array, id_col='ID', ds_col='DS_ID'):
 
     """
 
-    tops = filter(lambda r: r[id_col] not in subcatchment_array[ds_col], subcatchment_array)
-    return numpy.array(list(tops), dtype=subcatchment_array.dtype)
+    graph = _compile_graph(subcatchment_array, id_col, ds_col, graph=graph)
+    return numpy.array(subcatchment_array[graph.tops], dtype=subcatchment_array.dtype)
 
 
 @utils.update_status()
 def propagate_scores(subcatchment_array, id_col, ds_col, value_column,
-                     ignored_value=0, edge_ID='bottom'):
+                     ignored_value=0, edge_ID='bottom', graph=None,
+                     n_workers=1):
     """
     Propagate values into upstream subcatchments through a watershed.
 
+    Each subcatchment without a value takes the value of its nearest
+    populated downstream neighbor. All of the columns are filled in a
+    single pass over the watershed in downstream-to-upstream order, so
+    propagating many columns costs about as much as propagating one.
+
     Parameters
     ----------
     subcatchment_array : numpy.recarry
@@ -182,15 +272,24 @@ def propagate_scores(subcatchment_array, id_col, ds_col, value_column,
     ds_col : str, optional
         The name of the column that identifies the downstream
         subcatchment.
-    value_column : str
-        Name of a representative water quality column that can be used
-        to indicate if the given subcatchment has or has not been
-        populated with water quality data.
+    value_column : str or list of str
+        Name(s) of the water quality column(s) to be propagated. A
+        subcatchment is considered unpopulated in a given column if its
+        value in that column is ``ignored_value``.
     ignored_value : float, optional
         The values representing unpopulated records in the array of
         subcatchment and water quality data.
     edge_ID : str, optional
         The subcatchment ID of the pseudo-catchments in the Ocean.
+        Retained for backwards compatibility. Subcatchments that drain
+        out of the watershed are identified by ``graph``.
+    graph : topology.WatershedGraph, optional
+        The compiled topology of ``subcatchment_array``. If not
+        provided, one is built from ``id_col`` and ``ds_col``.
+    n_workers : int, optional (1)
+        Number of processes among which the independent drainage
+        basins are split. The result is the same as with a single
+        process.
 
     Returns
     -------
@@ -198,44 +297,164 @@ def propagate_scores(subcatchment_array, id_col, ds_col, value_column,
         A copy of ``subcatchment_array`` with all of the water quality
         records populated.
 
+    Notes
+    -----
+    The cost is O(n * len(value_column)) numpy work plus one
+    python-level step per level of the watershed (see
+    :attr:`topology.WatershedGraph.levels`).
+
+    Worker processes are only worth it for watersheds with many large
+    basins. On Windows, they re-import the calling script, which must
+    therefore guard its entry point with ``if __name__ == '__main__'``.
+
     """
 
+    graph = _compile_graph(subcatchment_array, id_col, ds_col, graph=graph)
+    value_columns = numpy.atleast_1d(value_column).tolist()
+
+    if n_workers > 1 and graph.outlets.shape[0] > 1:
+        parts = graph.partition(n_workers)
+        jobs = [
+            (subcatchment_array[rows], id_col, ds_col, value_columns, ignored_value)
+            for rows in parts
+        ]
+
+        propagated = subcatchment_array.copy()
+        for rows, result in zip(parts, _map_partitions(_propagate_partition, jobs, n_workers)):
+            propagated[rows] = result
+        return propagated
+
     # copy the input array so that we always have the
     # original to compare to.
     propagated = subcatchment_array.copy()
+    if propagated.shape[0] == 0:
+        return propagated
+
+    # treat all of the columns as one 2-D block so that each level of
+    # the watershed is filled for every column at once.
+    values = numpy.column_stack([propagated[col] for col in value_columns])
+
+    # the outlets keep their values. everything upstream of them is
+    # visited after its downstream neighbor, which has therefore
+    # already been filled in.
+    for level in graph.levels[1:]:
+        block = values[level]
+        values[level] = numpy.where(
+            block == ignored_value,
+            values[graph.parents[level]],
+            block
+        )
 
-    # loop through the array
-    for n, row in enumerate(propagated):
+    for n, col in enumerate(value_columns):
+        propagated[col] = values[:, n]
 
-        # check to see if we're at the bottom of the watershed
-        is_bottom = row[ds_col].lower() == edge_ID.lower()
+    return propagated
 
-        # look for a downstream value if there is not value
-        # and we're not already at the bottom
-        if row[value_column] == ignored_value and not is_bottom:
-            # find the downstream value
-            ds_values = _find_downstream_scores(
-                subcatchment_array=propagated,
-                subcatchment_ID=row[ds_col],
-                value_column=value_column,
-                ignored_value=ignored_value,
-                id_col=id_col,
-                ds_col=ds_col,
-                edge_ID=edge_ID,
-            )
 
-            # assign the downstream value to the current (empty) value
-            propagated[value_column][n] = ds_values[value_column]
+def _propagate_partition(job):
+    subcatchment_array, id_col, ds_col, value_columns, ignored_value = job
+    return propagate_scores(subcatchment_array, id_col, ds_col, value_columns,
+                            ignored_value=ignored_value)
 
-    return propagated
+
+@utils.update_status()
+def repropagate_scores(propagated_array, scores_array, id_col, ds_col,
+                       value_column, changed, ignored_value=0, graph=None):
+    """
+    Update previously propagated values after the scores of a few
+    subcatchments have changed.
+
+    Only the changed subcatchments and the subcatchments upstream of
+    them can be affected, so only those rows are recomputed. Their
+    downstream neighbors keep their already propagated values.
+
+    Parameters
+    ----------
+    propagated_array : numpy.recarray
+        The output of :func:`propagate_scores` for all of the
+        subcatchments in the watershed.
+    scores_array : numpy.recarray
+        The current (aggregated but not yet propagated) scores of at
+        least the affected subcatchments, with an ``id_col`` and each
+        of ``value_column``. Subcatchments missing from this array are
+        treated as unpopulated.
+    id_col, ds_col : str
+        The names of the columns with the IDs of each subcatchment and
+        of its downstream neighbor.
+    value_column : str or list of str
+        Name(s) of the water quality column(s) to be updated.
+    changed : list
+        The IDs of the subcatchments whose scores may have changed.
+        Unknown IDs are ignored.
+    ignored_value : float, optional
+        The value representing unpopulated records.
+    graph : topology.WatershedGraph, optional
+        The compiled topology of ``propagated_array``. If not
+        provided, one is built from ``id_col`` and ``ds_col``.
+
+    Returns
+    -------
+    updated : numpy.recarray
+        A copy of ``propagated_array`` with the affected rows updated.
+    rows : numpy.array of int
+        The positions in ``updated`` of the recomputed rows, which
+        have to be written back to the output.
+
+    See also
+    --------
+    propagate_scores
+    propagator.toolbox.update_propagation
+
+    """
+
+    graph = _compile_graph(propagated_array, id_col, ds_col, graph=graph)
+    value_columns = numpy.atleast_1d(value_column).tolist()
+
+    codes = graph.codes(changed)
+    rows = graph.upstream(numpy.unique(codes[codes >= 0]), include_base=True)
+
+    updated = propagated_array.copy()
+    if rows.shape[0] == 0:
+        return updated, rows
+
+    # the current scores of the affected subcatchments
+    index = utils.RowIndex(scores_array, id_col)
+    positions = index.positions(updated[id_col][rows].tolist())
+    found = positions >= 0
+
+    values = numpy.column_stack([updated[col] for col in value_columns])
+    scores = numpy.empty((rows.shape[0], len(value_columns)), dtype=values.dtype)
+    scores[:] = ignored_value
+    for n, col in enumerate(value_columns):
+        scores[found, n] = scores_array[col][positions[found]]
+    values[rows] = scores
+
+    # same sweep as `propagate_scores`, restricted to the affected rows.
+    # their downstream neighbors are either affected too (and therefore
+    # filled first) or keep the values they already had.
+    affected = numpy.zeros(graph.size, dtype=bool)
+    affected[rows] = True
+    for level in graph.levels[1:]:
+        level = level[affected[level]]
+        block = values[level]
+        values[level] = numpy.where(
+            block == ignored_value,
+            values[graph.parents[level]],
+            block
+        )
+
+    for n, col in enumerate(value_columns):
+        updated[col] = values[:, n]
+
+    return updated, numpy.sort(rows)
 
 
 @utils.update_status()
 def _find_downstream_scores(subcatchment_array, subcatchment_ID, value_column,
                             ignored_value='None', id_col='ID', ds_col='DS_ID',
-                            edge_ID='bottom'):
+                            edge_ID='bottom', graph=None):
     """
-    Recursively look for populated water quality score in downstream
+    Look for populated water quality score in downstream
     subcatchments.
 
     Parameters
@@ -259,6 +478,9 @@ def _find_downstream_scores(subcatchment_array, subcatchment_ID, value_column,
     ds_col : str, optional
         The name of the column that identifies the downstream
         subcatchment.
+    graph : topology.WatershedGraph, optional
+        The compiled topology of ``subcatchment_array``. If not
+        provided, one is built from ``id_col`` and ``ds_col``.
 
     Returns
     -------
@@ -267,29 +489,23 @@ def _find_downstream_scores(subcatchment_array, subcatchment_ID, value_column,
 
     """
 
-    row = utils.find_row_in_array(subcatchment_array, id_col, subcatchment_ID)
+    graph = _compile_graph(subcatchment_array, id_col, ds_col, graph=graph)
+    node = graph.code(subcatchment_ID)
 
-    # check to see if we're at the bottom of the watershed
-    is_bottom = row[ds_col].lower() == edge_ID.lower()
-    if row[value_column] == ignored_value and not is_bottom:
-        scores = _find_downstream_scores(
-            subcatchment_array=subcatchment_array,
-            subcatchment_ID=row[ds_col],
-            value_column=value_column,
-            ignored_value=ignored_value,
-            id_col=id_col,
-            ds_col=ds_col,
-            edge_ID=edge_ID,
-        )
-    else:
-        scores = row.copy()
+    # walk downstream until we find a value or reach the bottom
+    while node >= 0:
+        row = subcatchment_array[node]
+        is_bottom = row[ds_col].lower() == edge_ID.lower()
+        if row[value_column] != ignored_value or is_bottom:
+            return row.copy()
+        node = graph.parents[node]
 
-    return scores
+    return None
 
 
 @utils.update_status()
 def mark_edges(subcatchment_array, id_col='ID', ds_col='DS_ID',
-               edge_ID='EDGE'):
+               edge_ID='EDGE', graph=None):
     """
     Mark of all of the subcatchments on the edges of the study area
     (i.e., flow out of the study area). In this case "mark" means that
@@ -306,6 +522,9 @@ def mark_edges(subcatchment_array, id_col='ID', ds_col='DS_ID',
     edge_ID : str, optional
         The downstream subcatchment ID that will given to the
         subcatchments that flow out of the study area.
+    graph : topology.WatershedGraph, optional
+        The compiled topology of ``subcatchment_array``. If not
+        provided, one is built from ``id_col`` and ``ds_col``.
 
     Returns
     -------
@@ -315,11 +534,10 @@ def mark_edges(subcatchment_array, id_col='ID', ds_col='DS_ID',
 
     """
 
-    subc = subcatchment_array.copy()
-    for n, row in enumerate(subcatchment_array):
-        if row[ds_col] not in subc[id_col]:
-            subc[n][ds_col] = edge_ID
+    graph = _compile_graph(subcatchment_array, id_col, ds_col, graph=graph)
 
+    subc = subcatchment_array.copy()
+    subc[ds_col][graph.outlets] = edge_ID
     return subc
 
 
@@ -368,7 +586,8 @@ def remove_orphan_subcatchments(subcatchment_array, id_col='ID', ds_col='DS_ID',
 def preprocess_wq(monitoring_locations, subcatchments, id_col, ds_col,
                   output_path, value_columns=None, ml_filter=None,
                   ml_filter_cols=None, default_aggfxn='average',
-                  ignored_value=0, terminator_value=-99, cleanup=True):
+                  ignored_value=0, terminator_value=-99, cleanup=True,
+                  n_workers=1, persist=True):
     """
     Preprocess the water quality data to have to averaged score for
     each subcatchment.
@@ -407,6 +626,15 @@ def preprocess_wq(monitoring_locations, subcatchments, id_col, ds_col,
         signal that a value is missing.
     cleanup : bool, optional
         Toggles the deletion of temporary files.
+    n_workers : int, optional (1)
+        Number of threads used to locate the monitoring locations
+        within the subcatchments when both layers are shapefiles in
+        the same coordinate system.
+    persist : bool, optional (True)
+        Toggles saving the spatial index of the subcatchments and the
+        subcatchment of each monitoring location next to the input
+        shapefiles, so that later calls can reuse them (see
+        :func:`propagator.geometry.join_points_to_polygons`).
 
     Returns
     -------
@@ -417,58 +645,24 @@ def preprocess_wq(monitoring_locations, subcatchments, id_col, ds_col,
     """
 
     ml_filter_cols = validate.non_empty_list(ml_filter_cols, on_fail='create')
-    if ml_filter is None:
-        ml_filter = lambda row: row
-
-    # validate value_columns
-    value_columns = validate.value_column_stats(value_columns, default_aggfxn)
-    value_columns_field = [i[0] for i in value_columns]
-    value_columns_aggmethod = [i[1] for i in value_columns]
+    statistics, vectorized = _wq_statistics(value_columns, default_aggfxn, ignored_value)
+    res_columns = [stat.rescol for stat in statistics]
 
     # create the output feature class as a copy of the `subcatchments`
     output_path = utils.copy_layer(subcatchments, output_path)
 
-    # associate subcatchment IDs with all of the monitoring locations
-    joined = utils.intersect_layers(
-        input_paths=[monitoring_locations, subcatchments],
-        output_path=utils.create_temp_filename("joined_ml_sc", filetype='shape'),
-        how="ALL",
-    )
-
-    # define the Statistic objects that will be passed to `rec_groupby`
-    statfxns = []
-    for agg in value_columns_aggmethod:
-        statfxns.append(partial(
-            utils.stats_with_ignored_values,
-            statfxn=AGG_METHOD_DICT[agg.lower()],
-            ignored_value=ignored_value
-        ))
-
-    res_columns = [
-        '{}{}'.format(prefix[0:3].lower(), col)
-        for col, prefix in value_columns
-    ]
-
-    statistics = [
-        utils.Statistic(srccol, statfxn, rescol)
-        for srccol, statfxn, rescol in zip(value_columns_field, statfxns, res_columns)
-    ]
-
     # compile the original fields to read in from the joined table
     orig_fields = [id_col, ds_col]
     orig_fields.extend([stat.srccol for stat in statistics])
     orig_fields.extend(ml_filter_cols)
 
-    raw_array = utils.load_attribute_table(joined, *orig_fields)
-    # factor this into load_attribute_table
-    array = numpy.array(filter(ml_filter, raw_array), dtype=raw_array.dtype)
-
-    # compile the final results (aggregated) fields for the output
-    final_fields = [id_col, ds_col]
-    final_fields.extend([stat.rescol for stat in statistics])
+    raw_array, joined = _join_wq(monitoring_locations, subcatchments,
+                                 orig_fields, n_workers=n_workers,
+                                 persist=persist)
 
     # aggregate the data within each subcatchment
-    aggregated = utils.rec_groupby(array, orig_fields[:2], *statistics)
+    aggregated = _aggregate_wq(raw_array, ml_filter, orig_fields[:2],
+                               statistics, vectorized, ignored_value)
 
     # add the new columns for the aggregated data to the output
     for rescol in res_columns:
@@ -484,16 +678,292 @@ def preprocess_wq(monitoring_locations, subcatchments, id_col, ds_col,
         layerpath=output_path,
         attribute_array=aggregated,
         id_column=id_col,
-        orig_columns=[s.rescol for s in statistics]
+        orig_columns=res_columns
     )
 
     # remove the temporary data
-    if cleanup:
+    if cleanup and joined is not None:
         utils.cleanup_temp_results(joined)
 
     return utils.load_attribute_table(output_path), res_columns
 
 
+@utils.update_status()
+def preprocess_wq_scenarios(monitoring_locations, subcatchments, id_col,
+                            ds_col, scenarios, default_aggfxn='average',
+                            ignored_value=0, cleanup=True, n_workers=1,
+                            persist=True):
+    """
+    Aggregate the water quality data in each subcatchment for several
+    scenarios at once.
+
+    The monitoring locations are associated with the subcatchments
+    only once, after which each scenario is filtered and aggregated in
+    memory. Unlike :func:`preprocess_wq`, nothing is written to disk.
+
+    Parameters
+    ----------
+    monitoring_locations : str
+        Path to the feature class containing the monitoring locations
+        and their water quality scores.
+    subcatchments : str
+        Path to the feature class containing the subcatchment
+        boundaries.
+    id_col, ds_col : str
+        Name of the column in ``subcatchments`` that contains the
+        (ds = downstream) subcatchment IDs.
+    scenarios : list of Scenario or dict
+        The scenarios to aggregate. Dictionaries are passed to
+        :class:`Scenario` as keyword arguments.
+    default_aggfxn : str, optional
+        The aggregation method used for value columns that do not
+        specify one.
+    ignored_value : int, optional
+        The values in ``monitoring_locations`` that should be ignored.
+        Subcatchments without any monitoring locations are also given
+        this value.
+    cleanup : bool, optional
+        Toggles the deletion of temporary files.
+    n_workers : int, optional (1)
+        Number of threads used to locate the monitoring locations
+        within the subcatchments when both layers are shapefiles in
+        the same coordinate system.
+    persist : bool, optional (True)
+        Toggles saving the spatial index of the subcatchments and the
+        subcatchment of each monitoring location next to the input
+        shapefiles, so that later calls can reuse them (see
+        :func:`propagator.geometry.join_points_to_polygons`).
+
+    Returns
+    -------
+    array : numpy.recarray
+        The ``id_col`` and ``ds_col`` of every subcatchment along with
+        the aggregated scores of every scenario.
+    columns : OrderedDict
+        Maps the name of each scenario to a two-tuple of lists: the
+        names of its result columns (as :func:`preprocess_wq` would
+        name them) and the corresponding columns of ``array`` (see
+        :meth:`Scenario.column`).
+
+    """
+
+    scenarios = [_as_scenario(scenario) for scenario in scenarios]
+    names = [scenario.name for scenario in scenarios]
+    if len(set(names)) != len(names):
+        raise ValueError("scenario names must be unique")
+
+    # the union of the fields required by all of the scenarios is read
+    # from a single join
+    fields = [id_col, ds_col]
+    statistics = []
+    for scenario in scenarios:
+        stats, vectorized = _wq_statistics(scenario.value_columns,
+                                           default_aggfxn, ignored_value)
+        statistics.append((stats, vectorized))
+        fields.extend([stat.srccol for stat in stats])
+        fields.extend(validate.non_empty_list(scenario.ml_filter_cols, on_fail='create'))
+    fields = list(OrderedDict.fromkeys(fields))
+
+    raw_array, joined = _join_wq(monitoring_locations, subcatchments,
+                                 fields, n_workers=n_workers,
+                                 persist=persist)
+
+    subc = utils.load_attribute_table(subcatchments, id_col, ds_col)
+    columns = OrderedDict()
+    for scenario, (stats, _) in zip(scenarios, statistics):
+        res_columns = [stat.rescol for stat in stats]
+        columns[scenario.name] = (res_columns, [scenario.column(c) for c in res_columns])
+
+    wq_columns = [c for _, cols in columns.values() for c in cols]
+    if len(set(wq_columns)) != len(wq_columns):
+        raise ValueError("scenarios cannot repeat an aggregation of a column")
+
+    array = numpy.empty(subc.shape[0], dtype=subc.dtype.descr + [
+        (str(col), float) for col in wq_columns
+    ])
+    array[id_col] = subc[id_col]
+    array[ds_col] = subc[ds_col]
+
+    index = utils.RowIndex(subc, id_col)
+    for scenario, (stats, vectorized) in zip(scenarios, statistics):
+        aggregated = _aggregate_wq(raw_array, scenario.ml_filter, [id_col, ds_col],
+                                   stats, vectorized, ignored_value)
+        positions = index.positions(aggregated[id_col].tolist())
+        found = positions >= 0
+        for stat in stats:
+            col = scenario.column(stat.rescol)
+            array[col] = ignored_value
+            array[col][positions[found]] = aggregated[stat.rescol][found]
+
+    if cleanup and joined is not None:
+        utils.cleanup_temp_results(joined)
+
+    return array, columns
+
+
+@utils.update_status()
+def preprocess_wq_changes(monitoring_locations, subcatchments, id_col, ds_col,
+                          ml_id_col, changed_ids, value_columns=None,
+                          ml_filter=None, ml_filter_cols=None,
+                          default_aggfxn='average', ignored_value=0,
+                          cleanup=True, n_workers=1, persist=True):
+    """
+    Aggregate the water quality data in each subcatchment in memory
+    and find the subcatchments that contain some changed monitoring
+    locations.
+
+    Parameters
+    ----------
+    monitoring_locations : str
+        Path to the feature class containing the monitoring locations
+        and their (updated) water quality scores.
+    subcatchments : str
+        Path to the feature class containing the subcatchment
+        boundaries.
+    id_col, ds_col : str
+        Name of the column in ``subcatchments`` that contains the
+        (ds = downstream) subcatchment IDs.
+    ml_id_col : str
+        Name of the column in ``monitoring_locations`` that identifies
+        each monitoring location.
+    changed_ids : list
+        The IDs of the monitoring locations that were added or whose
+        scores have changed.
+    value_columns, ml_filter, ml_filter_cols, default_aggfxn, ignored_value
+        As in :func:`preprocess_wq`.
+    cleanup : bool, optional
+        Toggles the deletion of temporary files.
+    n_workers : int, optional (1)
+        Number of threads used to locate the monitoring locations
+        within the subcatchments when both layers are shapefiles in
+        the same coordinate system.
+    persist : bool, optional (True)
+        Toggles saving the spatial index of the subcatchments and the
+        subcatchment of each monitoring location next to the input
+        shapefiles, so that later calls can reuse them (see
+        :func:`propagator.geometry.join_points_to_polygons`).
+
+    Returns
+    -------
+    aggregated : numpy.recarray
+        The aggregated scores of every subcatchment that contains at
+        least one monitoring location.
+    res_columns : list of str
+        The names of the aggregated columns, as given by
+        :func:`preprocess_wq`.
+    changed : numpy.array
+        The IDs of the subcatchments containing the changed monitoring
+        locations, including those excluded by ``ml_filter``.
+
+    """
+
+    ml_filter_cols = validate.non_empty_list(ml_filter_cols, on_fail='create')
+    statistics, vectorized = _wq_statistics(value_columns, default_aggfxn, ignored_value)
+
+    fields = [id_col, ds_col]
+    fields.extend([stat.srccol for stat in statistics])
+    fields.extend(ml_filter_cols)
+    fields.append(ml_id_col)
+    fields = list(OrderedDict.fromkeys(fields))
+
+    raw_array, joined = _join_wq(monitoring_locations, subcatchments,
+                                 fields, n_workers=n_workers,
+                                 persist=persist)
+
+    is_changed = numpy.in1d(raw_array[ml_id_col], numpy.asarray(changed_ids))
+    changed = numpy.unique(raw_array[id_col][is_changed])
+
+    aggregated = _aggregate_wq(raw_array, ml_filter, [id_col, ds_col],
+                               statistics, vectorized, ignored_value)
+
+    if cleanup and joined is not None:
+        utils.cleanup_temp_results(joined)
+
+    return aggregated, [stat.rescol for stat in statistics], changed
+
+
+def _as_scenario(spec):
+    if isinstance(spec, Scenario):
+        return spec
+    return Scenario(**spec)
+
+
+def _wq_statistics(value_columns, default_aggfxn, ignored_value):
+    """ The Statistic objects that aggregate ``value_columns`` and
+    whether they can all be computed by `utils.sorted_groupby`. """
+
+    value_columns = validate.value_column_stats(value_columns, default_aggfxn)
+
+    # define the Statistic objects that will be passed to
+    # `sorted_groupby` (method names) if it supports all of the methods
+    # or to `rec_groupby` (functions) otherwise.
+    aggmethods = [agg.lower() for _, agg in value_columns]
+    vectorized = all(agg in utils.SORTED_GROUPBY_METHODS for agg in aggmethods)
+    if vectorized:
+        statfxns = aggmethods
+    else:
+        statfxns = []
+        for agg in aggmethods:
+            statfxns.append(partial(
+                utils.stats_with_ignored_values,
+                statfxn=AGG_METHOD_DICT[agg],
+                ignored_value=ignored_value
+            ))
+
+    statistics = [
+        utils.Statistic(col, statfxn, '{}{}'.format(agg[0:3].lower(), col))
+        for (col, agg), statfxn in zip(value_columns, statfxns)
+    ]
+    return statistics, vectorized
+
+
+def _join_wq(monitoring_locations, subcatchments, fields, n_workers=1,
+             persist=True):
+    """ Loads ``fields`` for every monitoring location along with the
+    ID columns (the first two ``fields``) of the subcatchment it is in.
+    Also returns the temporary layer that was created, if any. """
+
+    # associate subcatchment IDs with all of the monitoring locations.
+    # shapefiles in the same coordinate system are joined in memory,
+    # anything else is intersected (and reprojected) with arcpy into a
+    # temporary layer
+    ml_path = backends.find_shapefile(monitoring_locations)
+    sc_path = backends.find_shapefile(subcatchments)
+    if None not in (ml_path, sc_path) and shapefile.same_projection(ml_path, sc_path):
+        raw_array = geometry.join_points_to_polygons(
+            ml_path, sc_path,
+            point_fields=fields[2:],
+            polygon_fields=fields[:2],
+            n_workers=n_workers,
+            persist=persist,
+        )
+        return raw_array, None
+
+    joined = utils.intersect_layers(
+        input_paths=[monitoring_locations, subcatchments],
+        output_path=utils.create_temp_filename("joined_ml_sc", filetype='memory'),
+        how="ALL",
+    )
+    return utils.load_attribute_table(joined, *fields), joined
+
+
+def _aggregate_wq(raw_array, ml_filter, group_cols, statistics, vectorized,
+                  ignored_value):
+    """ Filters the joined monitoring locations and aggregates them
+    within each subcatchment. """
+
+    if ml_filter is None:
+        ml_filter = lambda row: row
+
+    # factor this into load_attribute_table
+    array = numpy.array(filter(ml_filter, raw_array), dtype=raw_array.dtype)
+
+    if vectorized:
+        return utils.sorted_groupby(array, group_cols, statistics,
+                                    ignored_value=ignored_value)
+    return utils.rec_groupby(array, group_cols, *statistics)
+
+
 def _get_wq_fields(layer, prefixes):
     """
     Gets all of the (water quality) fields in a shapefile whose names
@@ -621,7 +1091,8 @@ def aggregate_streams_by_subcatchment(stream_layer, subcatchment_layer,
                                       id_col, ds_col, other_cols,
                                       agg_method="first",
                                       output_layer=None,
-                                      cleanup=True):
+                                      cleanup=True, n_workers=1,
+                                      persist=True):
     """
     Split up stream into segments based on subcatchment borders, and
     then aggregates all of the individual segments within each
@@ -651,6 +1122,14 @@ def aggregate_streams_by_subcatchment(stream_layer, subcatchment_layer,
         Names of the new layer where the results should be saved.
     cleanup : bool, optional
         Toggles the deletion of intermediate files.
+    n_workers : int, optional (1)
+        Number of threads used to split the streams when all of the
+        layers are shapefiles.
+    persist : bool, optional (True)
+        Toggles saving the spatial index of the subcatchments and the
+        pieces of the split streams next to the input shapefiles, so
+        that later calls can reuse them (see
+        :func:`propagator.geometry.aggregate_lines_by_polygons`).
 
     Returns
     -------
@@ -658,6 +1137,18 @@ def aggregate_streams_by_subcatchment(stream_layer, subcatchment_layer,
         Names of the new layer where the results were successfully
         saved.
 
+    Notes
+    -----
+    When the streams and subcatchments are shapefiles that share a
+    coordinate system, and the output is either a shapefile or held in
+    memory (see :class:`propagator.backends.MemoryWorkspace`), the
+    streams are split and aggregated in memory (see
+    :func:`propagator.geometry.aggregate_lines_by_polygons`) instead of
+    with ``arcpy``'s Intersect and Dissolve tools. Unless ``persist``
+    is False, the pieces of the split streams are kept next to
+    ``stream_layer`` and reused until the geometries of either layer
+    change.
+
     Examples
     --------
     >>> import propagator
@@ -682,14 +1173,38 @@ def aggregate_streams_by_subcatchment(stream_layer, subcatchment_layer,
 
     utils.check_fields(subcatchment_layer, id_col, ds_col, *other_cols, should_exist=True)
 
+    stats_tuples = [(col, agg_method) for col in other_cols]
+
+    stream_path = backends.find_shapefile(stream_layer)
+    subcatchment_path = backends.find_shapefile(subcatchment_layer)
+    if backends.is_memory(output_layer):
+        output_path, exists = output_layer, output_layer in backends.MEMORY
+    else:
+        output_path = backends.output_shapefile(output_layer)
+        exists = output_path is not None and shapefile.exists(output_path)
+    if (None not in (stream_path, subcatchment_path, output_path) and
+            shapefile.same_projection(stream_path, subcatchment_path)):
+        if exists and not backends.get_backend().env.overwriteOutput:
+            raise ValueError("{} already exists".format(output_layer))
+
+        geometry.aggregate_lines_by_polygons(
+            line_path=stream_path,
+            polygon_path=subcatchment_path,
+            output_path=output_path,
+            by_fields=[id_col, ds_col],
+            field_stat_tuples=stats_tuples,
+            n_workers=n_workers,
+            persist=persist,
+        )
+        utils.SCHEMA_CACHE.invalidate(output_layer)
+        return output_layer
+
     intersected = utils.intersect_layers(
         input_paths=[stream_layer, subcatchment_layer],
-        output_path=utils.create_temp_filename(output_layer, filetype='shape'),
+        output_path=utils.create_temp_filename(output_layer, filetype='memory'),
         how="NO_FID",
     )
 
-    stats_tuples = [(col, agg_method) for col in other_cols]
-
     final = utils.aggregate_geom(
         layerpath=intersected,
         by_fields=[id_col, ds_col],
@@ -706,7 +1221,7 @@ def aggregate_streams_by_subcatchment(stream_layer, subcatchment_layer,
 
 
 def collect_upstream_attributes(subcatchments_table, target_subcatchments,
-                                id_col, ds_col, preserved_fields):
+                                id_col, ds_col, preserved_fields, graph=None):
     """
     Identifies all upstream subcatchment IDs of each target
     subcatchment.
@@ -723,6 +1238,9 @@ def collect_upstream_attributes(subcatchments_table, target_subcatchments,
         subcatchment ID and downstream subcatchment ID, respectively.
     preserved_fields : list
         List of column IDs that will be kept in output table.
+    graph : topology.WatershedGraph, optional
+        The compiled topology of ``subcatchments_table``. If not
+        provided, one is built from ``id_col`` and ``ds_col``.
 
     Returns
     -------
@@ -738,10 +1256,13 @@ def collect_upstream_attributes(subcatchments_table, target_subcatchments,
 
     src_array = None
 
+    graph = _compile_graph(subcatchments_table, id_col, ds_col, graph=graph)
+    ordered = graph.reorder(subcatchments_table)
     for row in target_subcatchments:
         upstream_subcatchments = trace_upstream(
             subcatchments_table, row[id_col],
-            id_col=id_col, ds_col=ds_col, include_base=True
+            id_col=id_col, ds_col=ds_col, include_base=True,
+            graph=graph, ordered=ordered
         )
 
         if upstream_subcatchments.shape[0] > 0:
@@ -758,3 +1279,546 @@ def collect_upstream_attributes(subcatchments_table, target_subcatchments,
                 src_array.extend(_src_array.copy().tolist())
 
     return numpy.array(src_array, dtype=template)
+
+
+@utils.update_status()
+def accumulate_upstream(subcatchments_table, target_subcatchments,
+                        id_col, ds_col, stats, ignored_value=None,
+                        graph=None, n_workers=1):
+    """
+    Summarizes the properties of everything upstream of (and
+    including) each target subcatchment.
+
+    The result is the same as aggregating the output of
+    :func:`collect_upstream_attributes` with :func:`utils.rec_groupby`,
+    but without building an array of every upstream row for every
+    target.
+
+    Parameters
+    ----------
+    subcatchments_table : numpy.ndarray
+        List of all subcatchments
+    target_subcatchments : numpy.ndarray
+        List of subcatchments whose upstream contributing subcatchments
+        will be summarized.
+    id_col, ds_col : str
+        Names of the columns in ``subcatchment_table`` that contain the
+        subcatchment ID and downstream subcatchment ID, respectively.
+    stats : list of utils.Statistic
+        The aggregations to perform. The ``aggfxn`` of each must be the
+        name of the method (e.g., "sum") instead of a function. For a
+        ``"weighted_average"``, ``srccol`` is a ``[value, weight]``
+        pair of column names.
+    ignored_value : float, optional
+        Values in ``subcatchments_table`` that should be ignored. If
+        every upstream value is ignored, the result is
+        ``ignored_value``.
+    graph : topology.WatershedGraph, optional
+        The compiled topology of ``subcatchments_table``. If not
+        provided, one is built from ``id_col`` and ``ds_col``.
+    n_workers : int, optional (1)
+        Number of processes among which the independent drainage
+        basins are split (see :func:`propagate_scores`). The result is
+        the same as with a single process.
+
+    Returns
+    -------
+    aggregated : numpy.recarray
+        One row for each unique target subcatchment with any upstream
+        subcatchments, sorted by ID. The columns are ``id_col`` and the
+        ``rescol`` of each statistic.
+
+    Notes
+    -----
+    Methods in ``DECOMPOSABLE_METHODS`` are computed for every
+    subcatchment at once with a single sweep from the top of the
+    watershed down to the outlets, costing O(n) numpy work plus one
+    python-level step per level of the watershed. All other methods
+    (e.g., median and percentiles) are computed one target at a time
+    from that target's upstream values only, so memory use is bounded
+    by the largest upstream set instead of the sum of all of them.
+
+    See also
+    --------
+    collect_upstream_attributes
+    utils.rec_groupby
+
+    """
+
+    graph = _compile_graph(subcatchments_table, id_col, ds_col, graph=graph)
+    if n_workers > 1 and graph.outlets.shape[0] > 1:
+        return _accumulate_by_basin(subcatchments_table, target_subcatchments, id_col, ds_col,
+                                    stats, ignored_value, graph, n_workers)
+
+    target_ids = numpy.unique(target_subcatchments[id_col])
+    codes = graph.codes(target_ids)
+
+    # targets that are not subcatchments are pseudo-catchments (e.g.,
+    # "Ocean") that collect everything that drains into them.
+    upstream_rows = {}
+    for n in numpy.flatnonzero(codes < 0):
+        bases = numpy.flatnonzero(subcatchments_table[ds_col] == target_ids[n])
+        if bases.shape[0] > 0:
+            upstream_rows[n] = graph.upstream(bases, include_base=True)
+
+    keep = codes >= 0
+    keep[list(upstream_rows.keys())] = True
+
+    columns = [target_ids[keep]]
+    for stat in stats:
+        method = stat.aggfxn.lower()
+        if numpy.isscalar(stat.srccol):
+            values = subcatchments_table[stat.srccol]
+        else:
+            values = subcatchments_table[list(stat.srccol)]
+
+        results = numpy.empty(target_ids.shape[0], dtype=object)
+        if method in DECOMPOSABLE_METHODS:
+            swept = _sweep_upstream(graph, values, method, ignored_value)
+            results[codes >= 0] = swept[codes[codes >= 0]].tolist()
+        else:
+            # each upstream set is a contiguous slice of the reordered
+            # values, so nothing is copied to compute the statistic.
+            ordered = graph.reorder(values)
+            for n in numpy.flatnonzero(codes >= 0):
+                upstream = ordered[graph.upstream_slice(codes[n], include_base=True)]
+                results[n] = _upstream_stat(upstream, method, ignored_value)
+
+        for n, rows in upstream_rows.items():
+            results[n] = _upstream_stat(values[rows], method, ignored_value)
+
+        columns.append(numpy.array(results[keep].tolist()))
+
+    names = [id_col] + [stat.rescol for stat in stats]
+    return numpy.rec.fromarrays(columns, names=names)
+
+
+def _accumulate_partition(job):
+    subcatchments_table, targets, id_col, ds_col, stats, ignored_value = job
+    return accumulate_upstream(subcatchments_table, targets, id_col, ds_col, stats,
+                               ignored_value=ignored_value)
+
+
+def _accumulate_by_basin(subcatchments_table, target_subcatchments, id_col, ds_col,
+                         stats, ignored_value, graph, n_workers):
+    """
+    Runs :func:`accumulate_upstream` separately on groups of whole
+    drainage basins in worker processes, and reassembles the results
+    in the order of the serial computation.
+    """
+
+    target_ids = numpy.unique(target_subcatchments[id_col])
+    codes = graph.codes(target_ids)
+
+    parts = graph.partition(n_workers)
+    part_of = numpy.empty(graph.size, dtype=int)
+    for n, rows in enumerate(parts):
+        part_of[rows] = n
+    target_parts = numpy.where(codes >= 0, part_of[codes], -1)
+
+    jobs = [
+        (subcatchments_table[rows], numpy.rec.fromarrays([target_ids[target_parts == n]], names=[id_col]),
+         id_col, ds_col, stats, ignored_value)
+        for n, rows in enumerate(parts)
+    ]
+    results = _map_partitions(_accumulate_partition, jobs, n_workers)
+
+    # pseudo-catchments (e.g., "Ocean") can collect several basins
+    pseudo = target_ids[codes < 0]
+    if pseudo.shape[0] > 0:
+        results.append(accumulate_upstream(
+            subcatchments_table, numpy.rec.fromarrays([pseudo], names=[id_col]),
+            id_col, ds_col, stats, ignored_value=ignored_value, graph=graph
+        ))
+
+    ids = numpy.hstack([result[id_col] for result in results])
+    order = numpy.argsort(ids, kind='mergesort')
+    columns = [ids[order]]
+    for stat in stats:
+        values = [v for result in results for v in result[stat.rescol].tolist()]
+        columns.append(numpy.array([values[n] for n in order]))
+
+    names = [id_col] + [stat.rescol for stat in stats]
+    return numpy.rec.fromarrays(columns, names=names)
+
+
+def _upstream_stat(values, method, ignored_value):
+    """
+    Computes a single statistic from an array of upstream values.
+    ``values`` is a two-field record array for weighted averages.
+    """
+
+    if values.dtype.names is None:
+        key = values
+    else:
+        key = values[values.dtype.names[0]]
+
+    if ignored_value is not None:
+        values = values[key != ignored_value]
+
+    if values.shape[0] == 0:
+        return ignored_value
+    elif method == 'count':
+        return values.shape[0]
+    return AGG_METHOD_DICT[method](values)
+
+
+def _sweep_upstream(graph, values, method, ignored_value):
+    """
+    Computes a decomposable statistic of everything upstream of (and
+    including) every subcatchment at once. The partial results of each
+    level of the watershed are folded into their downstream neighbors,
+    starting at the top.
+    """
+
+    partials = _own_partials(values, method, ignored_value)
+    _fold_upstream(graph, method, *partials)
+    return _finish_partials(method, *partials, ignored_value=ignored_value)
+
+
+def _own_partials(values, method, ignored_value):
+    """
+    The contribution of each subcatchment, by itself, to a decomposable
+    statistic as a (total, count, weight) triple of arrays.
+    """
+
+    if values.dtype.names is None:
+        weights = numpy.ones(values.shape[0])
+    else:
+        value_col, weight_col = values.dtype.names[:2]
+        values, weights = values[value_col], values[weight_col]
+    values = numpy.asarray(values, dtype=float)
+    weights = numpy.asarray(weights, dtype=float)
+
+    if ignored_value is None:
+        valid = numpy.ones(values.shape[0], dtype=bool)
+    else:
+        valid = values != ignored_value
+
+    if method == 'minimum':
+        total = numpy.where(valid, values, numpy.inf)
+    elif method == 'maximum':
+        total = numpy.where(valid, values, -numpy.inf)
+    else:
+        total = numpy.where(valid, values * weights, 0.0)
+
+    count = valid.astype(float)
+    weight = numpy.where(valid, weights, 0.0)
+    return total, count, weight
+
+
+def _combine_partials(method):
+    if method == 'minimum':
+        return numpy.minimum
+    elif method == 'maximum':
+        return numpy.maximum
+    return numpy.add
+
+
+def _fold_upstream(graph, method, total, count, weight):
+    """ Folds the partial results of every subcatchment into its
+    downstream neighbors, in place. """
+
+    combine = _combine_partials(method)
+
+    # every subcatchment in a level drains into the level below it.
+    for level in reversed(graph.levels[1:]):
+        parents = graph.parents[level]
+        combine.at(total, parents, total[level])
+        numpy.add.at(count, parents, count[level])
+        numpy.add.at(weight, parents, weight[level])
+
+
+def _finish_partials(method, total, count, weight, ignored_value):
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        if method == 'count':
+            result = count
+        elif method in ('average', 'weighted_average'):
+            result = total / weight
+        else:
+            result = total
+
+    if ignored_value is not None:
+        result = numpy.where(count > 0, result, ignored_value)
+    return result
+
+
+def _fold_path(parent_positions, method, total, count, weight):
+    """ Folds partial results along a path of subcatchments that each
+    come before their downstream neighbor. ``parent_positions`` are the
+    positions of those neighbors in the path (-1 where it leaves). """
+
+    combine = {'minimum': min, 'maximum': max}.get(method, operator.add)
+    total, count, weight = total.tolist(), count.tolist(), weight.tolist()
+    for n, parent in enumerate(parent_positions):
+        if parent >= 0:
+            total[parent] = combine(total[parent], total[n])
+            count[parent] += count[n]
+            weight[parent] += weight[n]
+    return numpy.array(total), numpy.array(count), numpy.array(weight)
+
+
+class UpstreamAccumulator(object):
+    """
+    Summaries of everything upstream of each subcatchment (see
+    :func:`accumulate_upstream`) that are kept up to date as the
+    attributes of individual subcatchments are edited.
+
+    Parameters
+    ----------
+    subcatchments_table : numpy.ndarray
+        List of all subcatchments. A copy is kept and edited.
+    id_col, ds_col : str
+        Names of the columns in ``subcatchment_table`` that contain the
+        subcatchment ID and downstream subcatchment ID, respectively.
+    stats : list of utils.Statistic
+        The aggregations to perform, as in :func:`accumulate_upstream`.
+    ignored_value : float, optional
+        Values in ``subcatchments_table`` that should be ignored.
+    graph : topology.WatershedGraph, optional
+        The compiled topology of ``subcatchments_table``. If not
+        provided, one is built from ``id_col`` and ``ds_col``.
+
+    Notes
+    -----
+    An edit can only change the results on the path from the edited
+    subcatchment to its outlet (see
+    :meth:`topology.WatershedGraph.downstream`), so :meth:`update`
+    only visits those subcatchments:
+
+    * for sums, counts, and (weighted) averages the change in the
+      subcatchment's own contribution is added to the running totals
+      along the path.
+    * minimums and maximums are recomputed along the path from each
+      subcatchment's own value and the results of its upstream
+      neighbors.
+    * all other methods are recomputed by :meth:`results` from the
+      upstream values of the requested subcatchments only.
+
+    The running sums pick up floating point round-off with every edit.
+    Build a new accumulator after a very large number of edits if that
+    matters.
+
+    Examples
+    --------
+    >>> from propagator import analysis, utils
+    >>> stats = [utils.Statistic('Imp', 'sum', 'SUMImp')]
+    >>> acc = analysis.UpstreamAccumulator(table, 'ID', 'DS_ID', stats)
+    >>> edits = numpy.array([('C1', 42.0)], dtype=[('ID', '<U5'), ('Imp', float)])
+    >>> changed = acc.update(edits)
+    >>> acc.results(changed)
+
+    """
+
+    def __init__(self, subcatchments_table, id_col, ds_col, stats,
+                 ignored_value=None, graph=None):
+        self.graph = _compile_graph(subcatchments_table, id_col, ds_col, graph=graph)
+        self.table = subcatchments_table.copy()
+        self.id_col = id_col
+        self.ds_col = ds_col
+        self.stats = list(stats)
+        self.ignored_value = ignored_value
+
+        # folded (total, count, weight) of the decomposable statistics,
+        # and the other statistics' values in depth-first order
+        self._partials = {}
+        self._ordered = {}
+        for stat in self.stats:
+            method = stat.aggfxn.lower()
+            if method in DECOMPOSABLE_METHODS:
+                partials = _own_partials(self._values(stat), method, ignored_value)
+                _fold_upstream(self.graph, method, *partials)
+                self._partials[stat.rescol] = partials
+            else:
+                self._ordered[stat.rescol] = self.graph.reorder(self._values(stat))
+
+    def _values(self, stat, rows=None):
+        table = self.table if rows is None else self.table[rows]
+        if numpy.isscalar(stat.srccol):
+            return table[stat.srccol]
+        return table[list(stat.srccol)]
+
+    def update(self, edits):
+        """
+        Applies new attribute values to some of the subcatchments.
+
+        Parameters
+        ----------
+        edits : numpy.recarray
+            The new values, with an ``id_col`` and any of the source
+            columns of the statistics.
+
+        Returns
+        -------
+        changed : numpy.array
+            The IDs of the subcatchments whose results may have
+            changed, and of any pseudo-catchments (e.g., "Ocean") that
+            they drain into.
+
+        Raises
+        ------
+        ValueError
+            When an edited subcatchment does not exist or is edited
+            more than once, or when ``edits`` has a field that is not a
+            source column (e.g., ``ds_col``, since the topology of an
+            accumulator cannot change).
+
+        """
+
+        columns = [name for name in edits.dtype.names if name != self.id_col]
+        if self.ds_col in columns:
+            raise ValueError("the downstream IDs ('{}') cannot be edited; build a new "
+                             "accumulator for the new topology".format(self.ds_col))
+
+        sources = set()
+        for stat in self.stats:
+            sources.update(numpy.atleast_1d(stat.srccol).tolist())
+        unknown = [name for name in columns if name not in sources]
+        if len(unknown) > 0:
+            raise ValueError("fields {} are not accumulated".format(unknown))
+
+        codes = self.graph.codes(edits[self.id_col])
+        if (codes < 0).any():
+            raise ValueError("subcatchments {} do not exist".format(
+                edits[self.id_col][codes < 0].tolist()))
+        if numpy.unique(codes).shape[0] != codes.shape[0]:
+            raise ValueError("each subcatchment can only be edited once")
+
+        stats = [
+            stat for stat in self.stats
+            if set(numpy.atleast_1d(stat.srccol).tolist()) & set(columns)
+        ]
+
+        before = {}
+        for stat in stats:
+            method = stat.aggfxn.lower()
+            if method in DECOMPOSABLE_METHODS:
+                before[stat.rescol] = _own_partials(self._values(stat, codes), method,
+                                                    self.ignored_value)
+
+        for name in columns:
+            self.table[name][codes] = edits[name]
+
+        # every subcatchment on the path comes before its downstream
+        # neighbor, which is therefore finished after all of its
+        # upstream neighbors on the path.
+        path = self.graph.downstream(codes, include_base=True)
+        position = numpy.empty(self.graph.size, dtype=int)
+        position[path] = numpy.arange(path.shape[0])
+        parents = self.graph.parents[path]
+        parent_positions = numpy.where(parents >= 0, position[parents], -1).tolist()
+
+        for stat in stats:
+            method = stat.aggfxn.lower()
+            if method in ('minimum', 'maximum'):
+                self._refold(stat, method, path, parent_positions)
+            elif method in DECOMPOSABLE_METHODS:
+                after = _own_partials(self._values(stat, codes), method, self.ignored_value)
+                delta = [numpy.zeros(path.shape[0]) for _ in range(3)]
+                for change, new, old in zip(delta, after, before[stat.rescol]):
+                    change[position[codes]] = new - old
+                delta = _fold_path(parent_positions, method, *delta)
+                for running, change in zip(self._partials[stat.rescol], delta):
+                    running[path] += change
+            else:
+                self._ordered[stat.rescol][self.graph.preorder_rank[codes]] = self._values(stat, codes)
+
+        outlets = path[self.graph.parents[path] < 0]
+        pseudo = numpy.unique(self.table[self.ds_col][outlets])
+        return numpy.hstack([self.graph.ids[path], pseudo])
+
+    def _refold(self, stat, method, path, parent_positions):
+        """ Recomputes a minimum or maximum along ``path`` from the
+        subcatchments' own values and the (unchanged) results of their
+        upstream neighbors that are not on the path. """
+
+        graph = self.graph
+        partials = self._partials[stat.rescol]
+        own = _own_partials(self._values(stat, path), method, self.ignored_value)
+
+        # the upstream neighbors of every subcatchment on the path
+        starts = graph.child_ptr[path]
+        lengths = graph.child_ptr[path + 1] - starts
+        offsets = numpy.cumsum(lengths) - lengths
+        children = graph.child_idx[
+            numpy.repeat(starts - offsets, lengths) + numpy.arange(lengths.sum())
+        ]
+        owners = numpy.repeat(numpy.arange(path.shape[0]), lengths)
+
+        on_path = numpy.zeros(graph.size, dtype=bool)
+        on_path[path] = True
+        off_path = ~on_path[children]
+        owners, children = owners[off_path], children[off_path]
+
+        _combine_partials(method).at(own[0], owners, partials[0][children])
+        numpy.add.at(own[1], owners, partials[1][children])
+        numpy.add.at(own[2], owners, partials[2][children])
+
+        for running, result in zip(partials, _fold_path(parent_positions, method, *own)):
+            running[path] = result
+
+    def results(self, target_ids=None):
+        """
+        The current summaries of some (by default all) subcatchments.
+
+        Parameters
+        ----------
+        target_ids : array-like, optional
+            The IDs of the subcatchments (or pseudo-catchments) to
+            summarize, such as those returned by :meth:`update`.
+
+        Returns
+        -------
+        aggregated : numpy.recarray
+            The same as :func:`accumulate_upstream` with the current
+            attributes and ``target_ids`` as the targets.
+
+        """
+
+        if target_ids is None:
+            target_ids = self.graph.ids
+        target_ids = numpy.unique(target_ids)
+        codes = self.graph.codes(target_ids)
+
+        # pseudo-catchments collect whole basins through their outlets
+        outlets = self.graph.outlets
+        bases = {}
+        for n in numpy.flatnonzero(codes < 0):
+            found = outlets[self.table[self.ds_col][outlets] == target_ids[n]]
+            if found.shape[0] > 0:
+                bases[n] = found
+
+        keep = codes >= 0
+        keep[list(bases.keys())] = True
+        found = numpy.flatnonzero(codes >= 0)
+
+        columns = [target_ids[keep]]
+        for stat in self.stats:
+            method = stat.aggfxn.lower()
+            results = numpy.empty(target_ids.shape[0], dtype=object)
+            if method in DECOMPOSABLE_METHODS:
+                total, count, weight = self._partials[stat.rescol]
+                nodes = codes[found]
+                results[found] = _finish_partials(method, total[nodes], count[nodes], weight[nodes],
+                                                  self.ignored_value).tolist()
+                combine = _combine_partials(method)
+                for n, rows in bases.items():
+                    results[n] = _finish_partials(
+                        method, combine.reduce(total[rows], keepdims=True),
+                        count[rows].sum(keepdims=True), weight[rows].sum(keepdims=True),
+                        self.ignored_value
+                    ).tolist()[0]
+            else:
+                ordered = self._ordered[stat.rescol]
+                for n in found:
+                    upstream = ordered[self.graph.upstream_slice(codes[n], include_base=True)]
+                    results[n] = _upstream_stat(upstream, method, self.ignored_value)
+                for n, rows in bases.items():
+                    upstream = self.graph.upstream(rows, include_base=True)
+                    results[n] = _upstream_stat(self._values(stat, upstream), method,
+                                                self.ignored_value)
+
+            columns.append(numpy.array(results[keep].tolist()))
+
+        names = [self.id_col] + [stat.rescol for stat in self.stats]
+        return numpy.rec.fromarrays(columns, names=names)
@@ -0,0 +1,895 @@
+""" Interchangeable geoprocessing backends for ``propagator``.
+
+The table I/O used by the core pipeline (loading and updating
+attribute tables, adding and populating fields, copying, counting, and
+deleting layers) goes through a backend object. ``ArcpyBackend`` wraps
+Esri's ``arcpy`` library. ``NumpyBackend`` reads and writes shapefiles
+directly with :mod:`propagator.shapefile` so that the pipeline can run
+on machines without ArcGIS. With either backend, layers named
+``memory:<name>`` are held in memory as numpy arrays (see
+:class:`MemoryWorkspace`) so intermediate results never touch the disk.
+
+Released under the BSD 3-clause license (see LICENSE file for more info)
+
+"""
+
+
+import os
+import shutil
+import itertools
+import tempfile
+from functools import wraps, partial
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy
+
+try:
+    import arcpy
+except ImportError:  # pragma: no cover
+    arcpy = None
+
+from propagator import shapefile
+
+
+class Environment(object):
+    """ Minimal stand-in for ``arcpy.env`` used by the backends that
+    do not rely on ``arcpy``.
+
+    Attributes
+    ----------
+    workspace : str or None
+        Directory against which relative paths are resolved.
+    overwriteOutput : bool
+        Whether existing outputs can be overwritten.
+
+    """
+
+    def __init__(self, workspace=None, overwriteOutput=False):
+        self.workspace = workspace
+        self.overwriteOutput = overwriteOutput
+
+
+def find_shapefile(layer, workspace=None):
+    """
+    Full path to ``layer`` if it is a shapefile on disk.
+
+    Parameters
+    ----------
+    layer : str
+        Path or name of the layer.
+    workspace : str, optional
+        Directory against which relative paths are resolved. Defaults
+        to the workspace of the current backend.
+
+    Returns
+    -------
+    path : str or None
+        The path to the .shp file, or None if ``layer`` is not a
+        shapefile (e.g., a feature class in a geodatabase or a layer
+        object).
+
+    """
+
+    if not hasattr(layer, 'lower'):
+        return None
+
+    if workspace is None:
+        workspace = get_backend().env.workspace
+
+    path = layer
+    if not os.path.isabs(path) and workspace:
+        path = os.path.join(workspace, path)
+    if os.path.splitext(path)[1] == '':
+        path += '.shp'
+    if path.lower().endswith('.shp') and os.path.exists(path):
+        return path
+    return None
+
+
+def geodatabase_marker(path):
+    """
+    The file that changes whenever the file geodatabase containing
+    ``path`` is edited.
+
+    Parameters
+    ----------
+    path : str
+        Full path to a feature class or table in a file geodatabase,
+        possibly within a feature dataset.
+
+    Returns
+    -------
+    marker : str or None
+        The geodatabase's ``timestamps`` file, or the geodatabase
+        folder itself if it does not have one. None if ``path`` is not
+        in an existing file geodatabase.
+
+    Notes
+    -----
+    The geodatabase is found from ``path`` alone and only the marker
+    is checked on disk, so this is cheap even on network shares. Any
+    edit to the geodatabase changes the marker, not only edits to the
+    feature class at ``path``.
+
+    """
+
+    folder = path
+    while not folder.lower().endswith('.gdb'):
+        parent = os.path.dirname(folder)
+        if parent == folder:
+            return None
+        folder = parent
+
+    timestamps = os.path.join(folder, 'timestamps')
+    if os.path.isfile(timestamps):
+        return timestamps
+    elif os.path.isdir(folder):
+        return folder
+    return None
+
+
+def output_shapefile(layer, workspace=None):
+    """
+    Full path to ``layer`` if it would be written as a shapefile
+    (i.e., it has a .shp extension and its folder exists).
+
+    Parameters
+    ----------
+    layer : str
+        Path or name of the new layer.
+    workspace : str, optional
+        Directory against which relative paths are resolved. Defaults
+        to the workspace of the current backend.
+
+    Returns
+    -------
+    path : str or None
+
+    """
+
+    if not hasattr(layer, 'lower') or not layer.lower().endswith('.shp'):
+        return None
+
+    if workspace is None:
+        workspace = get_backend().env.workspace
+
+    path = layer
+    if not os.path.isabs(path) and workspace:
+        path = os.path.join(workspace, path)
+    if os.path.isdir(os.path.dirname(path) or os.curdir):
+        return path
+    return None
+
+
+def _update_shapefile(path, index, id_column, orig_columns, new_columns):
+    """ Writes whole columns of ``index.array`` into the rows of the
+    shapefile at ``path`` with matching IDs, in place. """
+
+    with shapefile.DbfTable(path) as dbf:
+        ids = dbf.column(id_column)
+
+    positions = index.positions(ids.tolist())
+    rows = numpy.flatnonzero(positions >= 0)
+    matches = positions[rows]
+
+    columns = OrderedDict()
+    for orig, new in zip(orig_columns, new_columns):
+        columns[orig] = index.array[new][matches]
+
+    shapefile.update_dbf(path, columns, rows=rows)
+    return path
+
+
+# layers whose names start with this are held in memory (see `MEMORY`)
+MEMORY_PREFIX = 'memory:'
+
+
+def is_memory(layer):
+    """ Checks if ``layer`` names a dataset in memory (i.e., it starts
+    with ``MEMORY_PREFIX``). """
+
+    return hasattr(layer, 'lower') and layer.lower().startswith(MEMORY_PREFIX)
+
+
+def arcpy_path(layer):
+    """ The name under which ``arcpy``'s tools know ``layer``. Datasets
+    in memory are kept in ``arcpy``'s own ``in_memory`` workspace when
+    ``arcpy`` creates them (e.g., with :func:`utils.intersect_layers`).
+    """
+
+    if is_memory(layer):
+        return os.path.join('in_memory', layer[len(MEMORY_PREFIX):])
+    return layer
+
+
+def _geometry_dtype(field):
+    if field == 'FID':
+        return numpy.dtype('<i4')
+    elif field in ('SHAPE@AREA', 'SHAPE@LENGTH'):
+        return numpy.dtype('<f8')
+    elif field in ('Shape', 'SHAPE@XY'):
+        return numpy.dtype(('<f8', 2))
+    return None
+
+
+def _geometry_column(shapes, field):
+    if field == 'SHAPE@AREA':
+        return [shapefile.shape_area(s) for s in shapes]
+    elif field == 'SHAPE@LENGTH':
+        return [shapefile.shape_length(s) for s in shapes]
+    return [shapefile.shape_centroid(s) for s in shapes]
+
+
+def _add_geometry(table, fields, read_shapes, start=0):
+    """ Adds the geometry fields (see ``NumpyBackend``) in ``fields``
+    to ``table``. ``read_shapes(start, stop)`` returns the geometries
+    of the rows of ``table``. """
+
+    if len(table.dtype.names) == len(fields):
+        return table
+
+    # only read the geometries when they are needed
+    stop = start + table.shape[0]
+    shapes = None
+    if any(f not in table.dtype.names and f != 'FID' for f in fields):
+        shapes = read_shapes(start, stop)
+
+    dtype = []
+    for f in fields:
+        geom_dtype = _geometry_dtype(f)
+        dtype.append((str(f), table.dtype[f] if geom_dtype is None else geom_dtype))
+
+    array = numpy.empty(table.shape[0], dtype=dtype)
+    for f in fields:
+        if f in table.dtype.names:
+            array[f] = table[f]
+        elif f == 'FID':
+            array[f] = numpy.arange(start, stop)
+        else:
+            array[f] = _geometry_column(shapes, f)
+    return array
+
+
+class MemoryDataset(object):
+    """
+    A layer held in memory instead of in a shapefile.
+
+    Parameters
+    ----------
+    table : numpy.ndarray
+        Structured array of the attributes, one row per geometry.
+        Columns are stored with the dtypes that reading them from a
+        .dbf file would give (see :func:`shapefile.field_dtype`).
+    fields : list of shapefile.DbfField, optional
+        The definitions of the fields. Inferred from the dtype of
+        ``table`` when not provided.
+    shapetype : int, optional
+        The shape type of the layer (e.g., ``shapefile.POLYLINE``).
+    shapes : list of shapefile.Shape, optional
+        The geometries. Every row is a null shape if not provided.
+    projection : str, optional
+        The well-known text of the coordinate system.
+    encoding : str, optional
+        The text encoding used when the layer is saved as a shapefile.
+
+    """
+
+    def __init__(self, table, fields=None, shapetype=shapefile.NULL, shapes=None,
+                 projection=None, encoding=shapefile.DEFAULT_ENCODING):
+        if fields is None:
+            fields = [shapefile.infer_field(name, table.dtype[name]) for name in table.dtype.names]
+        if shapes is None:
+            shapes = [shapefile.Shape(shapefile.NULL, numpy.zeros(0, dtype=int),
+                                      numpy.zeros((0, 2)), None)] * table.shape[0]
+        if len(shapes) != table.shape[0]:
+            raise ValueError("the number of shapes and rows are different")
+
+        self.fields = list(fields)
+        self.table = numpy.empty(table.shape[0], dtype=[
+            (str(f.name), shapefile.field_dtype(f)) for f in self.fields
+        ])
+        for f in self.fields:
+            self.table[f.name] = table[f.name]
+        self.shapetype = shapetype
+        self.shapes = list(shapes)
+        self.projection = projection
+        self.encoding = encoding
+
+    def __len__(self):
+        return self.table.shape[0]
+
+    def copy(self):
+        return MemoryDataset(self.table.copy(), self.fields, self.shapetype, self.shapes,
+                             self.projection, self.encoding)
+
+    @classmethod
+    def from_shapefile(cls, path):
+        """ Reads a whole shapefile into memory. """
+
+        fields, _, _, _ = shapefile.read_dbf_header(path)
+        shapetype, _ = shapefile.read_shp_header(path)
+        return cls(shapefile.read_dbf(path), fields, shapetype, shapefile.read_shapes(path),
+                   shapefile.read_projection(path), shapefile.read_encoding(path))
+
+    def to_shapefile(self, path):
+        """ Writes the dataset as a shapefile. """
+
+        shapefile.write_shapes(path, self.shapetype, self.shapes)
+        with open(shapefile._sidecar(path, '.cpg'), 'w') as cpg:
+            cpg.write(self.encoding)
+        shapefile.write_dbf(path, self.table, fields=self.fields, encoding=self.encoding)
+        if self.projection is not None:
+            with open(shapefile._sidecar(path, '.prj'), 'w') as prj:
+                prj.write(self.projection)
+        return path
+
+
+class MemoryWorkspace(object):
+    """
+    Datasets that are named ``memory:<name>`` and held in memory as
+    numpy arrays instead of written to disk.
+
+    Both backends send the table I/O of these datasets here, so
+    intermediate results (see :func:`utils.create_temp_filename`) can
+    be loaded, updated, copied, and deleted like shapefiles without
+    ever touching the disk. Names are not case-sensitive.
+
+    Examples
+    --------
+    >>> from propagator import backends, utils
+    >>> utils.copy_layer('subcatchments.shp', 'memory:subcatchments')
+    >>> utils.load_attribute_table('memory:subcatchments', 'CatchID')
+    >>> utils.copy_layer('memory:subcatchments', 'subcatchments_copy.shp')
+    >>> backends.MEMORY.delete('memory:subcatchments')
+
+    """
+
+    def __init__(self):
+        self.datasets = {}
+
+    def __len__(self):
+        return len(self.datasets)
+
+    def __contains__(self, layer):
+        return is_memory(layer) and self._key(layer) in self.datasets
+
+    @staticmethod
+    def _key(layer):
+        if not is_memory(layer):
+            raise ValueError("{} is not a dataset in memory".format(layer))
+        return layer[len(MEMORY_PREFIX):].lower()
+
+    def get(self, layer):
+        """ The :class:`MemoryDataset` named ``layer``. """
+
+        if layer not in self:
+            raise ValueError("{} does not exist".format(layer))
+        return self.datasets[self._key(layer)]
+
+    def put(self, layer, dataset, overwrite=True):
+        """ Saves ``dataset`` (a :class:`MemoryDataset`) as ``layer``. """
+
+        if layer in self and not overwrite:
+            raise ValueError("{} already exists".format(layer))
+        self.datasets[self._key(layer)] = dataset
+        return layer
+
+    def clear(self):
+        """ Deletes every dataset. """
+        self.datasets.clear()
+
+    def get_field_names(self, layerpath):
+        return list(NumpyBackend.GEOMETRY_FIELDS) + [f.name for f in self.get(layerpath).fields]
+
+    def _read(self, layer, fields, start=0, stop=None):
+        """ Copies a range of rows of the attribute table, like
+        :meth:`shapefile.DbfTable.read`, and adds the geometry fields.
+        """
+
+        dataset = self.get(layer)
+        dbf_fields = [f for f in fields if _geometry_dtype(f) is None]
+        missing = [name for name in dbf_fields if name not in dataset.table.dtype.names]
+        if len(missing) > 0:
+            raise ValueError('fields {} are not in {}'.format(missing, layer))
+
+        rows = dataset.table[start:stop]
+        table = numpy.empty(rows.shape[0], dtype=[
+            (str(name), dataset.table.dtype[name]) for name in dbf_fields
+        ])
+        for name in dbf_fields:
+            table[name] = rows[name]
+        return _add_geometry(table, fields, lambda a, b: dataset.shapes[a:b], start=start)
+
+    def load_attribute_table(self, input_path, fields):
+        return self._read(input_path, fields)
+
+    def iter_attribute_table(self, input_path, fields, chunksize):
+        for start in range(0, self.count_features(input_path), chunksize):
+            yield self._read(input_path, fields, start, start + chunksize)
+
+    def update_attribute_table(self, layerpath, index, id_column,
+                               orig_columns, new_columns):
+        table = self.get(layerpath).table
+        positions = index.positions(table[id_column].tolist())
+        rows = numpy.flatnonzero(positions >= 0)
+        matches = positions[rows]
+        for orig, new in zip(orig_columns, new_columns):
+            table[orig][rows] = index.array[new][matches]
+        return layerpath
+
+    def add_field(self, table, field_name, field_type, **field_opts):
+        dataset = self.get(table)
+        if field_name in [f.name for f in dataset.fields]:
+            return table
+
+        fieldtype, size, decimals = NumpyBackend.FIELD_TYPES[field_type.upper()]
+        size = field_opts.get('field_length') or field_opts.get('field_precision') or size
+        decimals = field_opts.get('field_scale', decimals)
+        field = shapefile.DbfField(field_name, fieldtype, size, decimals)
+
+        new = numpy.zeros(len(dataset), dtype=dataset.table.dtype.descr + [
+            (str(field_name), shapefile.field_dtype(field))
+        ])
+        for name in dataset.table.dtype.names:
+            new[name] = dataset.table[name]
+        dataset.table = new
+        dataset.fields.append(field)
+        return table
+
+    def populate_field(self, table, value_fxn, fields):
+        array = self.load_attribute_table(table, fields)
+        columns = [array[f].tolist() for f in fields]
+        values = [value_fxn(list(row)) for row in zip(*columns)]
+        return self.write_columns(table, {fields[-1]: values})
+
+    def write_columns(self, table, columns):
+        dataset = self.get(table)
+        missing = [name for name in columns if name not in dataset.table.dtype.names]
+        if len(missing) > 0:
+            raise ValueError('fields {} are not in {}'.format(missing, table))
+
+        for name in columns:
+            dataset.table[name] = columns[name]
+        return table
+
+    def copy_layer(self, existing_layer, new_layer, resolve, overwrite=False):
+        """ Copies a dataset in memory or a shapefile (found with
+        ``resolve(path)``) into memory, or a dataset in memory into a
+        shapefile. """
+
+        if existing_layer in self:
+            dataset = self.get(existing_layer).copy()
+        else:
+            dataset = MemoryDataset.from_shapefile(resolve(existing_layer))
+
+        if is_memory(new_layer):
+            self.put(new_layer, dataset, overwrite=overwrite)
+            return new_layer
+
+        path = resolve(new_layer)
+        if shapefile.exists(path) and not overwrite:
+            raise ValueError("{} already exists".format(path))
+        dataset.to_shapefile(path)
+        return new_layer
+
+    def count_features(self, layer):
+        return len(self.get(layer))
+
+    def delete(self, path):
+        if path in self:
+            del self.datasets[self._key(path)]
+
+    def delete_columns(self, layerpath, columns):
+        dataset = self.get(layerpath)
+        dataset.fields = [f for f in dataset.fields if f.name not in columns]
+        dataset.table = dataset.table[[f.name for f in dataset.fields]].copy()
+        return layerpath
+
+
+# the datasets held in memory
+MEMORY = MemoryWorkspace()
+
+
+def _memory_aware(method):
+    """ Sends calls of a backend method on a dataset held in ``MEMORY``
+    to the method of the same name of ``MEMORY``. """
+
+    @wraps(method)
+    def wrapper(self, layer, *args, **kwargs):
+        if self._in_memory(layer):
+            return getattr(MEMORY, method.__name__)(layer, *args, **kwargs)
+        return method(self, layer, *args, **kwargs)
+    return wrapper
+
+
+class ArcpyBackend(object):
+    """ Geoprocessing backend that relies on Esri's ``arcpy``.
+
+    Attribute updates of shapefiles bypass ``arcpy``'s cursors and
+    patch the .dbf file directly (see :func:`shapefile.update_dbf`).
+
+    Datasets in ``MEMORY`` are handled by :class:`MemoryWorkspace`.
+    Other ``memory:`` names refer to ``arcpy``'s ``in_memory``
+    workspace (see :func:`arcpy_path`).
+
+    """
+
+    name = 'arcpy'
+
+    def __init__(self):
+        if arcpy is None:
+            raise ImportError("the 'arcpy' backend requires ArcGIS")
+
+    @property
+    def env(self):
+        return arcpy.env
+
+    def _in_memory(self, layer):
+        return layer in MEMORY
+
+    def _shapefile_path(self, layer):
+        """ Full path to ``layer`` if it is a shapefile on disk. """
+        return find_shapefile(layer, workspace=arcpy.env.workspace)
+
+    def _resolve(self, layer):
+        workspace = arcpy.env.workspace
+        return find_shapefile(layer, workspace) or output_shapefile(layer, workspace) or layer
+
+    @_memory_aware
+    def get_field_names(self, layerpath):
+        return [f.name for f in arcpy.ListFields(arcpy_path(layerpath))]
+
+    @_memory_aware
+    def load_attribute_table(self, input_path, fields):
+        return arcpy.da.FeatureClassToNumPyArray(in_table=arcpy_path(input_path),
+                                                 field_names=fields)
+
+    @_memory_aware
+    def iter_attribute_table(self, input_path, fields, chunksize):
+        input_path = arcpy_path(input_path)
+
+        # an empty selection gives the dtype of the table
+        dtype = arcpy.da.FeatureClassToNumPyArray(
+            in_table=input_path, field_names=fields, where_clause='1 = 0'
+        ).dtype
+
+        with arcpy.da.SearchCursor(input_path, fields) as cur:
+            while True:
+                rows = [tuple(row) for row in itertools.islice(cur, chunksize)]
+                if len(rows) == 0:
+                    break
+                yield numpy.array(rows, dtype=dtype)
+
+    @_memory_aware
+    def update_attribute_table(self, layerpath, index, id_column,
+                               orig_columns, new_columns):
+        path = self._shapefile_path(layerpath)
+        if path is not None:
+            _update_shapefile(path, index, id_column, orig_columns, new_columns)
+            return layerpath
+
+        all_columns = [id_column]
+        all_columns.extend(orig_columns)
+
+        # load the existing attributed table, loop through all rows
+        with arcpy.da.UpdateCursor(arcpy_path(layerpath), all_columns) as cur:
+            for oldrow in cur:
+                # find the current row in the new array
+                newrow = index.find(oldrow[0])
+                # loop through the value colums, setting them to the new values
+                if newrow is not None:
+                    for n, col in enumerate(new_columns, 1):
+                        oldrow[n] = newrow[col]
+
+                # update the row
+                cur.updateRow(oldrow)
+
+        return layerpath
+
+    @_memory_aware
+    def add_field(self, table, field_name, field_type, **field_opts):
+        # see http://goo.gl/66QD8c
+        arcpy.management.AddField(
+            in_table=arcpy_path(table),
+            field_name=field_name,
+            field_type=field_type,
+            **field_opts
+        )
+        return table
+
+    @_memory_aware
+    def populate_field(self, table, value_fxn, fields):
+        with arcpy.da.UpdateCursor(arcpy_path(table), fields) as cur:
+            for row in cur:
+                row[-1] = value_fxn(row)
+                cur.updateRow(row)
+        return table
+
+    @_memory_aware
+    def write_columns(self, table, columns):
+        path = self._shapefile_path(table)
+        if path is not None:
+            shapefile.update_dbf(path, columns)
+            return table
+
+        names = list(columns.keys())
+        n_rows = self.count_features(table)
+        values = [
+            numpy.broadcast_to(numpy.asarray(columns[name]), (n_rows,)).tolist()
+            for name in names
+        ]
+        with arcpy.da.UpdateCursor(arcpy_path(table), names) as cur:
+            for n, row in enumerate(cur):
+                cur.updateRow([v[n] for v in values])
+        return table
+
+    def copy_layer(self, existing_layer, new_layer):
+        to_memory = is_memory(new_layer) and self._shapefile_path(existing_layer) is not None
+        if not (existing_layer in MEMORY or to_memory):
+            arcpy.management.Copy(in_data=arcpy_path(existing_layer),
+                                  out_data=arcpy_path(new_layer))
+            return new_layer
+
+        if is_memory(new_layer) or output_shapefile(new_layer, arcpy.env.workspace):
+            return MEMORY.copy_layer(existing_layer, new_layer, self._resolve,
+                                     overwrite=arcpy.env.overwriteOutput)
+
+        # everything else (e.g., feature classes) goes through a
+        # temporary shapefile
+        folder = tempfile.mkdtemp()
+        try:
+            path = MEMORY.copy_layer(existing_layer, os.path.join(folder, 'layer.shp'),
+                                     self._resolve)
+            arcpy.management.CopyFeatures(in_features=path, out_feature_class=new_layer)
+        finally:
+            shutil.rmtree(folder)
+        return new_layer
+
+    @_memory_aware
+    def count_features(self, layer):
+        return int(arcpy.management.GetCount(arcpy_path(layer)).getOutput(0))
+
+    @_memory_aware
+    def delete(self, path):
+        arcpy.management.Delete(arcpy_path(path))
+
+    @_memory_aware
+    def delete_columns(self, layerpath, columns):
+        arcpy.management.DeleteField(arcpy_path(layerpath), ";".join(columns))
+        return layerpath
+
+
+class NumpyBackend(object):
+    """ Geoprocessing backend that reads and writes shapefiles with
+    numpy. Only shapefiles are supported (no geodatabases).
+
+    Besides the fields in the .dbf file, the following fields and
+    ``arcpy`` tokens can be loaded:
+
+    - ``FID``: the (zero-based) position of each feature.
+    - ``Shape`` or ``SHAPE@XY``: the centroid of each feature.
+    - ``SHAPE@AREA`` and ``SHAPE@LENGTH``
+
+    Datasets named ``memory:<name>`` are handled by
+    :class:`MemoryWorkspace`.
+
+    Parameters
+    ----------
+    workspace : str, optional
+        Directory against which relative paths are resolved.
+
+    """
+
+    name = 'numpy'
+
+    # fields that appear in the attribute table but are not in the .dbf
+    GEOMETRY_FIELDS = ('FID', 'Shape')
+
+    # Esri field types -> (dbf type, default size, default decimals)
+    FIELD_TYPES = {
+        'TEXT': ('C', 50, 0),
+        'SHORT': ('N', 4, 0),
+        'LONG': ('N', 9, 0),
+        'FLOAT': ('F', 13, 11),
+        'DOUBLE': ('F', 19, 11),
+        'DATE': ('D', 8, 0),
+    }
+
+    def __init__(self, workspace=None):
+        self.env = Environment(workspace=workspace)
+
+    def path(self, layer):
+        """ Full path to the shapefile ``layer``, relative to the
+        workspace. """
+
+        layer = str(layer)
+        if not os.path.isabs(layer) and self.env.workspace:
+            layer = os.path.join(self.env.workspace, layer)
+        if os.path.splitext(layer)[1] == '':
+            layer += '.shp'
+        return layer
+
+    def _in_memory(self, layer):
+        return is_memory(layer)
+
+    def _check_output(self, path):
+        if shapefile.exists(path) and not self.env.overwriteOutput:
+            raise ValueError("{} already exists".format(path))
+
+    @_memory_aware
+    def get_field_names(self, layerpath):
+        fields, _, _, _ = shapefile.read_dbf_header(self.path(layerpath))
+        return list(self.GEOMETRY_FIELDS) + [f.name for f in fields]
+
+    @_memory_aware
+    def load_attribute_table(self, input_path, fields):
+        path = self.path(input_path)
+        dbf_fields = [f for f in fields if _geometry_dtype(f) is None]
+        table = shapefile.read_dbf(path, fields=dbf_fields)
+        return _add_geometry(table, fields, partial(shapefile.read_shapes, path))
+
+    @_memory_aware
+    def iter_attribute_table(self, input_path, fields, chunksize):
+        path = self.path(input_path)
+        dbf_fields = [f for f in fields if _geometry_dtype(f) is None]
+        with shapefile.DbfTable(path) as dbf:
+            for start in range(0, len(dbf), chunksize):
+                table = dbf.read(dbf_fields, start, start + chunksize)
+                yield _add_geometry(table, fields, partial(shapefile.read_shapes, path),
+                                    start=start)
+
+    @_memory_aware
+    def update_attribute_table(self, layerpath, index, id_column,
+                               orig_columns, new_columns):
+        _update_shapefile(self.path(layerpath), index, id_column, orig_columns, new_columns)
+        return layerpath
+
+    @_memory_aware
+    def add_field(self, table, field_name, field_type, **field_opts):
+        path = self.path(table)
+        specs, _, _, _ = shapefile.read_dbf_header(path)
+        if field_name in [f.name for f in specs]:
+            return table
+
+        fieldtype, size, decimals = self.FIELD_TYPES[field_type.upper()]
+        size = field_opts.get('field_length') or field_opts.get('field_precision') or size
+        decimals = field_opts.get('field_scale', decimals)
+        field = shapefile.DbfField(field_name, fieldtype, size, decimals)
+
+        old = shapefile.read_dbf(path)
+        new = numpy.zeros(old.shape[0], dtype=old.dtype.descr + [
+            (str(field_name), shapefile.field_dtype(field))
+        ])
+        for name in old.dtype.names:
+            new[name] = old[name]
+
+        shapefile.write_dbf(path, new, fields=specs + [field])
+        return table
+
+    @_memory_aware
+    def populate_field(self, table, value_fxn, fields):
+        path = self.path(table)
+        array = self.load_attribute_table(path, fields)
+
+        columns = [array[f].tolist() for f in fields]
+        values = [value_fxn(list(row)) for row in zip(*columns)]
+
+        shapefile.update_dbf(path, {fields[-1]: values})
+        return table
+
+    @_memory_aware
+    def write_columns(self, table, columns):
+        shapefile.update_dbf(self.path(table), columns)
+        return table
+
+    def copy_layer(self, existing_layer, new_layer):
+        if is_memory(existing_layer) or is_memory(new_layer):
+            return MEMORY.copy_layer(existing_layer, new_layer, self.path,
+                                     overwrite=self.env.overwriteOutput)
+
+        dst = self.path(new_layer)
+        self._check_output(dst)
+        shapefile.copy(self.path(existing_layer), dst)
+        return new_layer
+
+    @_memory_aware
+    def count_features(self, layer):
+        return shapefile.count_records(self.path(layer))
+
+    @_memory_aware
+    def delete(self, path):
+        shapefile.delete(self.path(path))
+
+    @_memory_aware
+    def delete_columns(self, layerpath, columns):
+        path = self.path(layerpath)
+        specs, _, _, _ = shapefile.read_dbf_header(path)
+        keep = [f for f in specs if f.name not in columns]
+        table = shapefile.read_dbf(path, fields=[f.name for f in keep])
+        shapefile.write_dbf(path, table, fields=keep)
+        return layerpath
+
+
+BACKENDS = {
+    'arcpy': ArcpyBackend,
+    'numpy': NumpyBackend,
+}
+
+
+_backend = None
+
+
+def default_backend():
+    """ The backend used unless another is set. This is the one named
+    by the ``PROPAGATOR_BACKEND`` environment variable or, if that is
+    not set, ``'arcpy'`` when it can be imported and ``'numpy'``
+    otherwise. """
+
+    name = os.environ.get('PROPAGATOR_BACKEND')
+    if name is None:
+        name = 'arcpy' if arcpy is not None else 'numpy'
+    return BACKENDS[name.lower()]()
+
+
+def get_backend():
+    """ The current geoprocessing backend. """
+
+    global _backend
+    if _backend is None:
+        _backend = default_backend()
+    return _backend
+
+
+def set_backend(backend):
+    """
+    Sets the current geoprocessing backend.
+
+    Parameters
+    ----------
+    backend : str or backend instance
+        Either the name of a backend (``'arcpy'`` or ``'numpy'``) or an
+        instance of a backend class. ``None`` restores the default.
+
+    Returns
+    -------
+    previous : backend instance
+        The backend that was in use before.
+
+    """
+
+    global _backend
+    previous = get_backend()
+    if backend is None:
+        _backend = default_backend()
+    elif not hasattr(backend, 'load_attribute_table'):
+        if backend.lower() not in BACKENDS:
+            raise ValueError("'{}' is not a known backend".format(backend))
+        _backend = BACKENDS[backend.lower()]()
+    else:
+        _backend = backend
+    return previous
+
+
+@contextmanager
+def UseBackend(backend):
+    """ Context manager to temporarily switch the geoprocessing backend.
+
+    Parameters
+    ----------
+    backend : str or backend instance
+        See :func:`set_backend`.
+
+    Examples
+    --------
+    >>> from propagator import backends, utils
+    >>> with backends.UseBackend('numpy'):
+    ...     table = utils.load_attribute_table('subcatchments.shp')
+
+    """
+
+    previous = set_backend(backend)
+    try:
+        yield get_backend()
+    finally:
+        set_backend(previous)
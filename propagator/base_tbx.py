@@ -2,7 +2,10 @@ from copy import copy
 
 import numpy
 
-import arcpy
+try:
+    import arcpy
+except ImportError:  # pragma: no cover
+    arcpy = None
 
 from propagator import utils
 
@@ -0,0 +1,14 @@
+""" Benchmarks for ``propagator``.
+
+The test fixtures in ``propagator.testing`` are too small to show how
+the analysis scales. The modules in this package generate synthetic
+inputs of any size, time the library on them, and save the results as
+JSON so that runs can be compared between versions.
+
+Released under the BSD 3-clause license (see LICENSE file for more info)
+
+"""
+
+
+from . import kernels
+from . import table_io
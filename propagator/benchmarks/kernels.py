@@ -0,0 +1,368 @@
+""" Scaling benchmarks of the analysis kernels of ``propagator``.
+
+This generates random drainage trees of a given size, depth, and
+branching (see :func:`random_watershed`), times the core analysis
+functions on trees from a thousand to a million subcatchments, and
+reports how their run times grow with the size of the tree. A kernel
+whose time grows faster than ``n ** QUADRATIC_THRESHOLD`` between the
+two largest trees is flagged.
+
+Run it from the command line with::
+
+    python -m propagator.benchmarks.kernels --output kernels.json
+
+Released under the BSD 3-clause license (see LICENSE file for more info)
+
+"""
+
+
+import sys
+import json
+import timeit
+import argparse
+import platform
+import warnings
+from collections import OrderedDict
+
+import numpy
+
+from propagator import analysis
+from propagator import topology
+from propagator import utils
+
+
+# the number of subcatchments in the trees that are timed by default
+SIZES = (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6)
+
+# the downstream ID of the subcatchments that drain out of the trees
+OUTLET_ID = 'Ocean'
+
+# kernels whose time grows faster than this power of the size of the
+# tree are flagged
+QUADRATIC_THRESHOLD = 1.5
+
+# the number of subcatchments whose upstream attributes are collected
+N_TARGETS = 100
+
+
+def _level_sizes(n, depth=None, branching=2.0):
+    """ The number of subcatchments at each distance from the outlets.
+    The levels grow (or shrink) geometrically by a factor of
+    ``branching`` and every level has at least one subcatchment. """
+
+    if n < 1:
+        raise ValueError("a watershed needs at least one subcatchment")
+    if branching <= 0:
+        raise ValueError("branching must be positive")
+
+    if depth is None:
+        if branching <= 1:
+            depth = n
+        else:
+            depth = int(numpy.ceil(numpy.log(n * (branching - 1) + 1) / numpy.log(branching)))
+    depth = int(min(max(depth, 1), n))
+
+    # relative sizes of the levels, scaled in log space to not overflow
+    log_weights = numpy.arange(depth) * numpy.log(branching)
+    weights = numpy.exp(log_weights - log_weights.max())
+    extra = (n - depth) * weights / weights.sum()
+
+    sizes = 1 + numpy.floor(extra).astype(int)
+    remainder = n - sizes.sum()
+    if remainder > 0:
+        sizes[numpy.argsort(numpy.floor(extra) - extra)[:remainder]] += 1
+    return sizes
+
+
+def random_watershed(n, depth=None, branching=2.0, empty_fraction=0.5,
+                     value_columns=('WQ_1', 'WQ_2'), ignored_value=0, seed=0):
+    """
+    Generates the subcatchment table of a random drainage tree.
+
+    Parameters
+    ----------
+    n : int
+        Number of subcatchments.
+    depth : int, optional
+        Number of subcatchments on the longest path from an outlet to
+        the top of the watershed. By default, the tree is as deep as it
+        needs to be for the levels to grow by a factor of
+        ``branching``.
+    branching : float, optional (2.0)
+        Ratio of the number of subcatchments at a level to the number
+        at the level below it, i.e., the average number of upstream
+        neighbors of a subcatchment. With 1 (and no ``depth``), the
+        watershed is a single chain.
+    empty_fraction : float, optional (0.5)
+        Probability that a subcatchment has no score (i.e., its value
+        is ``ignored_value``) in each value column.
+    value_columns : list of str, optional
+        Names of the score columns.
+    ignored_value : float, optional (0)
+        The value of missing scores.
+    seed : int, optional (0)
+        Seed of the random number generator. The same parameters and
+        seed always give the same watershed.
+
+    Returns
+    -------
+    subcatchments : numpy.ndarray
+        Structured array with "ID", "DS_ID", and "Area" columns and the
+        ``value_columns``, in random order. Outlets drain into
+        ``OUTLET_ID``.
+
+    Examples
+    --------
+    >>> from propagator.benchmarks import kernels
+    >>> subcatchments = kernels.random_watershed(10000, depth=50, seed=42)
+
+    """
+
+    rng = numpy.random.RandomState(seed)
+    sizes = _level_sizes(n, depth=depth, branching=branching)
+    starts = numpy.concatenate([[0], numpy.cumsum(sizes)])
+    level = numpy.repeat(numpy.arange(sizes.shape[0]), sizes)
+
+    # every subcatchment drains into a random one of the level below
+    parents = numpy.full(n, -1, dtype=int)
+    upper = level > 0
+    below = level[upper] - 1
+    parents[upper] = starts[below] + (rng.random_sample(below.shape[0]) * sizes[below]).astype(int)
+
+    width = len(str(n - 1))
+    ids = numpy.char.mod('SC%0{}d'.format(width), rng.permutation(n))
+    ds_ids = numpy.where(parents >= 0, ids[parents], OUTLET_ID)
+
+    dtype = [('ID', '<U{}'.format(width + 2)),
+             ('DS_ID', '<U{}'.format(max(width + 2, len(OUTLET_ID)))),
+             ('Area', '<f8')]
+    dtype.extend((str(col), '<f8') for col in value_columns)
+
+    subcatchments = numpy.empty(n, dtype=dtype)
+    subcatchments['ID'] = ids
+    subcatchments['DS_ID'] = ds_ids
+    subcatchments['Area'] = rng.uniform(1, 10, size=n)
+    for col in value_columns:
+        values = rng.uniform(1, 100, size=n)
+        values[rng.random_sample(n) < empty_fraction] = ignored_value
+        subcatchments[col] = values
+
+    return subcatchments[rng.permutation(n)]
+
+
+def _trace_upstream(subcatchments):
+    outlet = subcatchments['ID'][subcatchments['DS_ID'] == OUTLET_ID][0]
+    return analysis.trace_upstream(subcatchments, outlet, id_col='ID', ds_col='DS_ID',
+                                   include_base=True)
+
+
+def _propagate_scores(subcatchments):
+    value_columns = [name for name in subcatchments.dtype.names if name.startswith('WQ')]
+    return analysis.propagate_scores(subcatchments, 'ID', 'DS_ID', value_columns,
+                                     ignored_value=0)
+
+
+def _mark_edges(subcatchments):
+    return analysis.mark_edges(subcatchments, id_col='ID', ds_col='DS_ID', edge_ID='EDGE')
+
+
+def _find_tops(subcatchments):
+    return analysis.find_tops(subcatchments, id_col='ID', ds_col='DS_ID')
+
+
+def _collect_upstream_attributes(subcatchments):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return analysis.collect_upstream_attributes(
+            subcatchments, subcatchments[:N_TARGETS], 'ID', 'DS_ID', ['Area']
+        )
+
+
+def _rec_groupby(subcatchments):
+    stats = [
+        utils.Statistic('Area', 'sum', 'Area'),
+        utils.Statistic('WQ_1', 'average', 'aveWQ_1'),
+        utils.Statistic('WQ_1', 'maximum', 'maxWQ_1'),
+    ]
+    return utils.rec_groupby(subcatchments, 'DS_ID', *stats)
+
+
+# name -> function of the subcatchment table. Each function builds its
+# own topology, like a call on a fresh table would.
+KERNELS = OrderedDict([
+    ('trace_upstream', _trace_upstream),
+    ('propagate_scores', _propagate_scores),
+    ('mark_edges', _mark_edges),
+    ('find_tops', _find_tops),
+    ('collect_upstream_attributes', _collect_upstream_attributes),
+    ('rec_groupby', _rec_groupby),
+])
+
+
+def time_kernel(kernel, subcatchments, repeat=3):
+    """ The best wall time (in seconds) of ``repeat`` calls of
+    ``kernel(subcatchments)``. """
+
+    best = None
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        kernel(subcatchments)
+        elapsed = timeit.default_timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def complexity_exponent(sizes, seconds):
+    """ The power of the size that the run time grows with, from a
+    least-squares fit of ``log(seconds)`` on ``log(sizes)``. Sizes that
+    were not timed (None) are skipped. Returns None with fewer than two
+    timings. """
+
+    points = [(n, s) for n, s in zip(sizes, seconds) if s is not None and s > 0]
+    if len(points) < 2:
+        return None
+
+    n, s = numpy.log(numpy.array(points, dtype=float)).T
+    return float(numpy.polyfit(n, s, 1)[0])
+
+
+def run(sizes=SIZES, kernels=None, repeat=3, max_seconds=60., seed=0,
+        verbose=False, asMessage=False, **watershed_opts):
+    """
+    Times the analysis kernels on random watersheds of increasing size.
+
+    Parameters
+    ----------
+    sizes : list of int, optional
+        Numbers of subcatchments of the watersheds (1e3 to 1e6 by
+        default).
+    kernels : list of str, optional
+        Names of the kernels (keys of ``KERNELS``) to time. All of them
+        by default.
+    repeat : int, optional (3)
+        Number of times each kernel is called on each watershed. The
+        best time is kept.
+    max_seconds : float, optional (60)
+        A kernel is not timed on larger watersheds once one of its
+        calls takes longer than this.
+    seed : int, optional (0)
+        See :func:`random_watershed`.
+    verbose, asMessage : bool, optional
+        Toggle printing the timings as they are measured.
+    **watershed_opts
+        Other parameters of :func:`random_watershed` (e.g., ``depth``,
+        ``branching``, and ``empty_fraction``).
+
+    Returns
+    -------
+    report : dict
+        JSON-serializable description of the run. For each kernel, the
+        ``"timings"`` list the best time and the time per subcatchment
+        at each size, along with the local ``"exponent"`` between that
+        size and the previous one. ``"exponent"`` is the fit over all
+        sizes (see :func:`complexity_exponent`). Kernels whose last
+        local exponent is above ``QUADRATIC_THRESHOLD`` are listed in
+        ``"flagged"``.
+
+    """
+
+    names = list(KERNELS.keys()) if kernels is None else list(kernels)
+    unknown = [name for name in names if name not in KERNELS]
+    if len(unknown) > 0:
+        raise ValueError("{} are not known kernels".format(unknown))
+
+    sizes = sorted(int(n) for n in sizes)
+    seconds = OrderedDict((name, []) for name in names)
+    depths = []
+    for n in sizes:
+        subcatchments = random_watershed(n, seed=seed, **watershed_opts)
+        depths.append(len(topology.WatershedGraph(subcatchments, 'ID', 'DS_ID').levels))
+        for name in names:
+            previous = seconds[name][-1] if seconds[name] else 0
+            if previous is None or previous > max_seconds:
+                seconds[name].append(None)
+                continue
+
+            seconds[name].append(time_kernel(KERNELS[name], subcatchments, repeat=repeat))
+            utils._status('{} (n={}, depth={}): {:.4f} s'.format(name, n, depths[-1], seconds[name][-1]),
+                          verbose=verbose, asMessage=asMessage)
+
+    report = OrderedDict([
+        ('parameters', OrderedDict([
+            ('sizes', sizes),
+            ('repeat', repeat),
+            ('max_seconds', max_seconds),
+            ('seed', seed),
+            ('watershed', dict((k, list(v) if isinstance(v, tuple) else v)
+                               for k, v in watershed_opts.items())),
+        ])),
+        ('environment', OrderedDict([
+            ('python', platform.python_version()),
+            ('numpy', numpy.__version__),
+            ('platform', platform.platform()),
+        ])),
+        ('kernels', OrderedDict()),
+        ('flagged', []),
+    ])
+
+    for name in names:
+        timings = []
+        for k, (n, s) in enumerate(zip(sizes, seconds[name])):
+            local = None
+            if k > 0:
+                local = complexity_exponent(sizes[k - 1:k + 1], seconds[name][k - 1:k + 1])
+            timings.append(OrderedDict([
+                ('n', n),
+                ('depth', depths[k]),
+                ('seconds', s),
+                ('seconds_per_node', None if s is None else s / n),
+                ('exponent', local),
+            ]))
+
+        report['kernels'][name] = OrderedDict([
+            ('timings', timings),
+            ('exponent', complexity_exponent(sizes, seconds[name])),
+        ])
+
+        local = [t['exponent'] for t in timings if t['exponent'] is not None]
+        if local and local[-1] > QUADRATIC_THRESHOLD:
+            report['flagged'].append(name)
+
+    return report
+
+
+def save(report, path):
+    """ Writes a report from :func:`run` as JSON. """
+
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    parser.add_argument('--kernels', nargs='+', choices=list(KERNELS.keys()))
+    parser.add_argument('--depth', type=int)
+    parser.add_argument('--branching', type=float, default=2.0)
+    parser.add_argument('--empty-fraction', type=float, default=0.5)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-seconds', type=float, default=60.)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='path of the JSON report (printed if not given)')
+    args = parser.parse_args(argv)
+
+    report = run(sizes=args.sizes, kernels=args.kernels, repeat=args.repeat,
+                 max_seconds=args.max_seconds, seed=args.seed, verbose=args.output is not None,
+                 depth=args.depth, branching=args.branching,
+                 empty_fraction=args.empty_fraction)
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        save(report, args.output)
+    return 1 if report['flagged'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
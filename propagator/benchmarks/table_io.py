@@ -0,0 +1,389 @@
+""" Throughput benchmarks of the attribute table I/O of ``propagator``.
+
+This writes point shapefiles with random attribute tables of a given
+number of rows and fields (see :func:`random_table`), times the
+functions in :mod:`propagator.utils` that read and write attribute
+tables on them with the current backend, and reports their throughput
+in rows and megabytes (of the .dbf file) per second. Reports can be
+saved as baselines and later runs compared against them (see
+:func:`compare`).
+
+Run it from the command line with::
+
+    python -m propagator.benchmarks.table_io --save-baseline baseline.json
+    python -m propagator.benchmarks.table_io --baseline baseline.json
+
+Released under the BSD 3-clause license (see LICENSE file for more info)
+
+"""
+
+
+import os
+import sys
+import json
+import shutil
+import timeit
+import argparse
+import platform
+import tempfile
+from collections import OrderedDict
+
+import numpy
+
+from propagator import utils
+from propagator import backends
+from propagator import shapefile
+
+
+# the number of rows and value fields of the tables timed by default
+ROWS = (10 ** 3, 10 ** 4, 10 ** 5)
+FIELDS = (10, 50)
+
+# the name of the copy of a table that is held in memory
+MEMORY_LAYER = backends.MEMORY_PREFIX + 'table_io'
+
+# a run is a regression when its throughput is less than this fraction
+# of the baseline's
+DEFAULT_TOLERANCE = 0.25
+
+
+def _value_fields(n_fields, text_fraction=0.2):
+    """ The definitions of the value fields of a random table. """
+
+    n_text = int(round(n_fields * text_fraction))
+    return [
+        shapefile.DbfField('V{:03d}'.format(n), 'C', 20, 0) if n < n_text
+        else shapefile.DbfField('V{:03d}'.format(n), 'F', 19, 11)
+        for n in range(n_fields)
+    ]
+
+
+def random_table(path, n_rows, n_fields=10, text_fraction=0.2, seed=0):
+    """
+    Writes a point shapefile with a random attribute table.
+
+    Parameters
+    ----------
+    path : str
+        Path of the new shapefile.
+    n_rows : int
+        Number of features.
+    n_fields : int, optional (10)
+        Number of value fields ("V000", "V001", ...), besides the
+        unique "ID" field.
+    text_fraction : float, optional (0.2)
+        Fraction of the value fields that are text. The others are
+        doubles.
+    seed : int, optional (0)
+        Seed of the random number generator.
+
+    Returns
+    -------
+    path : str
+
+    Examples
+    --------
+    >>> from propagator.benchmarks import table_io
+    >>> table_io.random_table('C:/temp/bench.shp', 100000, n_fields=50)
+
+    """
+
+    rng = numpy.random.RandomState(seed)
+    value_fields = _value_fields(n_fields, text_fraction=text_fraction)
+    fields = [shapefile.DbfField('ID', 'C', 12, 0)] + value_fields
+
+    table = numpy.empty(n_rows, dtype=[(str(f.name), shapefile.field_dtype(f)) for f in fields])
+    table['ID'] = numpy.char.mod('ID%08d', numpy.arange(n_rows))
+    for field in value_fields:
+        if field.type == 'C':
+            table[field.name] = numpy.char.mod('text %d', rng.randint(0, 10 ** 6, size=n_rows))
+        else:
+            table[field.name] = rng.uniform(0, 1000, size=n_rows)
+
+    points = rng.uniform(0, 10000, size=(n_rows, 2))
+    shapes = [
+        shapefile.Shape(shapefile.POINT, numpy.zeros(1, dtype=int), xy.reshape(1, 2), None)
+        for xy in points
+    ]
+
+    shapefile.write_shapes(path, shapefile.POINT, shapes)
+    shapefile.write_dbf(path, table, fields=fields, encoding=shapefile.DEFAULT_ENCODING)
+    return path
+
+
+def _numeric_fields(source):
+    fields, _, _, _ = shapefile.read_dbf_header(source)
+    return [f.name for f in fields if f.type in ('N', 'F')]
+
+
+def _load_attribute_table(source):
+    return lambda layer: utils.load_attribute_table(layer)
+
+
+def _update_attribute_table(source):
+    columns = _numeric_fields(source)[::2]
+    table = utils.load_attribute_table(source, 'ID', *columns)
+    for col in columns:
+        table[col] = table[col] + 1
+    return lambda layer: utils.update_attribute_table(layer, table, 'ID', columns)
+
+
+def _add_field_with_value(source):
+    return lambda layer: utils.add_field_with_value(layer, 'NEWVAL', 1.5, overwrite=True)
+
+
+def _populate_field(source):
+    key, value = _numeric_fields(source)[:2]
+    return lambda layer: utils.populate_field(layer, lambda row: row[0] * 2, value,
+                                              keyfields=[key])
+
+
+def _delete_columns(source):
+    columns = _numeric_fields(source)[::2]
+    return lambda layer: utils.delete_columns(layer, *columns)
+
+
+# name -> function that takes the original shapefile, does everything
+# that should not be timed (e.g., preparing new values), and returns
+# the operation to be timed as a function of the layer it changes.
+OPERATIONS = OrderedDict([
+    ('load_attribute_table', _load_attribute_table),
+    ('update_attribute_table', _update_attribute_table),
+    ('add_field_with_value', _add_field_with_value),
+    ('populate_field', _populate_field),
+    ('delete_columns', _delete_columns),
+])
+
+
+def _fresh_copy(source, workspace, in_memory):
+    """ A new copy of the shapefile ``source`` to be operated on. """
+
+    if in_memory:
+        with utils.OverwriteState(True):
+            return utils.copy_layer(source, MEMORY_LAYER)
+
+    layer = os.path.join(workspace, 'work.shp')
+    shapefile.copy(source, layer)
+    utils.SCHEMA_CACHE.invalidate(layer)
+    return layer
+
+
+def time_operation(operation, source, workspace, repeat=3, in_memory=False):
+    """ The best wall time (in seconds) of ``repeat`` calls of
+    ``operation`` (see ``OPERATIONS``) on fresh copies of the shapefile
+    ``source``. Preparing the operation and copying are not timed. """
+
+    action = operation(source)
+    best = None
+    for _ in range(repeat):
+        layer = _fresh_copy(source, workspace, in_memory)
+        start = timeit.default_timer()
+        action(layer)
+        elapsed = timeit.default_timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    utils.cleanup_temp_results(MEMORY_LAYER if in_memory else layer)
+    return best
+
+
+def run(rows=ROWS, fields=FIELDS, operations=None, repeat=3, in_memory=False,
+        workspace=None, seed=0, verbose=False, asMessage=False):
+    """
+    Times the attribute table operations on tables of increasing size
+    with the current backend (see :func:`propagator.backends.get_backend`).
+
+    Parameters
+    ----------
+    rows, fields : list of int, optional
+        Numbers of rows and of value fields of the tables. Every
+        combination is timed.
+    operations : list of str, optional
+        Names of the operations (keys of ``OPERATIONS``) to time. All
+        of them by default.
+    repeat : int, optional (3)
+        Number of times each operation is timed on each table. The
+        best time is kept.
+    in_memory : bool, optional (False)
+        Toggles operating on copies of the tables held in memory (see
+        :class:`propagator.backends.MemoryWorkspace`) instead of on
+        shapefiles.
+    workspace : str, optional
+        Folder where the tables are written. A temporary folder, which
+        is deleted afterwards, is used by default.
+    seed : int, optional (0)
+        See :func:`random_table`.
+    verbose, asMessage : bool, optional
+        Toggle printing the timings as they are measured.
+
+    Returns
+    -------
+    report : dict
+        JSON-serializable description of the run. Its ``"results"``
+        list the time, rows per second, and megabytes (of the .dbf
+        file) per second of each operation on each table.
+
+    """
+
+    names = list(OPERATIONS.keys()) if operations is None else list(operations)
+    unknown = [name for name in names if name not in OPERATIONS]
+    if len(unknown) > 0:
+        raise ValueError("{} are not known operations".format(unknown))
+
+    temporary = workspace is None
+    if temporary:
+        workspace = tempfile.mkdtemp(prefix='propagator_table_io_')
+
+    results = []
+    try:
+        for n_fields in fields:
+            for n_rows in rows:
+                source = random_table(os.path.join(workspace, 'table.shp'), n_rows,
+                                      n_fields=n_fields, seed=seed)
+                megabytes = os.path.getsize(shapefile._sidecar(source, '.dbf')) / 2. ** 20
+                for name in names:
+                    seconds = time_operation(OPERATIONS[name], source, workspace,
+                                             repeat=repeat, in_memory=in_memory)
+                    results.append(OrderedDict([
+                        ('operation', name),
+                        ('rows', n_rows),
+                        ('fields', n_fields),
+                        ('in_memory', in_memory),
+                        ('megabytes', megabytes),
+                        ('seconds', seconds),
+                        ('rows_per_second', n_rows / seconds),
+                        ('mb_per_second', megabytes / seconds),
+                    ]))
+                    utils._status(
+                        '{} ({} rows x {} fields): {:.4f} s, {:.0f} rows/s, {:.2f} MB/s'.format(
+                            name, n_rows, n_fields, seconds, n_rows / seconds, megabytes / seconds
+                        ),
+                        verbose=verbose, asMessage=asMessage
+                    )
+                shapefile.delete(source)
+    finally:
+        if temporary:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    backend = backends.get_backend()
+    return OrderedDict([
+        ('parameters', OrderedDict([
+            ('rows', list(rows)),
+            ('fields', list(fields)),
+            ('repeat', repeat),
+            ('in_memory', in_memory),
+            ('seed', seed),
+        ])),
+        ('environment', OrderedDict([
+            ('backend', getattr(backend, 'name', type(backend).__name__)),
+            ('python', platform.python_version()),
+            ('numpy', numpy.__version__),
+            ('platform', platform.platform()),
+        ])),
+        ('results', results),
+    ])
+
+
+def save(report, path):
+    """ Writes a report from :func:`run` (e.g., a baseline) as JSON. """
+
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def load(path):
+    """ Reads a report saved by :func:`save`. """
+
+    with open(path) as f:
+        return json.load(f, object_pairs_hook=OrderedDict)
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Finds the operations that got slower than in a baseline.
+
+    Parameters
+    ----------
+    report, baseline : dict
+        Reports from :func:`run` (or read with :func:`load`).
+        Operations and tables (sizes, and whether they were held in
+        memory) that are not in both are ignored.
+    tolerance : float, optional (0.25)
+        Fraction by which the throughput can drop before it counts as
+        a regression.
+
+    Returns
+    -------
+    regressions : list of dict
+        The operation, table size, baseline and current rows per
+        second, and their ratio of every regression.
+
+    """
+
+    def key(result):
+        return (result['operation'], result['rows'], result['fields'],
+                result.get('in_memory', False))
+
+    reference = dict((key(r), r['rows_per_second']) for r in baseline['results'])
+
+    regressions = []
+    for result in report['results']:
+        before = reference.get(key(result))
+        if before is None:
+            continue
+
+        ratio = result['rows_per_second'] / before
+        if ratio < 1 - tolerance:
+            regressions.append(OrderedDict([
+                ('operation', result['operation']),
+                ('rows', result['rows']),
+                ('fields', result['fields']),
+                ('baseline', before),
+                ('current', result['rows_per_second']),
+                ('ratio', ratio),
+            ]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=list(ROWS))
+    parser.add_argument('--fields', type=int, nargs='+', default=list(FIELDS))
+    parser.add_argument('--operations', nargs='+', choices=list(OPERATIONS.keys()))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', choices=sorted(backends.BACKENDS.keys()))
+    parser.add_argument('--memory', action='store_true',
+                        help='operate on copies of the tables held in memory')
+    parser.add_argument('--workspace', help='folder where the tables are written')
+    parser.add_argument('--output', help='path of the JSON report (printed if not given)')
+    parser.add_argument('--save-baseline', help='path where the report is saved as a baseline')
+    parser.add_argument('--baseline', help='path of a baseline to compare the report to')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    quiet = args.output is None and args.baseline is None and args.save_baseline is None
+    with backends.UseBackend(args.backend):
+        report = run(rows=args.rows, fields=args.fields, operations=args.operations,
+                     repeat=args.repeat, in_memory=args.memory, workspace=args.workspace,
+                     seed=args.seed, verbose=not quiet)
+
+    if args.output is not None:
+        save(report, args.output)
+    if args.save_baseline is not None:
+        save(report, args.save_baseline)
+    if quiet:
+        json.dump(report, sys.stdout, indent=2)
+
+    if args.baseline is None:
+        return 0
+
+    regressions = compare(report, load(args.baseline), tolerance=args.tolerance)
+    for r in regressions:
+        utils._status('{operation} ({rows} rows x {fields} fields) is {ratio:.0%} as fast '
+                      'as in the baseline'.format(**r), verbose=True)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,419 @@
+""" On-disk cache of the outputs of ``propagator``'s toolboxes.
+
+Rerunning :func:`propagator.toolbox.propagate` or
+:func:`propagator.toolbox.accumulate` with the same input datasets and
+parameters produces the same layers. A :class:`ResultCache` keeps
+copies of those layers keyed by a hash of the inputs and parameters so
+that a repeated run restores them instead of redoing the analysis.
+
+Released under the BSD 3-clause license (see LICENSE file for more info)
+
+"""
+
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import inspect
+import tempfile
+from functools import wraps, partial
+
+import numpy
+
+from propagator import utils
+from propagator import backends
+from propagator import shapefile
+
+
+# the file in each entry that describes the cached result
+MANIFEST = 'manifest.json'
+
+# the default limit on the total size of a cache (1 GB)
+DEFAULT_MAX_BYTES = 2 ** 30
+
+
+def _resolve(layer):
+    """ Absolute path of ``layer``, relative to the workspace. """
+
+    backend = backends.get_backend()
+    path = str(getattr(layer, 'dataSource', layer))
+    if not os.path.isabs(path) and backend.env.workspace:
+        path = os.path.join(backend.env.workspace, path)
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _file_signature(path, contents=False):
+    if contents and os.path.isfile(path):
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(partial(f.read, 2 ** 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
+
+
+def fingerprint(layer, contents=False):
+    """
+    Summarizes the current state of a dataset.
+
+    Parameters
+    ----------
+    layer : str
+        Path or name of the dataset, relative to the workspace.
+    contents : bool, optional (False)
+        Toggles hashing the contents of the dataset's files instead of
+        using their sizes and modification times.
+
+    Returns
+    -------
+    fingerprint : list or None
+        The path of the dataset and the signatures of its files, or
+        None if the dataset does not exist on disk.
+
+    Notes
+    -----
+    A shapefile is summarized by the files that make it up (except its
+    spatial indexes). A feature class in a file geodatabase is
+    summarized by the geodatabase's ``timestamps`` file (see
+    :func:`propagator.backends.geodatabase_marker`), so any change to
+    the geodatabase changes the fingerprint.
+
+    """
+
+    path = _resolve(layer)
+    marker = backends.geodatabase_marker(path)
+    shp = backends.find_shapefile(path) if marker is None else None
+    if marker is not None:
+        files = [marker]
+    elif shp is not None:
+        files = [
+            shapefile._sidecar(shp, ext) for ext in shapefile.EXTENSIONS
+            if ext not in shapefile.INDEX_EXTENSIONS
+        ]
+    elif os.path.isfile(path):
+        files = [path]
+    else:
+        return None
+
+    signatures = [
+        [os.path.basename(f), _file_signature(f, contents=contents)]
+        for f in files if os.path.exists(f)
+    ]
+    return [path, signatures]
+
+
+def normalize(value):
+    """
+    A JSON-serializable representation of a parameter.
+
+    Functions (e.g., a monitoring location filter) are represented by
+    their compiled code and the values of the variables they close
+    over, so two lambdas with the same body but different
+    ``included_ml_types`` do not collide.
+
+    """
+
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    elif hasattr(value, 'lower'):
+        return str(value)
+    elif isinstance(value, numpy.generic):
+        return value.item()
+    elif isinstance(value, numpy.ndarray):
+        return normalize(value.tolist())
+    elif isinstance(value, dict):
+        return [[normalize(k), normalize(v)] for k, v in sorted(value.items())]
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        items = [normalize(v) for v in value]
+        return sorted(items, key=repr) if isinstance(value, (set, frozenset)) else items
+    elif isinstance(value, partial):
+        return ['partial', normalize(value.func), normalize(value.args),
+                normalize(value.keywords or {})]
+    elif hasattr(value, '__code__'):
+        code = value.__code__
+        closure = [cell.cell_contents for cell in (value.__closure__ or ())]
+        return ['function', hashlib.sha1(code.co_code).hexdigest(),
+                normalize([c for c in code.co_consts if not inspect.iscode(c)]),
+                normalize(code.co_names), normalize(closure),
+                normalize(value.__defaults__ or ())]
+    elif callable(value):
+        return ['callable', getattr(value, '__module__', None),
+                getattr(value, '__name__', repr(value))]
+    return repr(value)
+
+
+class ResultCache(object):
+    """
+    Size-bounded, on-disk cache of the layers created by the toolbox
+    functions, keyed by a hash of their inputs and parameters.
+
+    Each entry is a folder (named after its key) holding copies of the
+    output shapefiles and a manifest. Entries are evicted in
+    least-recently-used order when the cache grows larger than
+    ``max_bytes``.
+
+    Parameters
+    ----------
+    directory : str
+        Folder where the entries are kept. Created if needed.
+    max_bytes : int, optional
+        Limit on the total size of the entries (1 GB by default).
+    contents : bool, optional (False)
+        Toggles hashing the contents of the input datasets instead of
+        using their sizes and modification times.
+
+    Attributes
+    ----------
+    hits, misses : int
+        Number of calls that were or were not answered by the cache.
+
+    Notes
+    -----
+    Only outputs that are shapefiles are cached. Results saved to a
+    geodatabase are always recomputed.
+
+    Examples
+    --------
+    >>> import propagator
+    >>> from propagator import cache, utils
+    >>> results = cache.ResultCache('C:/gis/propagator_cache')
+    >>> with utils.WorkSpace('C:/gis/SOC'):
+    ...     propagator.accumulate(
+    ...         subcatchments_layer='subcatchments.shp',
+    ...         id_col='Catch_ID',
+    ...         ds_col='DS_ID',
+    ...         value_columns=[('Area', 'sum', 'n/a')],
+    ...         streams_layer='streams.shp',
+    ...         output_layer='accumulated.shp',
+    ...         cache=results,
+    ...     )
+
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, contents=False):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.contents = contents
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def __len__(self):
+        return len(self._entries())
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self),
+                'bytes': sum(size for _, _, size in self._entries())}
+
+    def key(self, inputs, params):
+        """
+        The key of a call.
+
+        Parameters
+        ----------
+        inputs : list of str
+            The input datasets.
+        params : dict
+            All of the other parameters that determine the result.
+
+        Returns
+        -------
+        key : str or None
+            A hex digest, or None if any of the inputs is not on disk.
+
+        """
+
+        fingerprints = [fingerprint(layer, contents=self.contents) for layer in inputs]
+        if any(fp is None for fp in fingerprints):
+            return None
+
+        description = json.dumps({
+            'inputs': fingerprints,
+            'params': normalize(params),
+            'workspace': _resolve('.'),
+        }, sort_keys=True)
+        return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key)
+
+    def _entries(self):
+        """ (last use, key, size in bytes) of every entry. """
+
+        entries = []
+        for key in os.listdir(self.directory):
+            manifest = os.path.join(self._entry(key), MANIFEST)
+            if os.path.isfile(manifest):
+                with open(manifest) as f:
+                    size = json.load(f)['bytes']
+                entries.append((os.path.getmtime(manifest), key, size))
+        return entries
+
+    def fetch(self, key):
+        """
+        Restores the outputs of a cached call.
+
+        Returns
+        -------
+        result : str, tuple, or None
+            What the call returned, or None if ``key`` is not cached.
+
+        """
+
+        entry = self._entry(key)
+        manifest = os.path.join(entry, MANIFEST)
+        if not os.path.isfile(manifest):
+            return None
+
+        with open(manifest) as f:
+            info = json.load(f)
+
+        for n, path in enumerate(info['paths']):
+            shapefile.copy(os.path.join(entry, '{}.shp'.format(n)), path)
+            utils.SCHEMA_CACHE.invalidate(path)
+
+        # the manifest's modification time marks the last use
+        now = time.time()
+        os.utime(manifest, (now, now))
+
+        if info['tuple']:
+            return tuple(info['result'])
+        return info['result'][0]
+
+    def store(self, key, result):
+        """
+        Keeps copies of the layers returned by a call.
+
+        Returns
+        -------
+        stored : bool
+            False if any of the layers is not a shapefile.
+
+        """
+
+        layers = list(result) if isinstance(result, tuple) else [result]
+        paths = [backends.find_shapefile(layer) for layer in layers]
+        if any(path is None for path in paths):
+            return False
+
+        # build the entry next to the others and move it into place at
+        # once so a half-written entry is never found
+        staging = tempfile.mkdtemp(prefix='_staging_', dir=self.directory)
+        for n, path in enumerate(paths):
+            shapefile.copy(path, os.path.join(staging, '{}.shp'.format(n)))
+
+        size = sum(os.path.getsize(os.path.join(staging, name)) for name in os.listdir(staging))
+        with open(os.path.join(staging, MANIFEST), 'w') as f:
+            json.dump({
+                'result': layers,
+                'tuple': isinstance(result, tuple),
+                'paths': paths,
+                'bytes': size,
+            }, f)
+
+        entry = self._entry(key)
+        if os.path.exists(entry):
+            shutil.rmtree(entry)
+        os.rename(staging, entry)
+
+        self.evict()
+        return True
+
+    def evict(self):
+        """ Deletes the least recently used entries until the cache
+        fits in ``max_bytes``. """
+
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        for _, key, size in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._entry(key))
+            total -= size
+
+    def clear(self):
+        """ Deletes every entry and resets the counters. """
+
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+        self.hits = 0
+        self.misses = 0
+
+    def call(self, fxn, inputs, params, verbose=False, asMessage=False):
+        """
+        Restores the result of ``fxn()`` from the cache or, if it is
+        not cached, calls it and caches its result.
+
+        Parameters
+        ----------
+        fxn : callable
+            Function, taking no arguments, that creates and returns the
+            output layer(s).
+        inputs, params
+            See :meth:`key`.
+
+        """
+
+        key = self.key(inputs, params)
+        if key is not None:
+            result = self.fetch(key)
+            if result is not None:
+                self.hits += 1
+                utils._status("Restored cached results", verbose=verbose, asMessage=asMessage)
+                return result
+
+        self.misses += 1
+        result = fxn()
+        if key is not None:
+            self.store(key, result)
+        return result
+
+
+def cached(inputs, ignore=('verbose', 'asMessage'), normalizers=None):
+    """ Decorator to allow a function to take an additional ``cache``
+    keyword argument (a :class:`ResultCache`, or None to not use one).
+
+    Parameters
+    ----------
+    inputs : list of str
+        Names of the arguments that are input datasets.
+    ignore : list of str, optional
+        Names of the arguments that do not change the result.
+    normalizers : dict, optional
+        Functions that put the values of some arguments in a canonical
+        form (e.g., lower-case aggregation methods).
+
+    """
+
+    normalizers = normalizers or {}
+
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = kwargs.pop("cache", None)
+            if cache is None:
+                return func(*args, **kwargs)
+
+            callargs = inspect.getcallargs(func, *args, **kwargs)
+            params = dict(
+                (name, normalizers.get(name, lambda x: x)(value))
+                for name, value in callargs.items()
+                if name not in ignore and name not in inputs
+            )
+            return cache.call(
+                partial(func, *args, **kwargs),
+                [callargs[name] for name in inputs if callargs[name] is not None],
+                params,
+                verbose=callargs.get('verbose', False),
+                asMessage=callargs.get('asMessage', False),
+            )
+        return wrapper
+    return decorate
@@ -0,0 +1,1010 @@
+""" Native (numpy) geometric operations for ``propagator``.
+
+This contains vectorized replacements for the few ``arcpy``
+geoprocessing tools that the propagation pipeline relies on, working
+directly on the geometries read by :mod:`propagator.shapefile`.
+
+Released under the BSD 3-clause license (see LICENSE file for more info)
+
+"""
+
+
+import os
+import shutil
+import hashlib
+from collections import OrderedDict
+from concurrent import futures
+
+import numpy
+from numpy.lib import recfunctions
+
+from propagator import shapefile
+from propagator import backends
+
+
+def _checksum(path, blocksize=2 ** 20):
+    """ MD5 checksum of the .shp file of a shapefile. """
+
+    md5 = hashlib.md5()
+    with open(os.path.splitext(path)[0] + '.shp', 'rb') as shp:
+        for block in iter(lambda: shp.read(blocksize), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def _load_sidecar(path, key):
+    """ The arrays saved by :func:`_save_sidecar`, or None if the file
+    is missing, unreadable, or was saved under another ``key``. """
+
+    if not os.path.exists(path):
+        return None
+    try:
+        with numpy.load(path, allow_pickle=False) as data:
+            if str(data['key']) != key:
+                return None
+            return dict((name, data[name]) for name in data.files if name != 'key')
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+
+def _save_sidecar(path, key, arrays):
+    try:
+        numpy.savez(path, key=numpy.array(key), **arrays)
+    except (IOError, OSError):
+        pass
+
+
+def _persisted(path, key, compute, persist=True):
+    """ The arrays returned by ``compute()``, reused from the .npz file
+    at ``path`` as long as they were saved under the same ``key``. """
+
+    if persist:
+        arrays = _load_sidecar(path, key)
+        if arrays is not None:
+            return arrays
+
+    arrays = compute()
+    if persist:
+        _save_sidecar(path, key, arrays)
+    return arrays
+
+
+def _boxes_intersect(a, b):
+    """ Whether each box ``a`` intersects the corresponding box ``b``.
+    Both are given as (xmin, ymin, xmax, ymax) column arrays. """
+
+    # boxes padded with NaNs never intersect anything
+    with numpy.errstate(invalid='ignore'):
+        hit = a[0] <= b[2]
+        hit &= a[2] >= b[0]
+        hit &= a[1] <= b[3]
+        hit &= a[3] >= b[1]
+    return hit
+
+
+def _segments_intersect_boxes(segments, boxes):
+    """ Slab test of whether each segment (x1, y1, x2, y2) crosses
+    the corresponding box (xmin, ymin, xmax, ymax). Both are given as
+    column arrays. """
+
+    t_enter = numpy.zeros(segments[0].shape[0])
+    t_exit = numpy.ones(segments[0].shape[0])
+
+    # boxes padded with NaNs never intersect anything
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        for axis in (0, 1):
+            start = segments[axis]
+            delta = segments[axis + 2] - start
+            lower, upper = boxes[axis], boxes[axis + 2]
+
+            parallel = delta == 0
+            inside = (start >= lower) & (start <= upper)
+            t1 = (lower - start) / delta
+            t2 = (upper - start) / delta
+
+            t_min = numpy.where(parallel, numpy.where(inside, -numpy.inf, numpy.inf), numpy.minimum(t1, t2))
+            t_max = numpy.where(parallel, numpy.where(inside, numpy.inf, -numpy.inf), numpy.maximum(t1, t2))
+            t_enter = numpy.maximum(t_enter, t_min)
+            t_exit = numpy.minimum(t_exit, t_max)
+        return t_enter <= t_exit
+
+
+class SpatialIndex(object):
+    """
+    Packed (Sort-Tile-Recursive) R-tree over the bounding boxes of a
+    layer's features, queried in bulk.
+
+    The leaves are the feature bounding boxes sorted into vertical
+    slices by x and then by y within each slice. Every ``nodesize``
+    consecutive entries of a level are grouped into one node of the
+    level above, so the tree is fully described by the boxes of each
+    level.
+
+    Parameters
+    ----------
+    bboxes : numpy.ndarray
+        An N x 4 array of the (xmin, ymin, xmax, ymax) of each
+        feature. Rows with NaNs (e.g., null geometries) are never
+        returned by the queries.
+    nodesize : int, optional (4)
+        Number of entries in each node. Queries are vectorized over
+        every child of the nodes they reach, so small nodes are
+        faster than the usual disk-oriented sizes.
+
+    Attributes
+    ----------
+    order : numpy.ndarray of int
+        Feature IDs in the order of the leaves.
+    levels : list of numpy.ndarray
+        Boxes of each level of the tree, from the leaves to the root.
+
+    """
+
+    def __init__(self, bboxes=None, nodesize=4, order=None, levels=None):
+        self.nodesize = int(nodesize)
+        self._padded = None
+        if levels is not None:
+            self.order = numpy.asarray(order, dtype=int)
+            self.levels = list(levels)
+            return
+
+        bboxes = numpy.asarray(bboxes, dtype=float).reshape(-1, 4)
+        ids = numpy.flatnonzero(~numpy.isnan(bboxes).any(axis=1))
+        boxes = bboxes[ids]
+
+        if ids.shape[0] > 0:
+            cx = (boxes[:, 0] + boxes[:, 2]) / 2.
+            cy = (boxes[:, 1] + boxes[:, 3]) / 2.
+            n_nodes = -(-ids.shape[0] // self.nodesize)
+            n_slices = int(numpy.ceil(numpy.sqrt(n_nodes)))
+            by_x = numpy.argsort(cx, kind='mergesort')
+            slices = numpy.empty(ids.shape[0], dtype=int)
+            slices[by_x] = numpy.arange(ids.shape[0]) // (n_slices * self.nodesize)
+            leaves = numpy.lexsort((cy, slices))
+            ids, boxes = ids[leaves], boxes[leaves]
+
+        self.order = ids
+        self.levels = [boxes]
+        while self.levels[-1].shape[0] > 1:
+            self.levels.append(self._parent_boxes(self.levels[-1]))
+
+    def __len__(self):
+        return self.order.shape[0]
+
+    def _parent_boxes(self, boxes):
+        n_parents = -(-boxes.shape[0] // self.nodesize)
+        padded = numpy.full((n_parents * self.nodesize, 4), numpy.nan)
+        padded[:boxes.shape[0]] = boxes
+        padded = padded.reshape(n_parents, self.nodesize, 4)
+        return numpy.hstack([
+            numpy.nanmin(padded[:, :, :2], axis=1),
+            numpy.nanmax(padded[:, :, 2:], axis=1),
+        ])
+
+    def _columns(self):
+        """ Coordinates of the boxes of each level as contiguous
+        columns. All but the root are padded with NaN (which never
+        intersects anything) to a whole number of nodes. """
+
+        if self._padded is None:
+            self._padded = []
+            for boxes in self.levels:
+                size = -(-boxes.shape[0] // self.nodesize) * self.nodesize
+                columns = numpy.full((4, size), numpy.nan)
+                columns[:, :boxes.shape[0]] = boxes.T
+                self._padded.append(columns)
+        return self._padded
+
+    def _search(self, queries, test, chunksize=2 ** 16):
+        """ Walks down the tree with all of the ``queries`` at once,
+        keeping the (query, node) pairs that pass ``test``. """
+
+        levels = self._columns()
+        children = numpy.arange(self.nodesize)
+        results = []
+        for first in range(0, queries.shape[0], chunksize):
+            chunk = queries[first:first + chunksize].T.copy()
+            n_top = self.levels[-1].shape[0]
+            query = numpy.repeat(numpy.arange(chunk.shape[1]), n_top)
+            node = numpy.tile(numpy.arange(n_top), chunk.shape[1])
+
+            for depth, boxes in enumerate(levels[::-1]):
+                if depth > 0:
+                    query = numpy.repeat(query, self.nodesize)
+                    node = (node[:, None] * self.nodesize + children).ravel()
+                keep = test([c[query] for c in chunk], [c[node] for c in boxes])
+                query, node = query[keep], node[keep]
+
+            results.append((query + first, self.order[node]))
+
+        if len(results) == 0:
+            return numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int)
+
+        query = numpy.hstack([r[0] for r in results])
+        feature = numpy.hstack([r[1] for r in results])
+        order = numpy.lexsort((feature, query))
+        return query[order], feature[order]
+
+    def query_bboxes(self, bboxes):
+        """
+        Finds the features whose bounding boxes intersect each of the
+        ``bboxes``.
+
+        Parameters
+        ----------
+        bboxes : array-like
+            An N x 4 array of (xmin, ymin, xmax, ymax).
+
+        Returns
+        -------
+        query, feature : numpy.ndarray of int
+            Pairs of the position of the query box and the ID of a
+            candidate feature, sorted by query and then feature.
+
+        """
+
+        bboxes = numpy.asarray(bboxes, dtype=float).reshape(-1, 4)
+        return self._search(bboxes, _boxes_intersect)
+
+    def query_points(self, x, y):
+        """ Finds the features whose bounding boxes contain each of
+        the points ``(x, y)``. See :meth:`query_bboxes`. """
+
+        x = numpy.asarray(x, dtype=float).ravel()
+        y = numpy.asarray(y, dtype=float).ravel()
+        return self.query_bboxes(numpy.column_stack([x, y, x, y]))
+
+    def query_segments(self, x1, y1, x2, y2):
+        """ Finds the features whose bounding boxes are crossed by
+        each of the line segments from ``(x1, y1)`` to ``(x2, y2)``.
+        See :meth:`query_bboxes`. """
+
+        segments = numpy.column_stack([
+            numpy.asarray(c, dtype=float).ravel() for c in (x1, y1, x2, y2)
+        ])
+        return self._search(segments, _segments_intersect_boxes)
+
+    def save(self, path, checksum=''):
+        """ Writes the index to a .npz file. """
+
+        numpy.savez(
+            path,
+            checksum=numpy.array(checksum),
+            nodesize=numpy.array(self.nodesize),
+            order=self.order,
+            boxes=numpy.vstack(self.levels),
+            level_sizes=numpy.array([level.shape[0] for level in self.levels]),
+        )
+        return path
+
+    @classmethod
+    def load(cls, path, checksum=None):
+        """ Reads an index written by :meth:`save`. Returns None when
+        ``checksum`` is given and does not match the stored one. """
+
+        with numpy.load(path, allow_pickle=False) as data:
+            if checksum is not None and str(data['checksum']) != checksum:
+                return None
+            bounds = numpy.cumsum(data['level_sizes'])[:-1]
+            levels = numpy.split(data['boxes'], bounds)
+            return cls(nodesize=int(data['nodesize']), order=data['order'], levels=levels)
+
+    @classmethod
+    def from_shapefile(cls, path, persist=True, checksum=None):
+        """
+        Spatial index of the features of a shapefile.
+
+        Parameters
+        ----------
+        path : str
+            Path to the shapefile.
+        persist : bool, optional (True)
+            Toggles reading and writing the index from and to a
+            ``.sidx.npz`` file next to the shapefile. The stored index
+            is only reused if the checksum of the .shp file matches.
+        checksum : str, optional
+            The checksum of the .shp file, if the caller has already
+            computed it. Saves reading the file again.
+
+        Returns
+        -------
+        index : SpatialIndex
+
+        """
+
+        if not persist:
+            return cls(shapefile.read_bboxes(path))
+
+        sidecar = os.path.splitext(path)[0] + '.sidx.npz'
+        if checksum is None:
+            checksum = _checksum(path)
+        if os.path.exists(sidecar):
+            try:
+                index = cls.load(sidecar, checksum=checksum)
+            except (IOError, OSError, KeyError, ValueError):
+                index = None
+            if index is not None:
+                return index
+
+        index = cls(shapefile.read_bboxes(path))
+        try:
+            index.save(sidecar, checksum=checksum)
+        except (IOError, OSError):
+            pass
+        return index
+
+
+class PolygonSet(object):
+    """
+    Polygons stored as flat coordinate arrays.
+
+    The vertices of every ring of every polygon are concatenated into
+    ``x`` and ``y``. The rings of polygon ``n`` are the edges between
+    vertices ``vertex_ptr[n]`` and ``vertex_ptr[n + 1]``, except for
+    the (invalid) edges that join the end of one ring to the start of
+    the next, which are flagged in ``ring_break``.
+
+    Parameters
+    ----------
+    shapes : list of shapefile.Shape
+        The polygons.
+
+    Attributes
+    ----------
+    bbox : numpy.ndarray
+        An N x 4 array of the (xmin, ymin, xmax, ymax) of each polygon.
+    index : SpatialIndex
+        Spatial index of the polygons' bounding boxes.
+
+    """
+
+    def __init__(self, shapes, index=None):
+        self._index = index
+        self.size = len(shapes)
+        xs, ys, breaks = [], [], []
+        counts = numpy.zeros(self.size, dtype=int)
+        self.bbox = numpy.full((self.size, 4), numpy.nan)
+
+        for n, shape in enumerate(shapes):
+            points = numpy.asarray(shape.points, dtype=float).reshape(-1, 2)
+            counts[n] = points.shape[0]
+            xs.append(points[:, 0])
+            ys.append(points[:, 1])
+
+            # edges that start on the last vertex of a ring are invalid
+            is_break = numpy.zeros(points.shape[0], dtype=bool)
+            ends = numpy.append(numpy.asarray(shape.parts, dtype=int)[1:], points.shape[0]) - 1
+            is_break[ends[ends >= 0]] = True
+            breaks.append(is_break)
+
+            if points.shape[0] > 0:
+                self.bbox[n] = (points[:, 0].min(), points[:, 1].min(),
+                                points[:, 0].max(), points[:, 1].max())
+
+        self.vertex_ptr = numpy.zeros(self.size + 1, dtype=int)
+        self.vertex_ptr[1:] = numpy.cumsum(counts)
+        self.x = numpy.hstack(xs) if self.size > 0 else numpy.zeros(0)
+        self.y = numpy.hstack(ys) if self.size > 0 else numpy.zeros(0)
+        self.ring_break = numpy.hstack(breaks) if self.size > 0 else numpy.zeros(0, dtype=bool)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = SpatialIndex(self.bbox)
+        return self._index
+
+    @classmethod
+    def from_shapefile(cls, path, persist_index=True, checksum=None):
+        """ Reads the polygons of a shapefile along with their
+        (persisted) spatial index. ``checksum`` is passed to
+        :meth:`SpatialIndex.from_shapefile`. """
+
+        index = SpatialIndex.from_shapefile(path, persist=persist_index, checksum=checksum)
+        return cls(shapefile.read_shapes(path), index=index)
+
+    def edges(self, n):
+        """ The (x1, y1, x2, y2) coordinates of the edges of polygon
+        ``n``. """
+
+        start, stop = self.vertex_ptr[n], self.vertex_ptr[n + 1]
+        valid = ~self.ring_break[start:stop - 1]
+        x, y = self.x[start:stop], self.y[start:stop]
+        return x[:-1][valid], y[:-1][valid], x[1:][valid], y[1:][valid]
+
+    def contains(self, n, px, py, blocksize=2 ** 22):
+        """ Crossing number (even-odd) test of whether the points
+        ``(px, py)`` are inside polygon ``n``. Holes are handled by the
+        even-odd rule. The points are tested in blocks so that no more
+        than ``blocksize`` edge-point pairs are compared at once. """
+
+        edges = [e[:, None] for e in self.edges(n)]
+        step = max(blocksize // max(edges[0].shape[0], 1), 1)
+        if px.shape[0] <= step:
+            return self._crossings(edges, px, py)
+
+        return numpy.hstack([
+            self._crossings(edges, px[i:i + step], py[i:i + step])
+            for i in range(0, px.shape[0], step)
+        ])
+
+    def distance(self, n, px, py, blocksize=2 ** 22):
+        """ Distance from the points ``(px, py)`` to the boundary of
+        polygon ``n``. """
+
+        edges = [e[:, None] for e in self.edges(n)]
+        if edges[0].shape[0] == 0:
+            return numpy.full(px.shape[0], numpy.inf)
+
+        step = max(blocksize // edges[0].shape[0], 1)
+        return numpy.hstack([
+            self._distances(edges, px[i:i + step], py[i:i + step])
+            for i in range(0, max(px.shape[0], 1), step)
+        ])[:px.shape[0]]
+
+    @staticmethod
+    def _distances(edges, px, py):
+        x1, y1, x2, y2 = edges
+        dx, dy = x2 - x1, y2 - y1
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            t = ((px[None, :] - x1) * dx + (py[None, :] - y1) * dy) / (dx * dx + dy * dy)
+        t = numpy.clip(numpy.nan_to_num(t), 0, 1)
+        return numpy.hypot(x1 + t * dx - px[None, :], y1 + t * dy - py[None, :]).min(axis=0)
+
+    @staticmethod
+    def _crossings(edges, px, py):
+        x1, y1, x2, y2 = edges
+        px, py = px[None, :], py[None, :]
+
+        # edges that straddle the horizontal ray from each point...
+        straddles = (y1 > py) != (y2 > py)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            xcross = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+
+        # ...and cross it to the right of the point
+        crossings = straddles & (px < xcross)
+        return (crossings.sum(axis=0) % 2) == 1
+
+
+def _group_pairs(items, polygon_ids):
+    """ Sorts candidate (item, polygon) pairs by polygon and returns
+    them with the (start, stop) slices of each polygon's pairs. """
+
+    order = numpy.argsort(polygon_ids, kind='mergesort')
+    items, polygon_ids = items[order], polygon_ids[order]
+    if polygon_ids.shape[0] == 0:
+        return items, polygon_ids, []
+
+    starts = numpy.flatnonzero(numpy.r_[True, polygon_ids[1:] != polygon_ids[:-1]])
+    stops = numpy.append(starts[1:], polygon_ids.shape[0])
+    return items, polygon_ids, list(zip(starts, stops))
+
+
+def _map_groups(fxn, groups, n_workers):
+    """ Applies ``fxn`` to lists of groups, spread over ``n_workers``
+    threads. """
+
+    if n_workers <= 1 or len(groups) < 2:
+        return [fxn(groups)]
+
+    chunks = [c for c in numpy.array_split(numpy.arange(len(groups)), n_workers) if c.shape[0] > 0]
+    with futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(lambda c: fxn([groups[i] for i in c]), chunks))
+
+
+def _locate(polygons, px, py, point_ids, polygon_ids, groups):
+    hits = []
+    for first, last in groups:
+        candidates = point_ids[first:last]
+        inside = polygons.contains(polygon_ids[first], px[candidates], py[candidates])
+        hits.append(candidates[inside])
+    found = numpy.hstack(hits) if len(hits) > 0 else numpy.zeros(0, dtype=int)
+    which = numpy.repeat(polygon_ids[[g[0] for g in groups]], [h.shape[0] for h in hits])
+    return found, which.astype(int)
+
+
+def points_in_polygons(points, polygons, n_workers=1):
+    """
+    Finds the polygon that contains each point.
+
+    Parameters
+    ----------
+    points : array-like
+        An N x 2 array of point coordinates.
+    polygons : PolygonSet or list of shapefile.Shape
+        The polygons.
+    n_workers : int, optional (1)
+        Number of threads used to test the polygons in parallel. The
+        heavy lifting is done by numpy, which releases the GIL.
+
+    Returns
+    -------
+    index : numpy.ndarray of int
+        The position of the polygon that contains each point, or -1 if
+        the point is not inside any polygon. Points inside overlapping
+        polygons are assigned to the first one.
+
+    Notes
+    -----
+    Candidate (point, polygon) pairs are taken from the polygons'
+    :class:`SpatialIndex`, so that only the points inside a polygon's
+    bounding box are tested against its edges.
+
+    """
+
+    if not isinstance(polygons, PolygonSet):
+        polygons = PolygonSet(polygons)
+
+    points = numpy.asarray(points, dtype=float).reshape(-1, 2)
+    px, py = points[:, 0], points[:, 1]
+
+    point_ids, polygon_ids = polygons.index.query_points(px, py)
+    point_ids, polygon_ids, groups = _group_pairs(point_ids, polygon_ids)
+    results = _map_groups(
+        lambda g: _locate(polygons, px, py, point_ids, polygon_ids, g),
+        groups, n_workers
+    )
+
+    # keep the first polygon (in order) that contains each point
+    found = numpy.full(px.shape[0], len(polygons), dtype=int)
+    for hits, which in results:
+        numpy.minimum.at(found, hits, which)
+    found[found == len(polygons)] = -1
+    return found
+
+
+def join_points_to_polygons(point_path, polygon_path, point_fields, polygon_fields,
+                            n_workers=1, persist=True):
+    """
+    In-memory equivalent of intersecting a point layer with a polygon
+    layer (``arcpy.analysis.Intersect`` with ``join_attributes="ALL"``)
+    and loading the attribute table of the result.
+
+    Parameters
+    ----------
+    point_path, polygon_path : str
+        Paths to the point and polygon shapefiles.
+    point_fields, polygon_fields : list of str
+        Fields of each layer to be included in the result. Fields in
+        both lists are taken from the polygons.
+    n_workers : int, optional (1)
+        Number of threads used to test the polygons in parallel.
+    persist : bool, optional (True)
+        Toggles reading and writing the polygon of each point from and
+        to a ``.join.npz`` file next to the points. It is reused as
+        long as the checksums of both .shp files match, so edits to
+        the attributes of either layer do not redo the join.
+
+    Returns
+    -------
+    joined : numpy.ndarray
+        Record array with a row for each point that is inside one of
+        the polygons.
+
+    """
+
+    # the polygons' checksum keys both the join and their index
+    checksum = _checksum(polygon_path) if persist else None
+
+    def locate():
+        shapes = shapefile.read_shapes(point_path)
+        points = numpy.array([
+            s.points[0] if s.points.shape[0] > 0 else (numpy.nan, numpy.nan)
+            for s in shapes
+        ], dtype=float).reshape(-1, 2)
+
+        polygons = PolygonSet.from_shapefile(polygon_path, persist_index=persist,
+                                             checksum=checksum)
+        return {'index': points_in_polygons(points, polygons, n_workers=n_workers)}
+
+    key = '{}:{}'.format(_checksum(point_path), checksum) if persist else None
+    sidecar = os.path.splitext(point_path)[0] + '.join.npz'
+    index = _persisted(sidecar, key, locate, persist=persist)['index']
+    inside = index >= 0
+
+    polygon_fields = list(OrderedDict.fromkeys(polygon_fields))
+    point_fields = [f for f in OrderedDict.fromkeys(point_fields) if f not in polygon_fields]
+    polygon_table = shapefile.read_dbf(polygon_path, fields=polygon_fields)[index[inside]]
+    if len(point_fields) == 0:
+        return polygon_table
+
+    point_table = shapefile.read_dbf(point_path, fields=point_fields)[inside]
+    return recfunctions.merge_arrays([polygon_table, point_table], flatten=True,
+                                     usemask=False)
+
+
+# statistics supported by ``arcpy.management.Dissolve``
+DISSOLVE_STATISTICS = OrderedDict([
+    ('FIRST', lambda values: values[0]),
+    ('LAST', lambda values: values[-1]),
+    ('SUM', numpy.sum),
+    ('MEAN', numpy.mean),
+    ('MIN', numpy.min),
+    ('MAX', numpy.max),
+    ('RANGE', numpy.ptp),
+    ('STD', numpy.std),
+    ('COUNT', len),
+])
+
+
+def _line_segments(shapes):
+    """ The segments of the paths of polylines as an N x 4 array of
+    (x1, y1, x2, y2), with the feature and path of each segment. """
+
+    coords, features, paths = [], [], []
+    n_paths = 0
+    for n, shape in enumerate(shapes):
+        points = numpy.asarray(shape.points, dtype=float).reshape(-1, 2)
+        bounds = numpy.append(numpy.asarray(shape.parts, dtype=int), points.shape[0])
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            if stop - start < 2:
+                continue
+            path = points[start:stop]
+            coords.append(numpy.hstack([path[:-1], path[1:]]))
+            features.append(numpy.full(stop - start - 1, n, dtype=int))
+            paths.append(numpy.full(stop - start - 1, n_paths, dtype=int))
+            n_paths += 1
+
+    if len(coords) == 0:
+        return numpy.zeros((0, 4)), numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int)
+    return numpy.vstack(coords), numpy.hstack(features), numpy.hstack(paths)
+
+
+def _clip_to_polygon(polygons, n, edges, segments, tolerance):
+    """ The (segment, t0, t1) intervals of ``segments`` that are inside
+    polygon ``n`` or on its boundary. """
+
+    ex1, ey1, ex2, ey2 = edges
+    sx1, sy1, sx2, sy2 = segments.T
+    rx, ry = sx2 - sx1, sy2 - sy1
+    qx, qy = ex2 - ex1, ey2 - ey1
+
+    # parameters of the crossings of each segment with each edge
+    denom = rx[:, None] * qy - ry[:, None] * qx
+    dx, dy = ex1 - sx1[:, None], ey1 - sy1[:, None]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        t = (dx * qy - dy * qx) / denom
+        u = (dx * ry[:, None] - dy * rx[:, None]) / denom
+        snap = tolerance / numpy.hypot(rx, ry)[:, None]
+
+    # crossings within the tolerance of a vertex are snapped to it
+    crosses = (denom != 0) & (t > snap) & (t < 1 - snap) & (u >= 0) & (u <= 1)
+    rows, cols = numpy.nonzero(crosses)
+
+    m = segments.shape[0]
+    local = numpy.hstack([numpy.arange(m), numpy.arange(m), rows])
+    breaks = numpy.hstack([numpy.zeros(m), numpy.ones(m), t[rows, cols]])
+    order = numpy.lexsort((breaks, local))
+    local, breaks = local[order], breaks[order]
+
+    first = numpy.flatnonzero((local[1:] == local[:-1]) & (breaks[1:] > breaks[:-1]))
+    local, t0, t1 = local[first], breaks[first], breaks[first + 1]
+
+    # keep the pieces whose midpoints are inside or on the boundary
+    mid = (t0 + t1) / 2.
+    mx, my = sx1[local] + mid * rx[local], sy1[local] + mid * ry[local]
+    keep = polygons.contains(n, mx, my)
+    outside = numpy.flatnonzero(~keep)
+    keep[outside] = polygons.distance(n, mx[outside], my[outside]) <= tolerance
+    return local[keep], t0[keep], t1[keep]
+
+
+def _clip_groups(polygons, segments, segment_ids, polygon_ids, groups, tolerance,
+                 blocksize=2 ** 22):
+    results = []
+    for first, last in groups:
+        n = polygon_ids[first]
+        edges = polygons.edges(n)
+        ids = segment_ids[first:last]
+        step = max(blocksize // max(edges[0].shape[0], 1), 1)
+        for i in range(0, ids.shape[0], step):
+            local, t0, t1 = _clip_to_polygon(polygons, n, edges, segments[ids[i:i + step]], tolerance)
+            results.append((ids[i:i + step][local], numpy.full(local.shape[0], n, dtype=int), t0, t1))
+    return results
+
+
+def clip_lines(lines, polygons, tolerance=0.001, n_workers=1):
+    """
+    Splits polylines at the boundaries of polygons, keeping the pieces
+    inside each polygon. This is the in-memory equivalent of
+    ``arcpy.analysis.Intersect`` with a line and a polygon layer.
+
+    Parameters
+    ----------
+    lines : list of shapefile.Shape
+        The polylines.
+    polygons : PolygonSet or list of shapefile.Shape
+        The polygons.
+    tolerance : float, optional (0.001)
+        Distance, in map units, within which crossings are snapped to
+        the vertices of the lines and lines are considered to be on the
+        boundaries of the polygons. Pieces on the shared boundary of
+        two polygons are kept in both.
+    n_workers : int, optional (1)
+        Number of threads used to clip the polygons in parallel.
+
+    Returns
+    -------
+    feature_ids, polygon_ids : numpy.ndarray of int
+        The polyline and polygon of each piece.
+    paths : list of numpy.ndarray
+        The N x 2 coordinates of each piece, in the direction of the
+        original polyline.
+
+    """
+
+    if not isinstance(polygons, PolygonSet):
+        polygons = PolygonSet(polygons)
+
+    segments, features, paths = _line_segments(lines)
+    segment_ids, polygon_ids = polygons.index.query_segments(*segments.T)
+    segment_ids, polygon_ids, groups = _group_pairs(segment_ids, polygon_ids)
+    results = _map_groups(
+        lambda g: _clip_groups(polygons, segments, segment_ids, polygon_ids, g, tolerance),
+        groups, n_workers
+    )
+
+    results = [r for chunk in results for r in chunk]
+    if len(results) == 0:
+        return numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int), []
+
+    seg, poly, t0, t1 = [numpy.hstack(r) for r in zip(*results)]
+    order = numpy.lexsort((t0, seg, poly))
+    seg, poly, t0, t1 = seg[order], poly[order], t0[order], t1[order]
+
+    # consecutive intervals of the same path in the same polygon are
+    # joined into a single piece
+    same_path = (poly[1:] == poly[:-1]) & (paths[seg[1:]] == paths[seg[:-1]])
+    continues = same_path & (
+        ((seg[1:] == seg[:-1]) & (t0[1:] == t1[:-1])) |
+        ((seg[1:] == seg[:-1] + 1) & (t1[:-1] == 1) & (t0[1:] == 0))
+    )
+    starts = numpy.flatnonzero(numpy.r_[True, ~continues])
+    stops = numpy.append(starts[1:], seg.shape[0])
+
+    xy1, xy2 = segments[seg, :2], segments[seg, 2:]
+    begin = numpy.where((t0 == 0)[:, None], xy1, xy1 + t0[:, None] * (xy2 - xy1))
+    end = numpy.where((t1 == 1)[:, None], xy2, xy1 + t1[:, None] * (xy2 - xy1))
+
+    # breaks within a segment are only kept where a piece ends
+    vertex = (t1 == 1)
+    vertex[stops - 1] = True
+    pieces = [numpy.vstack([begin[a:a + 1], end[a:b][vertex[a:b]]]) for a, b in zip(starts, stops)]
+    return features[seg[starts]], poly[starts], pieces
+
+
+def _close(a, b, tolerance):
+    """ Pairwise test of whether the points ``a`` and ``b`` are within
+    ``tolerance`` of each other. """
+
+    return numpy.hypot(a[:, None, 0] - b[None, :, 0], a[:, None, 1] - b[None, :, 1]) <= tolerance
+
+
+def dissolve_paths(paths, tolerance=0.001):
+    """
+    Combines paths into a single multipart polyline, the way
+    ``arcpy.management.Dissolve`` does with ``DISSOLVE_LINES`` and
+    ``MULTI_PART``.
+
+    Paths are split at the interior vertices where other paths start
+    or end (e.g., where a tributary joins a stream), and paths that
+    meet end to start with no other path at that node are merged.
+
+    Parameters
+    ----------
+    paths : list of numpy.ndarray
+        The N x 2 coordinates of each path.
+    tolerance : float, optional (0.001)
+        Distance within which vertices are considered the same.
+
+    Returns
+    -------
+    shape : shapefile.Shape
+        The polyline, with its parts ordered by their first vertex
+        (south to north, then west to east).
+
+    """
+
+    paths = [numpy.asarray(p, dtype=float).reshape(-1, 2) for p in paths if len(p) > 1]
+    if len(paths) == 0:
+        return shapefile.Shape(shapefile.POLYLINE, numpy.zeros(0, dtype=int), numpy.zeros((0, 2)), None)
+
+    # split at the nodes of the other paths
+    ends = numpy.vstack([p[[0, -1]] for p in paths])
+    owner = numpy.repeat(numpy.arange(len(paths)), 2)
+    split = []
+    for n, path in enumerate(paths):
+        touches = _close(path[1:-1], ends[owner != n], tolerance).any(axis=1)
+        cuts = numpy.flatnonzero(touches) + 1
+        bounds = numpy.r_[0, cuts, path.shape[0] - 1]
+        split.extend(path[a:b + 1] for a, b in zip(bounds[:-1], bounds[1:]))
+
+    # merge paths that continue each other at nodes of degree two
+    merged = True
+    while merged:
+        merged = False
+        ends = numpy.vstack([p[[0, -1]] for p in split])
+        degree = _close(ends, ends, tolerance).sum(axis=1)
+        for n, path in enumerate(split):
+            if degree[2 * n + 1] != 2:
+                continue
+            nexts = numpy.flatnonzero(_close(path[-1:], ends[0::2], tolerance)[0])
+            nexts = nexts[nexts != n]
+            if nexts.shape[0] == 1:
+                other = nexts[0]
+                split[n] = numpy.vstack([path, split[other][1:]])
+                del split[other]
+                merged = True
+                break
+
+    firsts = numpy.vstack([p[0] for p in split])
+    lasts = numpy.vstack([p[-1] for p in split])
+    order = numpy.lexsort((lasts[:, 0], lasts[:, 1], firsts[:, 0], firsts[:, 1]))
+    split = [split[i] for i in order]
+    parts = numpy.cumsum([0] + [p.shape[0] for p in split[:-1]])
+    return shapefile.Shape(shapefile.POLYLINE, parts, numpy.vstack(split), None)
+
+
+def _stat_field(field, stat, dtype, taken=()):
+    # dbf field names are truncated to 10 characters, so (like arcpy)
+    # the ends of names that collide are replaced with a counter
+    name = '{}_{}'.format(stat, field.name)[:10]
+    n = 0
+    while name in taken:
+        n += 1
+        suffix = '_{}'.format(n)
+        name = '{}_{}'.format(stat, field.name)[:10 - len(suffix)] + suffix
+
+    if stat in ('FIRST', 'LAST', 'MIN', 'MAX', 'RANGE'):
+        return field._replace(name=name)
+    elif stat == 'COUNT':
+        return shapefile.DbfField(name, 'N', 9, 0)
+    return shapefile.infer_field(name, dtype)
+
+
+def aggregate_lines_by_polygons(line_path, polygon_path, output_path, by_fields,
+                                field_stat_tuples, tolerance=0.001, n_workers=1,
+                                persist=True):
+    """
+    Splits the lines of a shapefile at the boundaries of the polygons
+    of another, and dissolves the pieces into a multipart polyline for
+    each unique combination of ``by_fields``. This is the in-memory
+    equivalent of ``arcpy.analysis.Intersect`` followed by
+    ``arcpy.management.Dissolve``.
+
+    Parameters
+    ----------
+    line_path, polygon_path : str
+        Paths to the polyline and polygon shapefiles.
+    output_path : str
+        Path to the new shapefile, or the name of a dataset to be held
+        in memory (see :class:`propagator.backends.MemoryWorkspace`).
+    by_fields : list of str
+        The fields on which the pieces will be aggregated.
+    field_stat_tuples : list of tuples of str
+        List of two-tuples of a field and how it should be aggregated.
+        The statistics are those in ``DISSOLVE_STATISTICS`` and are
+        computed over the (line, polygon) pairs of each group. Results
+        are named like ``arcpy`` names them (e.g., "FIRST_WQ_1").
+    tolerance : float, optional (0.001)
+        See :func:`clip_lines`.
+    n_workers : int, optional (1)
+        Number of threads used to clip the polygons in parallel.
+    persist : bool, optional (True)
+        Toggles reading and writing the pieces of the split lines from
+        and to a ``.clip.npz`` file next to the lines. They are reused
+        as long as the checksums of both .shp files and the
+        ``tolerance`` match, so edits to the attributes of either layer
+        do not split the lines again.
+
+    Returns
+    -------
+    output_path : str
+
+    Notes
+    -----
+    Fields are looked up in ``polygon_path`` first, then in
+    ``line_path``. The output uses the projection of ``line_path``.
+
+    """
+
+    stats = [(field, stat.upper()) for field, stat in field_stat_tuples]
+    for _, stat in stats:
+        if stat not in DISSOLVE_STATISTICS:
+            raise ValueError("{} is not a valid statistic".format(stat))
+
+    # find the layer of each field
+    sources = OrderedDict()
+    for path in (polygon_path, line_path):
+        for field in shapefile.read_dbf_header(path)[0]:
+            sources.setdefault(field.name, (path, field))
+
+    names = list(OrderedDict.fromkeys(list(by_fields) + [f for f, _ in stats]))
+    missing = [name for name in names if name not in sources]
+    if len(missing) > 0:
+        raise ValueError("fields {} are not in {} or {}".format(missing, polygon_path, line_path))
+
+    # the polygons' checksum keys both the pieces and their index
+    checksum = _checksum(polygon_path) if persist else None
+
+    def clip():
+        polygons = PolygonSet.from_shapefile(polygon_path, persist_index=persist,
+                                             checksum=checksum)
+        lines = shapefile.read_shapes(line_path)
+        feature_ids, polygon_ids, paths = clip_lines(lines, polygons, tolerance=tolerance,
+                                                     n_workers=n_workers)
+        return {
+            'feature_ids': feature_ids,
+            'polygon_ids': polygon_ids,
+            'lengths': numpy.array([p.shape[0] for p in paths], dtype=int),
+            'coords': numpy.vstack(paths) if len(paths) > 0 else numpy.zeros((0, 2)),
+        }
+
+    key = None
+    if persist:
+        key = '{}:{}:{!r}'.format(_checksum(line_path), checksum, float(tolerance))
+    sidecar = os.path.splitext(line_path)[0] + '.clip.npz'
+    pieces = _persisted(sidecar, key, clip, persist=persist)
+    feature_ids, polygon_ids = pieces['feature_ids'], pieces['polygon_ids']
+    paths = []
+    if pieces['lengths'].shape[0] > 0:
+        paths = numpy.split(pieces['coords'], numpy.cumsum(pieces['lengths'])[:-1])
+
+    # attributes of each piece
+    values = {}
+    for path, ids in [(polygon_path, polygon_ids), (line_path, feature_ids)]:
+        fields = [name for name in names if sources[name][0] == path]
+        if len(fields) > 0:
+            table = shapefile.read_dbf(path, fields=fields)
+            for name in fields:
+                values[name] = table[name][ids]
+
+    keys = numpy.rec.fromarrays([values[f] for f in by_fields], names=list(by_fields))
+    groups, labels = numpy.unique(keys, return_inverse=True)
+    labels = labels.ravel()
+
+    # one record for each (line, polygon) pair, like Intersect creates
+    records = OrderedDict()
+    for n in numpy.lexsort((polygon_ids, feature_ids)):
+        records.setdefault((feature_ids[n], polygon_ids[n]), n)
+    record_ids = numpy.array(list(records.values()), dtype=int)
+
+    # every group has at least one piece and one record, so the slices
+    # of the (stably) sorted labels line up with `groups`
+    record_ids, _, record_slices = _group_pairs(record_ids, labels[record_ids])
+    piece_ids, _, piece_slices = _group_pairs(numpy.arange(labels.shape[0]), labels)
+
+    fields = [sources[f][1] for f in by_fields]
+    columns = [groups[f] for f in by_fields]
+    for name, stat in stats:
+        record_values = values[name][record_ids]
+        keep_dtype = stat in ('FIRST', 'LAST', 'MIN', 'MAX', 'RANGE')
+        result = numpy.array(
+            [DISSOLVE_STATISTICS[stat](record_values[start:stop]) for start, stop in record_slices],
+            dtype=record_values.dtype if keep_dtype else None
+        )
+        taken = [f.name for f in fields]
+        fields.append(_stat_field(sources[name][1], stat, result.dtype, taken))
+        columns.append(result)
+
+    table = numpy.rec.fromarrays(columns, names=[f.name for f in fields])
+    shapes = [
+        dissolve_paths([paths[i] for i in piece_ids[start:stop]], tolerance=tolerance)
+        for start, stop in piece_slices
+    ]
+
+    if backends.is_memory(output_path):
+        dataset = backends.MemoryDataset(table, fields, shapefile.POLYLINE, shapes,
+                                         projection=shapefile.read_projection(line_path),
+                                         encoding=shapefile.read_encoding(polygon_path))
+        return backends.MEMORY.put(output_path, dataset)
+
+    shapefile.write_shapes(output_path, shapefile.POLYLINE, shapes)
+    shapefile.write_dbf(output_path, table, fields=fields)
+    for path, ext in [(line_path, '.prj'), (polygon_path, '.cpg')]:
+        source = os.path.splitext(path)[0] + ext
+        if os.path.exists(source):
+            shutil.copyfile(source, os.path.splitext(output_path)[0] + ext)
+    return output_path
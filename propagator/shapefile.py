@@ -0,0 +1,845 @@
+""" Pure python/numpy reading and writing of ESRI shapefiles.
+
+This contains just enough of the shapefile specification (the .shp
+geometries, the .shx index, and the .dbf attribute table) for
+``propagator`` to read and write its inputs and outputs without
+``arcpy``. The 2-D, Z, and M variants of points, multipoints,
+polylines, and polygons can be read. Z values are kept, M values are
+dropped.
+
+See the ESRI Shapefile Technical Description (https://goo.gl/wGmc0F)
+and the dBASE III file format for details.
+
+Released under the BSD 3-clause license (see LICENSE file for more info)
+
+"""
+
+
+import os
+import struct
+import shutil
+import datetime
+from collections import namedtuple
+
+import numpy
+
+
+# a single attribute table field
+DbfField = namedtuple("DbfField", ("name", "type", "size", "decimals"))
+
+# a single geometry. ``parts`` are the positions in ``points`` (an
+# N x 2 array) where each ring or path starts. ``z`` is None unless the
+# shapefile has Z values.
+Shape = namedtuple("Shape", ("shapetype", "parts", "points", "z"))
+
+NULL = 0
+POINT = 1
+POLYLINE = 3
+POLYGON = 5
+MULTIPOINT = 8
+
+# the base type of every shape type (e.g., PolygonZ -> Polygon)
+BASE_SHAPETYPES = {
+    0: NULL,
+    1: POINT, 11: POINT, 21: POINT,
+    3: POLYLINE, 13: POLYLINE, 23: POLYLINE,
+    5: POLYGON, 15: POLYGON, 25: POLYGON,
+    8: MULTIPOINT, 18: MULTIPOINT, 28: MULTIPOINT,
+}
+
+# all of the files that make up a shapefile
+EXTENSIONS = ('.shp', '.shx', '.dbf', '.prj', '.cpg', '.sbn', '.sbx',
+              '.shp.xml', '.qix', '.sidx.npz', '.join.npz', '.clip.npz')
+
+# spatial indexes and cached spatial relationships (see
+# :mod:`propagator.geometry`) that are rebuilt rather than copied
+INDEX_EXTENSIONS = ('.sbn', '.sbx', '.qix', '.sidx.npz', '.join.npz', '.clip.npz')
+
+# used when a shapefile does not have a .cpg file
+DEFAULT_ENCODING = 'latin-1'
+
+# how ArcGIS writes missing M values
+NO_DATA = -1.7976931348623157e+308
+
+_DBF_TERMINATOR = b'\x0d'
+_DBF_EOF = b'\x1a'
+
+
+def _sidecar(path, ext):
+    return os.path.splitext(path)[0] + ext
+
+
+def exists(path):
+    """ Checks that the .shp and .dbf files of a shapefile exist. """
+    return os.path.exists(_sidecar(path, '.shp')) and os.path.exists(_sidecar(path, '.dbf'))
+
+
+def copy(src, dst):
+    """ Copies all of the files that make up a shapefile. The spatial
+    indexes and cached relationships (``INDEX_EXTENSIONS``) are not
+    copied. """
+
+    for ext in EXTENSIONS:
+        if ext in INDEX_EXTENSIONS:
+            continue
+        if os.path.exists(_sidecar(src, ext)):
+            shutil.copyfile(_sidecar(src, ext), _sidecar(dst, ext))
+    return dst
+
+
+def delete(path):
+    """ Deletes all of the files that make up a shapefile. """
+    for ext in EXTENSIONS:
+        if os.path.exists(_sidecar(path, ext)):
+            os.remove(_sidecar(path, ext))
+
+
+def read_encoding(path):
+    """ The text encoding of a shapefile's attribute table, as given by
+    its .cpg file. """
+
+    cpg = _sidecar(path, '.cpg')
+    if os.path.exists(cpg):
+        with open(cpg, 'r') as f:
+            encoding = f.read().strip()
+        if encoding:
+            return encoding
+    return DEFAULT_ENCODING
+
+
+def read_projection(path):
+    """ The coordinate system of a shapefile as the well-known text in
+    its .prj file, or None if it does not have one. """
+
+    prj = _sidecar(path, '.prj')
+    if os.path.exists(prj):
+        with open(prj, 'r') as f:
+            return f.read().strip() or None
+    return None
+
+
+def same_projection(*paths):
+    """ Checks that all of the shapefiles have identical .prj files,
+    and therefore that their coordinates can be compared directly. """
+
+    return len(set(read_projection(path) for path in paths)) <= 1
+
+
+def read_dbf_header(path):
+    """
+    Reads the header of a .dbf file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the shapefile or its .dbf file.
+
+    Returns
+    -------
+    fields : list of DbfField
+    n_records : int
+    header_length, record_length : int
+        The number of bytes in the header and in each record.
+
+    """
+
+    with open(_sidecar(path, '.dbf'), 'rb') as dbf:
+        header = dbf.read(32)
+        n_records, header_length, record_length = struct.unpack('<IHH', header[4:12])
+        n_fields = (header_length - 33) // 32
+        raw = dbf.read(32 * n_fields)
+
+    fields = []
+    for n in range(n_fields):
+        desc = raw[32 * n:32 * (n + 1)]
+        name = desc[:11].split(b'\x00')[0].decode('ascii').strip()
+        fieldtype = desc[11:12].decode('ascii')
+        size, decimals = struct.unpack('<BB', desc[16:18])
+        fields.append(DbfField(name, fieldtype, size, decimals))
+
+    return fields, n_records, header_length, record_length
+
+
+def dbf_record_dtype(fields, record_length=None):
+    """ The raw (byte string) numpy dtype of the records of a .dbf file
+    with the given fields, including the leading deletion flag. Records
+    are padded to ``record_length`` if it is given. """
+
+    names = ['_deleted']
+    formats = ['S1']
+    offsets = [0]
+    for f in fields:
+        names.append(str(f.name))
+        formats.append('S{}'.format(f.size))
+        offsets.append(offsets[-1] + int(formats[-2][1:]))
+
+    itemsize = offsets[-1] + fields[-1].size if len(fields) > 0 else 1
+    return numpy.dtype({
+        'names': names,
+        'formats': formats,
+        'offsets': offsets,
+        'itemsize': max(itemsize, record_length or 0),
+    })
+
+
+class DbfTable(object):
+    """
+    Read-only, memory-mapped view of a .dbf file.
+
+    Nothing but the header is read when the table is opened. The
+    fixed-width records are exposed without copying as a structured
+    array of raw bytes (``records``), and each field is decoded into a
+    numpy array the first time it is accessed.
+
+    Parameters
+    ----------
+    path : str
+        Path to the shapefile or its .dbf file.
+    encoding : str, optional
+        The text encoding of the file. Read from the .cpg file if not
+        provided.
+
+    Examples
+    --------
+    >>> from propagator import shapefile
+    >>> with shapefile.DbfTable('subcatchments.shp') as dbf:
+    ...     ids = dbf['CatchID']
+
+    """
+
+    def __init__(self, path, encoding=None):
+        self.path = _sidecar(path, '.dbf')
+        self.encoding = encoding or read_encoding(path)
+        self.fields, n_records, header_length, record_length = read_dbf_header(path)
+        self._lookup = dict((f.name, f) for f in self.fields)
+        self._columns = {}
+
+        dtype = dbf_record_dtype(self.fields, record_length)
+        available = (os.path.getsize(self.path) - header_length) // dtype.itemsize
+        n_records = max(min(n_records, available), 0)
+        if n_records > 0:
+            self.records = numpy.memmap(self.path, dtype=dtype, mode='r',
+                                        offset=header_length, shape=(n_records,))
+        else:
+            self.records = numpy.zeros(0, dtype=dtype)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.records.shape[0]
+
+    def __contains__(self, name):
+        return name in self._lookup
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    @property
+    def names(self):
+        return [f.name for f in self.fields]
+
+    @property
+    def deleted(self):
+        """ Boolean array flagging the records marked as deleted. """
+        return self.records['_deleted'] == b'*'
+
+    def field(self, name):
+        """ The :class:`DbfField` definition of a field. """
+        if name not in self._lookup:
+            raise ValueError('field {} is not in {}'.format(name, self.path))
+        return self._lookup[name]
+
+    def read(self, fields=None, start=0, stop=None):
+        """
+        Decodes a range of records into a structured array. Unlike
+        :meth:`column`, nothing is cached, so reading a large table in
+        slices keeps memory use bounded by the size of each slice.
+
+        Parameters
+        ----------
+        fields : list of str, optional
+            The fields to read. All fields are read if not provided.
+        start, stop : int, optional
+            The range of records to read.
+
+        Returns
+        -------
+        table : numpy.ndarray
+
+        """
+
+        if fields is None:
+            fields = self.names
+
+        missing = [name for name in fields if name not in self]
+        if len(missing) > 0:
+            raise ValueError('fields {} are not in {}'.format(missing, self.path))
+
+        records = self.records[start:stop]
+        dtype = [(str(name), field_dtype(self.field(name))) for name in fields]
+        table = numpy.empty(records.shape[0], dtype=dtype)
+        for name in fields:
+            table[name] = decode_column(records[name], self.field(name), self.encoding)
+        return table
+
+    def column(self, name):
+        """ The decoded values of a field. Each field is only decoded
+        once. """
+        if name not in self._columns:
+            self._columns[name] = decode_column(self.records[name], self.field(name),
+                                                self.encoding)
+        return self._columns[name]
+
+    def close(self):
+        """ Releases the memory map. Columns that have already been
+        decoded remain valid. """
+        self.records = self.records[:0].copy()
+        self._columns = {}
+
+
+def field_dtype(field):
+    """ The numpy dtype used to represent a .dbf field. This mimics
+    what ``arcpy.da.FeatureClassToNumPyArray`` returns. """
+
+    if field.type == 'C':
+        return numpy.dtype('<U{}'.format(max(field.size, 1)))
+    elif field.type in ('N', 'F') and field.decimals == 0 and field.size < 10:
+        return numpy.dtype('<i4')
+    elif field.type in ('N', 'F'):
+        return numpy.dtype('<f8')
+    elif field.type == 'L':
+        return numpy.dtype('bool')
+    elif field.type == 'D':
+        return numpy.dtype('datetime64[D]')
+    raise ValueError("unsupported dbf field type '{}'".format(field.type))
+
+
+def decode_column(raw, field, encoding=DEFAULT_ENCODING):
+    """ Converts the raw bytes of a .dbf field into a numpy array. """
+
+    dtype = field_dtype(field)
+    if field.type == 'C':
+        return numpy.char.decode(numpy.char.rstrip(raw), encoding, 'replace').astype(dtype)
+
+    stripped = numpy.char.strip(raw)
+    if field.type == 'L':
+        return numpy.in1d(stripped, [b'T', b't', b'Y', b'y'])
+
+    blank = (stripped == b'') | (numpy.char.count(stripped, b'*') > 0)
+    if field.type == 'D':
+        text = numpy.where(blank | (stripped == b'00000000'), b'NaT', stripped)
+        dates = [t[:4] + b'-' + t[4:6] + b'-' + t[6:8] if t != b'NaT' else t for t in text.tolist()]
+        return numpy.array([d.decode('ascii') for d in dates], dtype=dtype)
+
+    # shapefiles do not have real nulls. blank numbers are zero in
+    # integer fields and nan in floating point fields.
+    if dtype.kind == 'i':
+        return numpy.where(blank, b'0', stripped).astype(float).astype(dtype)
+    return numpy.where(blank, b'nan', stripped).astype(dtype)
+
+
+def read_dbf(path, fields=None, encoding=None):
+    """
+    Reads a .dbf attribute table into a numpy record array.
+
+    Parameters
+    ----------
+    path : str
+        Path to the shapefile or its .dbf file.
+    fields : list of str, optional
+        The fields to read. All fields are read if not provided.
+    encoding : str, optional
+        The text encoding of the file. Read from the .cpg file if not
+        provided.
+
+    Returns
+    -------
+    table : numpy.ndarray
+        Structured array of the records. Records flagged as deleted
+        are kept so that the rows stay aligned with the geometries.
+
+    """
+
+    # only the requested fields are ever parsed
+    with DbfTable(path, encoding=encoding) as dbf:
+        return dbf.read(fields)
+
+
+def update_dbf(path, columns, rows=None, encoding=None):
+    """
+    Overwrites the values of existing fields of a .dbf file in place.
+    The fixed-width slots of the fields are patched through a
+    writable memory map, so the rest of the file is never rewritten.
+
+    Parameters
+    ----------
+    path : str
+        Path to the shapefile or its .dbf file.
+    columns : dict or numpy.ndarray
+        New values of each field to be updated, keyed by field name
+        (or as a structured array). Values can be scalars or arrays
+        aligned with ``rows``.
+    rows : array of int, optional
+        Positions of the records to be updated. All records are
+        updated if not provided.
+    encoding : str, optional
+        The text encoding of the file. Read from the .cpg file if not
+        provided.
+
+    Returns
+    -------
+    path : str
+
+    """
+
+    if encoding is None:
+        encoding = read_encoding(path)
+
+    names = columns.dtype.names if hasattr(columns, 'dtype') else list(columns.keys())
+    specs, n_records, header_length, record_length = read_dbf_header(path)
+    lookup = dict((f.name, f) for f in specs)
+    missing = [name for name in names if name not in lookup]
+    if len(missing) > 0:
+        raise ValueError('fields {} are not in {}'.format(missing, path))
+
+    if n_records == 0:
+        return path
+
+    records = numpy.memmap(_sidecar(path, '.dbf'), mode='r+', offset=header_length,
+                           dtype=dbf_record_dtype(specs, record_length), shape=(n_records,))
+    if rows is None:
+        rows = slice(None)
+    n_rows = numpy.arange(n_records)[rows].shape[0]
+
+    for name in names:
+        values = numpy.broadcast_to(numpy.asarray(columns[name]), (n_rows,))
+        records[name][rows] = encode_column(values, lookup[name], encoding)
+
+    records.flush()
+    del records
+    return path
+
+
+def infer_field(name, dtype):
+    """ Picks a .dbf field definition that can hold the values of a
+    numpy dtype. Floats are stored like ArcGIS stores doubles. """
+
+    dtype = numpy.dtype(dtype)
+    if dtype.kind in ('U', 'S'):
+        size = dtype.itemsize // 4 if dtype.kind == 'U' else dtype.itemsize
+        return DbfField(name, 'C', min(max(size, 1), 254), 0)
+    elif dtype.kind in ('i', 'u'):
+        return DbfField(name, 'N', 9 if dtype.itemsize <= 4 else 18, 0)
+    elif dtype.kind == 'f':
+        return DbfField(name, 'F', 19, 11)
+    elif dtype.kind == 'b':
+        return DbfField(name, 'L', 1, 0)
+    elif dtype.kind == 'M':
+        return DbfField(name, 'D', 8, 0)
+    raise ValueError("cannot store {} values in a dbf file".format(dtype))
+
+
+def encode_column(values, field, encoding=DEFAULT_ENCODING):
+    """ Converts a numpy array into the raw, fixed width bytes of a .dbf
+    field. Values that do not fit are truncated (text) or written in
+    exponential notation (numbers). """
+
+    values = numpy.asarray(values)
+    size = field.size
+    if field.type == 'C':
+        text = numpy.char.encode(values.astype(numpy.unicode_), encoding)
+        return numpy.char.ljust(text.astype('S{}'.format(size)), size)
+    elif field.type == 'L':
+        return numpy.where(values.astype(bool), b'T', b'F').astype('S1')
+    elif field.type == 'D':
+        text = numpy.datetime_as_string(values.astype('datetime64[D]'))
+        return numpy.char.replace(numpy.char.encode(text, 'ascii'), b'-', b'').astype('S8')
+
+    values = values.astype(float)
+    if values.size == 0:
+        return numpy.empty(values.shape, dtype='S{}'.format(size))
+    elif field.decimals == 0:
+        text = numpy.char.mod('%{}.0f'.format(size), numpy.round(values))
+    else:
+        text = numpy.char.mod('%{}.{}f'.format(size, field.decimals), values)
+
+    too_long = numpy.char.str_len(text) > size
+    if too_long.any():
+        precision = max(size - 7, 1)
+        text[too_long] = numpy.char.mod('%{}.{}e'.format(size, precision), values[too_long])
+
+    text = numpy.where(numpy.isfinite(values), text, ' ' * size)
+    return numpy.char.encode(text, 'ascii').astype('S{}'.format(size))
+
+
+def write_dbf(path, table, fields=None, encoding=None):
+    """
+    Writes a numpy record array as a .dbf attribute table.
+
+    Parameters
+    ----------
+    path : str
+        Path to the shapefile or its .dbf file.
+    table : numpy.ndarray
+        Structured array of the records.
+    fields : list of DbfField, optional
+        The definitions of the fields. Inferred from the dtype of
+        ``table`` when not provided. Pass the fields from
+        :func:`read_dbf_header` to keep an existing file's definitions.
+    encoding : str, optional
+        The text encoding of the file. Read from the .cpg file if not
+        provided.
+
+    Returns
+    -------
+    path : str
+
+    """
+
+    if encoding is None:
+        encoding = read_encoding(path)
+
+    if fields is None:
+        fields = [infer_field(name, table.dtype[name]) for name in table.dtype.names]
+
+    records = numpy.empty(table.shape[0], dtype=dbf_record_dtype(fields))
+    records['_deleted'] = b' '
+    for field in fields:
+        records[field.name] = encode_column(table[field.name], field, encoding)
+
+    today = datetime.date.today()
+    header_length = 32 + 32 * len(fields) + 1
+    header = struct.pack('<BBBBIHH20x', 3, today.year - 1900, today.month, today.day,
+                         table.shape[0], header_length, records.dtype.itemsize)
+
+    with open(_sidecar(path, '.dbf'), 'wb') as dbf:
+        dbf.write(header)
+        for field in fields:
+            name = field.name.encode('ascii')[:10]
+            dbf.write(struct.pack('<11sc4xBB14x', name, field.type.encode('ascii'),
+                                  field.size, field.decimals))
+        dbf.write(_DBF_TERMINATOR)
+        dbf.write(records.tobytes())
+        dbf.write(_DBF_EOF)
+
+    return path
+
+
+def read_shp_header(path):
+    """ The shape type and bounding box (xmin, ymin, xmax, ymax) of a
+    shapefile. """
+
+    with open(_sidecar(path, '.shp'), 'rb') as shp:
+        header = shp.read(100)
+    shapetype = struct.unpack('<i', header[32:36])[0]
+    bbox = struct.unpack('<4d', header[36:68])
+    return shapetype, bbox
+
+
+def count_records(path):
+    """ The number of geometries in a shapefile, read from the size of
+    its .shx index. """
+
+    shx = _sidecar(path, '.shx')
+    if os.path.exists(shx):
+        return (os.path.getsize(shx) - 100) // 8
+    return len(read_shapes(path))
+
+
+def _parse_shape(content):
+    shapetype = struct.unpack('<i', content[:4])[0]
+    base = BASE_SHAPETYPES[shapetype]
+    has_z = 10 < shapetype < 20
+
+    if base == NULL:
+        return Shape(shapetype, numpy.zeros(0, dtype=int), numpy.zeros((0, 2)), None)
+
+    if base == POINT:
+        points = numpy.frombuffer(content, dtype='<f8', count=2, offset=4).reshape(1, 2)
+        z = numpy.frombuffer(content, dtype='<f8', count=1, offset=20) if has_z else None
+        return Shape(shapetype, numpy.zeros(1, dtype=int), points.copy(), z)
+
+    if base == MULTIPOINT:
+        n_parts = 0
+        n_points = struct.unpack('<i', content[36:40])[0]
+        start = 40
+    else:
+        n_parts, n_points = struct.unpack('<ii', content[36:44])
+        start = 44
+
+    parts = numpy.frombuffer(content, dtype='<i4', count=n_parts, offset=start).astype(int)
+    if base == MULTIPOINT:
+        parts = numpy.zeros(1, dtype=int)
+    start += 4 * n_parts
+    points = numpy.frombuffer(content, dtype='<f8', count=2 * n_points, offset=start)
+    z = None
+    if has_z:
+        z = numpy.frombuffer(content, dtype='<f8', count=n_points,
+                             offset=start + 16 * n_points + 16).copy()
+    return Shape(shapetype, parts, points.reshape(n_points, 2).copy(), z)
+
+
+def _read_shx(shx):
+    """ The offset and content length (in 16-bit words) of every record
+    listed in a .shx file. """
+
+    # `numpy.fromfile` only accepts an `offset` in numpy >= 1.17
+    with open(shx, 'rb') as f:
+        f.seek(100)
+        return numpy.fromfile(f, dtype='>i4').reshape(-1, 2)
+
+
+def read_shapes(path, start=0, stop=None):
+    """
+    Reads the geometries in a shapefile.
+
+    Parameters
+    ----------
+    path : str
+        Path to the shapefile.
+    start, stop : int, optional
+        The range of records to read. When the .shx index exists, only
+        the bytes of those records are read from the .shp file.
+
+    Returns
+    -------
+    shapes : list of Shape
+
+    """
+
+    shx = _sidecar(path, '.shx')
+    if not os.path.exists(shx):
+        with open(_sidecar(path, '.shp'), 'rb') as shp:
+            data = shp.read()
+
+        shapes = []
+        position = 100
+        while position + 8 <= len(data):
+            _, length = struct.unpack('>ii', data[position:position + 8])
+            content = data[position + 8:position + 8 + 2 * length]
+            shapes.append(_parse_shape(content))
+            position += 8 + 2 * length
+        return shapes[start:stop]
+
+    # offsets and content lengths of each record, in 16-bit words
+    index = _read_shx(shx)[start:stop]
+    if index.shape[0] == 0:
+        return []
+
+    offsets = 2 * index[:, 0].astype(int)
+    lengths = 2 * index[:, 1].astype(int)
+    begin = offsets[0]
+    with open(_sidecar(path, '.shp'), 'rb') as shp:
+        shp.seek(begin)
+        data = shp.read(offsets[-1] + 8 + lengths[-1] - begin)
+
+    return [
+        _parse_shape(data[offset - begin + 8:offset - begin + 8 + length])
+        for offset, length in zip(offsets, lengths)
+    ]
+
+
+def read_bboxes(path):
+    """
+    Reads the bounding box of every geometry in a shapefile without
+    parsing the geometries. When the .shx index exists, only the few
+    bytes at the start of each record are read.
+
+    Parameters
+    ----------
+    path : str
+        Path to the shapefile.
+
+    Returns
+    -------
+    bboxes : numpy.ndarray
+        An N x 4 array of the (xmin, ymin, xmax, ymax) of each
+        geometry. Rows of null geometries are NaN.
+
+    """
+
+    shx = _sidecar(path, '.shx')
+    if not os.path.exists(shx):
+        bboxes = numpy.full((count_records(path), 4), numpy.nan)
+        for n, shape in enumerate(read_shapes(path)):
+            if shape.points.shape[0] > 0:
+                bboxes[n] = _bbox(shape.points)
+        return bboxes
+
+    index = _read_shx(shx)
+    bboxes = numpy.full((index.shape[0], 4), numpy.nan)
+    if index.shape[0] == 0:
+        return bboxes
+
+    # shape type and bounding box (or point) after the record header
+    shp = numpy.memmap(_sidecar(path, '.shp'), dtype=numpy.uint8, mode='r')
+    starts = 2 * index[:, 0].astype(int) + 8
+    lengths = 2 * index[:, 1].astype(int)
+    positions = numpy.minimum(starts[:, None] + numpy.arange(36), shp.shape[0] - 1)
+    content = numpy.array(shp[positions])
+    del shp
+
+    shapetypes = content[:, :4].copy().view('<i4')[:, 0]
+    coords = content[:, 4:].copy().view('<f8')
+    base = numpy.array([BASE_SHAPETYPES.get(t, NULL) for t in shapetypes])
+
+    is_point = (base == POINT) & (lengths >= 20)
+    bboxes[is_point] = coords[is_point][:, [0, 1, 0, 1]]
+
+    has_bbox = (base != NULL) & (base != POINT) & (lengths >= 36)
+    bboxes[has_bbox] = coords[has_bbox]
+    return bboxes
+
+
+def _bbox(points):
+    if points.shape[0] == 0:
+        return (0., 0., 0., 0.)
+    return (points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max())
+
+
+def _encode_shape(shapetype, shape):
+    base = BASE_SHAPETYPES[shapetype]
+    has_z = 10 < shapetype < 20
+    points = numpy.asarray(shape.points, dtype='<f8').reshape(-1, 2)
+
+    if base == NULL or points.shape[0] == 0:
+        return struct.pack('<i', NULL)
+
+    z = numpy.zeros(points.shape[0]) if shape.z is None else numpy.asarray(shape.z, dtype='<f8')
+    if base == POINT:
+        content = struct.pack('<i2d', shapetype, points[0, 0], points[0, 1])
+        if has_z:
+            content += struct.pack('<2d', z[0], NO_DATA)
+        return content
+
+    content = struct.pack('<i4d', shapetype, *_bbox(points))
+    if base == MULTIPOINT:
+        content += struct.pack('<i', points.shape[0])
+    else:
+        parts = numpy.asarray(shape.parts, dtype='<i4')
+        content += struct.pack('<ii', parts.shape[0], points.shape[0]) + parts.tobytes()
+    content += points.tobytes()
+
+    if has_z:
+        content += struct.pack('<2d', z.min(), z.max()) + z.astype('<f8').tobytes()
+        content += struct.pack('<2d', NO_DATA, NO_DATA)
+        content += numpy.full(points.shape[0], NO_DATA, dtype='<f8').tobytes()
+    return content
+
+
+def _file_header(shapetype, length, bbox, zrange):
+    mrange = (NO_DATA, NO_DATA) if shapetype > 10 else (0., 0.)
+    return (
+        struct.pack('>i20xi', 9994, length) +
+        struct.pack('<ii', 1000, shapetype) +
+        struct.pack('<4d', *bbox) +
+        struct.pack('<4d', zrange[0], zrange[1], mrange[0], mrange[1])
+    )
+
+
+def write_shapes(path, shapetype, shapes):
+    """
+    Writes geometries to the .shp and .shx files of a shapefile.
+
+    Parameters
+    ----------
+    path : str
+        Path to the shapefile.
+    shapetype : int
+        The shape type of the file (e.g., ``POLYGON``). Every shape is
+        written as this type, or as a null shape if it has no points.
+    shapes : list of Shape
+
+    Returns
+    -------
+    path : str
+
+    """
+
+    contents = [_encode_shape(shapetype, shape) for shape in shapes]
+
+    points = [numpy.asarray(s.points).reshape(-1, 2) for s in shapes]
+    points = numpy.vstack(points) if len(points) > 0 else numpy.zeros((0, 2))
+    zs = [numpy.asarray(s.z) for s in shapes if s.z is not None and len(s.z) > 0]
+    zrange = (min(z.min() for z in zs), max(z.max() for z in zs)) if zs else (0., 0.)
+    bbox = _bbox(points)
+
+    shp_length = 50 + sum(4 + len(c) // 2 for c in contents)
+    shx_length = 50 + 4 * len(contents)
+
+    with open(_sidecar(path, '.shp'), 'wb') as shp, open(_sidecar(path, '.shx'), 'wb') as shx:
+        shp.write(_file_header(shapetype, shp_length, bbox, zrange))
+        shx.write(_file_header(shapetype, shx_length, bbox, zrange))
+        offset = 50
+        for n, content in enumerate(contents, 1):
+            shp.write(struct.pack('>ii', n, len(content) // 2) + content)
+            shx.write(struct.pack('>ii', offset, len(content) // 2))
+            offset += 4 + len(content) // 2
+
+    return path
+
+
+def _rings(shape):
+    bounds = list(shape.parts) + [shape.points.shape[0]]
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        yield shape.points[start:stop]
+
+
+def shape_area(shape):
+    """ The area of a polygon. Holes (counter-clockwise rings) are
+    subtracted. Other shapes have no area. """
+
+    if BASE_SHAPETYPES[shape.shapetype] != POLYGON:
+        return 0.
+
+    area = 0.
+    for ring in _rings(shape):
+        x, y = ring[:, 0], ring[:, 1]
+        # outer rings are clockwise, which is a negative shoelace area
+        area -= 0.5 * numpy.sum(x[:-1] * y[1:] - x[1:] * y[:-1])
+    return area
+
+
+def shape_length(shape):
+    """ The length of a polyline, or the perimeter of a polygon. """
+
+    if BASE_SHAPETYPES[shape.shapetype] not in (POLYLINE, POLYGON):
+        return 0.
+
+    return sum(numpy.hypot(*numpy.diff(ring, axis=0).T).sum() for ring in _rings(shape))
+
+
+def shape_centroid(shape):
+    """ The centroid of a shape, like ``arcpy``'s ``SHAPE@XY`` token.
+    Polygons are weighted by area, polylines by length, and points
+    equally. """
+
+    base = BASE_SHAPETYPES[shape.shapetype]
+    if shape.points.shape[0] == 0:
+        return (numpy.nan, numpy.nan)
+
+    if base == POLYGON:
+        cx = cy = area = 0.
+        for ring in _rings(shape):
+            x, y = ring[:, 0], ring[:, 1]
+            cross = x[:-1] * y[1:] - x[1:] * y[:-1]
+            area -= 0.5 * cross.sum()
+            cx -= numpy.sum((x[:-1] + x[1:]) * cross) / 6.
+            cy -= numpy.sum((y[:-1] + y[1:]) * cross) / 6.
+        if area != 0:
+            return (cx / area, cy / area)
+
+    elif base == POLYLINE:
+        weights, centers = [], []
+        for ring in _rings(shape):
+            weights.append(numpy.hypot(*numpy.diff(ring, axis=0).T))
+            centers.append((ring[:-1] + ring[1:]) / 2.)
+        weights, centers = numpy.hstack(weights), numpy.vstack(centers)
+        if weights.sum() > 0:
+            return tuple(numpy.average(centers, axis=0, weights=weights))
+
+    return tuple(shape.points.mean(axis=0))
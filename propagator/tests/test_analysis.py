@@ -6,9 +6,14 @@ import numpy
 import nose.tools as nt
 import numpy.testing as nptest
 import propagator.testing as pptest
+import mock
 
 from propagator import analysis
 from propagator import utils
+from propagator import topology
+from propagator import backends
+from propagator import shapefile
+from propagator import geometry
 
 
 SIMPLE_SUBCATCHMENTS = numpy.array(
@@ -99,6 +104,39 @@ class Test_trace_upstream(object):
         upstream = analysis.trace_upstream(self.subcatchments, 'A2', include_base=True)
         nptest.assert_array_equal(upstream, self.expected_right_with_base)
 
+    def test_with_graph(self):
+        graph = topology.WatershedGraph(self.subcatchments, 'ID', 'DS_ID')
+        upstream = analysis.trace_upstream(self.subcatchments, 'A1', include_base=True,
+                                           graph=graph)
+        nptest.assert_array_equal(upstream, self.expected_left_with_base)
+
+    def test_ordered_view(self):
+        graph = topology.WatershedGraph(self.subcatchments, 'ID', 'DS_ID')
+        ordered = graph.reorder(self.subcatchments)
+        upstream = analysis.trace_upstream(self.subcatchments, 'A1',
+                                           graph=graph, ordered=ordered)
+        nptest.assert_array_equal(upstream, self.expected_left_no_base)
+        nt.assert_true(numpy.shares_memory(upstream, ordered))
+
+    def test_from_pseudo_catchment(self):
+        upstream = analysis.trace_upstream(self.subcatchments, 'Ocean')
+        nt.assert_equal(upstream.shape[0], self.subcatchments.shape[0])
+
+    @nt.raises(ValueError)
+    def test_mismatched_graph(self):
+        graph = topology.WatershedGraph(self.subcatchments[:5], 'ID', 'DS_ID')
+        analysis.trace_upstream(self.subcatchments, 'A1', graph=graph)
+
+    def test_deep_chain(self):
+        n = 1000000
+        chain = numpy.empty(n, dtype=[('ID', int), ('DS_ID', int), ('Cu', float)])
+        chain['ID'] = numpy.arange(n)
+        chain['DS_ID'] = chain['ID'] - 1
+        chain['Cu'] = chain['ID'] * 2.
+
+        upstream = analysis.trace_upstream(chain, 0, include_base=False)
+        nptest.assert_array_equal(upstream, chain[1:])
+
 
 def test_find_edges():
     subcatchments = SIMPLE_SUBCATCHMENTS.copy()
@@ -109,6 +147,10 @@ def test_find_edges():
     result = analysis.find_edges(subcatchments, 'Ocean')
     nptest.assert_array_equal(result, expected)
 
+    graph = topology.WatershedGraph(subcatchments, 'ID', 'DS_ID')
+    result = analysis.find_edges(subcatchments, 'Ocean', graph=graph)
+    nptest.assert_array_equal(result, expected)
+
 
 def test_find_tops():
     subcatchments = SIMPLE_SUBCATCHMENTS.copy()
@@ -126,6 +168,10 @@ def test_find_tops():
     result = analysis.find_tops(subcatchments)
     nptest.assert_array_equal(result, expected)
 
+    graph = topology.WatershedGraph(subcatchments, 'ID', 'DS_ID')
+    result = analysis.find_tops(subcatchments, graph=graph)
+    nptest.assert_array_equal(result, expected)
+
 
 def test_propagate_scores_complex_1_columns():
     subcatchments = COMPLEX_SUBCATCHMENTS.copy()
@@ -173,6 +219,78 @@ def test_propagate_scores_simple_2_columns():
 
     nptest.assert_array_equal(result, expected)
 
+    # both columns at once should be the same as one at a time
+    graph = topology.WatershedGraph(subcatchments, 'ID', 'DS_ID')
+    result = analysis.propagate_scores(subcatchments, 'ID', 'DS_ID', ['Cu', 'Pb'],
+                                       ignored_value='None', graph=graph)
+    nptest.assert_array_equal(result, expected)
+
+
+def test_propagate_scores_numeric_columns():
+    subcatchments = numpy.array(
+        [
+            ('A1', 'Ocean', 1.0, 0.0), ('B1', 'A1', 0.0, 2.0),
+            ('C1', 'B1', 0.0, 0.0), ('D1', 'C1', 4.0, 0.0),
+            ('A2', 'Ocean', 0.0, 0.0), ('B2', 'A2', 0.0, 5.0),
+        ], dtype=[('ID', '<U5'), ('DS_ID', '<U5'), ('Cu', float), ('Pb', float)]
+    )
+    expected = numpy.array(
+        [
+            ('A1', 'Ocean', 1.0, 0.0), ('B1', 'A1', 1.0, 2.0),
+            ('C1', 'B1', 1.0, 2.0), ('D1', 'C1', 4.0, 2.0),
+            ('A2', 'Ocean', 0.0, 0.0), ('B2', 'A2', 0.0, 5.0),
+        ], dtype=subcatchments.dtype
+    )
+    result = analysis.propagate_scores(subcatchments, 'ID', 'DS_ID', ['Cu', 'Pb'])
+    nptest.assert_array_equal(result, expected)
+
+
+def test_propagate_scores_parallel():
+    subcatchments = COMPLEX_SUBCATCHMENTS.copy()
+    expected = analysis.propagate_scores(subcatchments, 'ID', 'DS_ID', 'Cu',
+                                         ignored_value='None')
+    result = analysis.propagate_scores(subcatchments, 'ID', 'DS_ID', 'Cu',
+                                       ignored_value='None', n_workers=2)
+    nptest.assert_array_equal(result, expected)
+
+
+def test_repropagate_scores():
+    subcatchments = numpy.array(
+        [
+            ('A1', 'Ocean', 1.0, 0.0), ('B1', 'A1', 0.0, 2.0),
+            ('C1', 'B1', 0.0, 0.0), ('D1', 'C1', 4.0, 0.0),
+            ('A2', 'Ocean', 0.0, 0.0), ('B2', 'A2', 0.0, 5.0),
+        ], dtype=[('ID', '<U5'), ('DS_ID', '<U5'), ('Cu', float), ('Pb', float)]
+    )
+    propagated = analysis.propagate_scores(subcatchments, 'ID', 'DS_ID', ['Cu', 'Pb'])
+
+    scores = subcatchments[['ID', 'Cu', 'Pb']][[0, 1, 2, 3, 5]].copy()
+    scores['Cu'][2] = 3.0
+    scores['Pb'][1] = 0.0
+    changed = subcatchments.copy()
+    changed['Cu'][2] = 3.0
+    changed['Pb'][1] = 0.0
+    expected = analysis.propagate_scores(changed, 'ID', 'DS_ID', ['Cu', 'Pb'])
+
+    result, rows = analysis.repropagate_scores(propagated, scores, 'ID', 'DS_ID', ['Cu', 'Pb'],
+                                               changed=['C1', 'B1', 'Junk'])
+    nptest.assert_array_equal(result, expected)
+    nptest.assert_array_equal(rows, [1, 2, 3])
+
+    # subcatchments missing from the scores are unpopulated
+    result, rows = analysis.repropagate_scores(propagated, scores, 'ID', 'DS_ID', 'Cu',
+                                               changed=['A2'])
+    nptest.assert_array_equal(result, propagated)
+    nptest.assert_array_equal(rows, [4, 5])
+
+
+def test_repropagate_scores_nothing_changed():
+    subcatchments = SIMPLE_SUBCATCHMENTS.copy()
+    result, rows = analysis.repropagate_scores(subcatchments, subcatchments, 'ID', 'DS_ID', 'Cu',
+                                               ignored_value='None', changed=['Junk'])
+    nptest.assert_array_equal(result, subcatchments)
+    nt.assert_equal(rows.shape[0], 0)
+
 
 def test__find_downstream_scores():
     subcatchments = SIMPLE_SUBCATCHMENTS.copy()
@@ -210,7 +328,8 @@ class Test_preprocess_wq(object):
                 id_col='CID',
                 ds_col='DS_CID',
                 output_path=self.results,
-                value_columns=self.wq_cols
+                value_columns=self.wq_cols,
+                persist=False,
             )
         expected = 'expected.shp'
         pptest.assert_shapefiles_are_close(
@@ -219,6 +338,34 @@ class Test_preprocess_wq(object):
         )
         nt.assert_true(isinstance(wq, numpy.ndarray))
         nt.assert_list_equal(cols, self.expected_cols)
+        nt.assert_false(os.path.exists(os.path.join(self.ws, 'monitoring_locations.join.npz')))
+        nt.assert_false(os.path.exists(os.path.join(self.ws, 'subcatchments.sidx.npz')))
+
+    def test_native_join(self):
+        # both layers share a projection, so the monitoring locations are
+        # joined in memory instead of intersected with arcpy
+        join = mock.patch.object(geometry, 'join_points_to_polygons',
+                                 wraps=geometry.join_points_to_polygons)
+        intersect = mock.patch.object(utils, 'intersect_layers')
+        with join as jpp, intersect as il:
+            with utils.OverwriteState(True), utils.WorkSpace(self.ws):
+                wq, cols = analysis.preprocess_wq(
+                    monitoring_locations=self.ml,
+                    subcatchments=self.sc,
+                    id_col='CID',
+                    ds_col='DS_CID',
+                    output_path=self.results,
+                    value_columns=self.wq_cols,
+                    persist=False,
+                )
+
+        nt.assert_equal(jpp.call_count, 1)
+        nt.assert_false(il.called)
+        pptest.assert_shapefiles_are_close(
+            os.path.join(self.ws, self.expected),
+            os.path.join(self.ws, self.results),
+        )
+        nt.assert_list_equal(cols, self.expected_cols)
 
     def test_with_filter(self):
         with utils.OverwriteState(True), utils.WorkSpace(self.ws):
@@ -230,7 +377,8 @@ class Test_preprocess_wq(object):
                 ml_filter_cols='StationTyp',
                 ml_filter=lambda row: row['StationTyp'] != 'Outfall',
                 output_path=self.results,
-                value_columns=self.wq_cols
+                value_columns=self.wq_cols,
+                persist=False,
             )
         expected = 'expected_filtered.shp'
         pptest.assert_shapefiles_are_close(
@@ -261,7 +409,8 @@ class Test_preprocess_wq(object):
                 id_col='CID',
                 ds_col='DS_CID',
                 output_path=self.results,
-                value_columns=wq_cols
+                value_columns=wq_cols,
+                persist=False,
             )
         expected = 'expected_multi_agg.shp'
         pptest.assert_shapefiles_are_close(
@@ -280,12 +429,100 @@ class Test_preprocess_wq(object):
                 id_col='CID',
                 ds_col='DS_CID',
                 output_path=self.results,
+                persist=False,
             )
 
     def teardown(self):
         utils.cleanup_temp_results(os.path.join(self.ws, self.results))
 
 
+class Test_preprocess_wq_scenarios(object):
+    def setup(self):
+        self.ws = resource_filename('propagator.testing', 'preprocess_wq')
+        self.wq_cols = [
+            ('Dry_B', 'medIAN'),
+            ('Dry_M', 'Median'),
+            ('Dry_N', 'minIMUM'),
+            ('Wet_B', 'minIMUM'),
+            ('Wet_M',),
+            ('Wet_N', 'MAXIMUM'),
+        ]
+        self.expected_cols = [
+            'medDry_B', 'medDry_M', 'minDry_N',
+            'minWet_B', 'aveWet_M', 'maxWet_N',
+        ]
+        self.scenarios = [
+            analysis.Scenario('all', self.wq_cols),
+            dict(name='filt', value_columns=self.wq_cols,
+                 ml_filter=lambda row: row['StationTyp'] != 'Outfall',
+                 ml_filter_cols='StationTyp'),
+        ]
+
+    def check(self, array, scenario, expected):
+        expected = shapefile.read_dbf(os.path.join(self.ws, expected))
+        rows = utils.RowIndex(array, 'CID').positions(expected['CID'].tolist())
+        for col in self.expected_cols:
+            nptest.assert_array_almost_equal(array[scenario.column(col)][rows], expected[col])
+
+    def test_baseline(self):
+        with utils.WorkSpace(self.ws):
+            wq, columns = analysis.preprocess_wq_scenarios(
+                monitoring_locations='monitoring_locations.shp',
+                subcatchments='subcatchments.shp',
+                id_col='CID',
+                ds_col='DS_CID',
+                scenarios=self.scenarios,
+                persist=False,
+            )
+
+        nt.assert_list_equal(list(columns.keys()), ['all', 'filt'])
+        nt.assert_list_equal(columns['filt'][0], self.expected_cols)
+        nt.assert_list_equal(columns['filt'][1], [c + '_filt' for c in self.expected_cols])
+        nt.assert_equal(wq.shape[0], 10)
+
+        self.check(wq, analysis.Scenario('all', None), 'expected.shp')
+        self.check(wq, analysis.Scenario('filt', None), 'expected_filtered.shp')
+
+    @nt.raises(ValueError)
+    def test_duplicate_names(self):
+        with utils.WorkSpace(self.ws):
+            analysis.preprocess_wq_scenarios(
+                monitoring_locations='monitoring_locations.shp',
+                subcatchments='subcatchments.shp',
+                id_col='CID',
+                ds_col='DS_CID',
+                scenarios=[self.scenarios[0], self.scenarios[0]],
+                persist=False,
+            )
+
+
+def test_preprocess_wq_changes():
+    ws = resource_filename('propagator.testing', 'preprocess_wq')
+    with utils.WorkSpace(ws):
+        aggregated, cols, changed = analysis.preprocess_wq_changes(
+            monitoring_locations='monitoring_locations.shp',
+            subcatchments='subcatchments.shp',
+            id_col='CID',
+            ds_col='DS_CID',
+            ml_id_col='Station',
+            changed_ids=['TCOL02', 'L01S02', 'Junk'],
+            value_columns=[('Dry_B', 'medIAN'), ('Wet_M',)],
+            persist=False,
+        )
+
+    expected = shapefile.read_dbf(os.path.join(ws, 'expected.shp'))
+    rows = utils.RowIndex(expected, 'CID').positions(aggregated['CID'].tolist())
+    nt.assert_list_equal(cols, ['medDry_B', 'aveWet_M'])
+    nptest.assert_array_equal(changed, ['571SJ', '728SJ'])
+    nptest.assert_array_almost_equal(aggregated['medDry_B'], expected['medDry_B'][rows])
+
+
+def test_Scenario():
+    scenario = analysis.Scenario('dry', ['Dry_B'])
+    nt.assert_true(scenario.ml_filter is None)
+    nt.assert_equal(scenario.column('aveDry_B'), 'aveDry_B_dry')
+
+
 @nt.nottest
 def doctor_subcatchments(array, to_remove):
     sub_array = numpy.rec.fromrecords(
@@ -330,6 +567,11 @@ def test_mark_edges():
     results = analysis.mark_edges(input_array, id_col='ID', ds_col='DS_ID', edge_ID='EDGE')
     nptest.assert_array_equal(results, expected)
 
+    graph = topology.WatershedGraph(input_array, 'ID', 'DS_ID')
+    results = analysis.mark_edges(input_array, id_col='ID', ds_col='DS_ID', edge_ID='EDGE',
+                                  graph=graph)
+    nptest.assert_array_equal(results, expected)
+
 
 def test__get_wq_fields():
     ws = resource_filename('propagator.testing', 'get_wq_fields')
@@ -365,6 +607,24 @@ def test_non_zero_means():
     nt.assert_equal(lst2_mean, expected_lst2_mean)
 
 
+@nt.raises(ImportError)
+def test_preprocess_wq_changes_reprojection_without_arcpy():
+    # the monitoring locations and subcatchments are in different
+    # coordinate systems, so they can only be joined by arcpy
+    ws = resource_filename('propagator.testing', 'tbx_propagate')
+    with utils.WorkSpace(ws), backends.UseBackend('numpy'), mock.patch.object(utils, 'arcpy', None):
+        analysis.preprocess_wq_changes(
+            monitoring_locations='monitoring_locations.shp',
+            subcatchments='subcatchments.shp',
+            id_col='CID',
+            ds_col='DS_CID',
+            ml_id_col='Station',
+            changed_ids=['TCOL02'],
+            value_columns=[('Dry_B', 'medIAN')],
+            persist=False,
+        )
+
+
 def test_aggregate_streams_by_subcatchment():
     ws = resource_filename('propagator.testing', 'agg_stream_in_subc')
     with utils.WorkSpace(ws), utils.OverwriteState(True):
@@ -374,7 +634,8 @@ def test_aggregate_streams_by_subcatchment():
             id_col='CID',
             ds_col='DS_CID',
             other_cols=['WQ_1', 'WQ_2'],
-            output_layer='test.shp'
+            output_layer='test.shp',
+            persist=False,
         )
 
     nt.assert_equal(results, 'test.shp')
@@ -383,10 +644,30 @@ def test_aggregate_streams_by_subcatchment():
         os.path.join(ws, 'expected.shp'),
         ngeom=4
     )
+    nt.assert_false(os.path.exists(os.path.join(ws, 'streams.clip.npz')))
+    nt.assert_false(os.path.exists(os.path.join(ws, 'subc.sidx.npz')))
 
     utils.cleanup_temp_results(os.path.join(ws, results),)
 
 
+def test_aggregate_streams_by_subcatchment_in_memory():
+    ws = resource_filename('propagator.testing', 'agg_stream_in_subc')
+    with utils.WorkSpace(ws), utils.OverwriteState(True):
+        kwargs = dict(stream_layer='streams.shp', subcatchment_layer='subc.shp',
+                      id_col='CID', ds_col='DS_CID', other_cols=['WQ_1', 'WQ_2'],
+                      persist=False)
+        on_disk = analysis.aggregate_streams_by_subcatchment(output_layer='test.shp', **kwargs)
+        in_memory = analysis.aggregate_streams_by_subcatchment(output_layer='memory:test', **kwargs)
+
+        nt.assert_equal(in_memory, 'memory:test')
+        nt.assert_true(in_memory in backends.MEMORY)
+        nptest.assert_array_equal(utils.load_attribute_table(in_memory),
+                                  utils.load_attribute_table(on_disk))
+
+    utils.cleanup_temp_results(os.path.join(ws, on_disk), in_memory)
+    nt.assert_false(in_memory in backends.MEMORY)
+
+
 def test_collect_upstream_attributes():
     subcatchments_table = numpy.array(
         [
@@ -443,3 +724,180 @@ def test_collect_upstream_attributes():
     result.sort()
     expected.sort()
     nptest.assert_array_equal(result, expected)
+
+
+class Test_accumulate_upstream(object):
+    def setup(self):
+        self.subcatchments = numpy.array(
+            [
+                ('A1', 'Ocean', 20, 45.23), ('A2', 'Ocean', 0.64, 42),
+                ('B1', 'A1', 43.3, 45.23), ('B2', 'A1', 0.32, 41),
+                ('B3', 'A2', 91, 15.23), ('C1', 'B2', 0.32, 4),
+                ('C2', 'B3', 50.3, 45.23), ('C3', 'B3', 0.32, 41),
+                ('D1', 'C1', 32, 45.23), ('D2', 'C3', 0.32, 41),
+                ('E1', 'D1', 1, 45.23), ('E2', 'D2', 0.32, 100),
+                ('F1', 'E1', 42, 35.3), ('F2', 'E1', 0.32, 315),
+                ('F3', 'E1', 5, 45.23), ('G1', 'F1', 0.32, 123),
+                ('G2', 'F3', 8, 45.23), ('H1', 'G2', 0.32, 41),
+            ], dtype=[('ID', '<U5'), ('DS_ID', '<U5'), ('Imp', '<f8'), ('Area', '<f8'),]
+        )
+
+        self.targets = numpy.array(
+            [('C2',), ('A1',), ('E2',), ('A2',), ('Ocean',), ('Junk',)],
+            dtype=[('ID', '<U5')]
+        )
+
+        self.stats = [
+            utils.Statistic('Imp', 'sum', 'SUMImp'),
+            utils.Statistic('Area', 'maximum', 'MAXArea'),
+            utils.Statistic('Imp', 'minimum', 'MINImp'),
+            utils.Statistic('Area', 'average', 'AVEArea'),
+            utils.Statistic(['Imp', 'Area'], 'weighted_average', 'WEIImp'),
+            utils.Statistic('Imp', 'median', 'MEDImp'),
+            utils.Statistic('Imp', 'first', 'FIRImp'),
+            utils.Statistic('Imp', 'count', 'COUImp'),
+        ]
+
+        self.known_ids = ['A1', 'A2', 'C2', 'E2', 'Ocean']
+        self.known_cols = ['SUMImp', 'MAXArea', 'MINImp', 'AVEArea',
+                           'WEIImp', 'MEDImp', 'FIRImp', 'COUImp']
+
+    def check(self, result, expected):
+        nptest.assert_array_equal(result['ID'], self.known_ids)
+        nt.assert_equal(list(result.dtype.names), ['ID'] + self.known_cols)
+        for n, col in enumerate(self.known_cols):
+            nptest.assert_array_almost_equal(result[col], expected[:, n])
+
+    def test_baseline(self):
+        expected = numpy.array([
+            [152.90, 315.00, 0.32, 69.223333, 7.937977, 3.00, 20.00, 12.0],
+            [142.90, 100.00, 0.32, 47.410000, 13.169229, 0.48, 0.64, 6.0],
+            [50.30, 45.23, 50.30, 45.230000, 50.300000, 50.30, 50.30, 1.0],
+            [0.32, 100.00, 0.32, 100.000000, 0.320000, 0.32, 0.32, 1.0],
+            [295.80, 315.00, 0.32, 61.952222, 9.272412, 0.82, 20.00, 18.0],
+        ])
+        result = analysis.accumulate_upstream(
+            self.subcatchments, self.targets, 'ID', 'DS_ID', self.stats
+        )
+        self.check(result, expected)
+
+    def test_ignored_value(self):
+        expected = numpy.array([
+            [151.30, 315.00, 1.00, 69.223333, 20.954216, 20.00, 20.00, 7.0],
+            [141.94, 100.00, 0.64, 47.410000, 35.993354, 50.30, 0.64, 3.0],
+            [50.30, 45.23, 50.30, 45.230000, 50.300000, 50.30, 50.30, 1.0],
+            [0.32, 100.00, 0.32, 100.000000, 0.320000, 0.32, 0.32, 0.32],
+            [293.24, 315.00, 0.64, 61.952222, 24.720433, 26.00, 20.00, 10.0],
+        ])
+        result = analysis.accumulate_upstream(
+            self.subcatchments, self.targets, 'ID', 'DS_ID', self.stats,
+            ignored_value=0.32
+        )
+        self.check(result, expected)
+
+    def test_with_graph(self):
+        graph = topology.WatershedGraph(self.subcatchments, 'ID', 'DS_ID')
+        result = analysis.accumulate_upstream(
+            self.subcatchments, self.targets, 'ID', 'DS_ID', self.stats[:1],
+            graph=graph
+        )
+        nptest.assert_array_almost_equal(
+            result['SUMImp'], [152.9, 142.9, 50.3, 0.32, 295.8]
+        )
+
+    def test_parallel(self):
+        expected = analysis.accumulate_upstream(
+            self.subcatchments, self.targets, 'ID', 'DS_ID', self.stats
+        )
+        result = analysis.accumulate_upstream(
+            self.subcatchments, self.targets, 'ID', 'DS_ID', self.stats,
+            n_workers=2
+        )
+        nptest.assert_array_equal(result, expected)
+
+
+def test_accumulate_upstream_deep_chain():
+    n = 1000
+    chain = numpy.empty(n, dtype=[('ID', int), ('DS_ID', int), ('Area', float)])
+    chain['ID'] = numpy.arange(n)
+    chain['DS_ID'] = chain['ID'] - 1
+    chain['Area'] = 1.0
+
+    stats = [
+        utils.Statistic('Area', 'sum', 'SUMArea'),
+        utils.Statistic('Area', 'median', 'MEDArea'),
+    ]
+    result = analysis.accumulate_upstream(chain, chain[::100], 'ID', 'DS_ID', stats)
+    nptest.assert_array_equal(result['SUMArea'], numpy.arange(n, 0, -100))
+    nptest.assert_array_equal(result['MEDArea'], numpy.ones(10))
+
+
+class Test_UpstreamAccumulator(object):
+    def setup(self):
+        fixture = Test_accumulate_upstream()
+        fixture.setup()
+        self.subcatchments = fixture.subcatchments
+        self.targets = fixture.targets
+        self.stats = fixture.stats
+        self.edits = numpy.array(
+            [('F3', 7.5, 45.23), ('C2', 0.32, 12), ('A2', 3, 0.32)],
+            dtype=[('ID', '<U5'), ('Imp', '<f8'), ('Area', '<f8')]
+        )
+
+    def check(self, ignored_value):
+        acc = analysis.UpstreamAccumulator(
+            self.subcatchments, 'ID', 'DS_ID', self.stats,
+            ignored_value=ignored_value
+        )
+        changed = acc.update(self.edits)
+
+        edited = self.subcatchments.copy()
+        for row in self.edits:
+            mask = edited['ID'] == row['ID']
+            edited['Imp'][mask] = row['Imp']
+            edited['Area'][mask] = row['Area']
+
+        expected = analysis.accumulate_upstream(
+            edited, self.targets, 'ID', 'DS_ID', self.stats,
+            ignored_value=ignored_value
+        )
+        result = acc.results(self.targets['ID'])
+        nt.assert_equal(result.dtype.names, expected.dtype.names)
+        nptest.assert_array_equal(result['ID'], expected['ID'])
+        for col in expected.dtype.names[1:]:
+            nptest.assert_array_almost_equal(result[col], expected[col])
+
+        nt.assert_set_equal(
+            set(changed.tolist()),
+            set(['F3', 'E1', 'D1', 'C1', 'B2', 'A1', 'C2', 'B3', 'A2', 'Ocean'])
+        )
+
+    def test_baseline(self):
+        self.check(None)
+
+    def test_ignored_value(self):
+        self.check(0.32)
+
+    def test_results_all(self):
+        acc = analysis.UpstreamAccumulator(self.subcatchments, 'ID', 'DS_ID', self.stats)
+        expected = analysis.accumulate_upstream(
+            self.subcatchments, self.subcatchments, 'ID', 'DS_ID', self.stats
+        )
+        result = acc.results()
+        for col in expected.dtype.names[1:]:
+            nptest.assert_array_almost_equal(result[col], expected[col])
+
+    @nt.raises(ValueError)
+    def test_unknown_subcatchment(self):
+        acc = analysis.UpstreamAccumulator(self.subcatchments, 'ID', 'DS_ID', self.stats)
+        acc.update(numpy.array([('Junk', 1.0)], dtype=[('ID', '<U5'), ('Imp', '<f8')]))
+
+    @nt.raises(ValueError)
+    def test_edit_downstream_id(self):
+        acc = analysis.UpstreamAccumulator(self.subcatchments, 'ID', 'DS_ID', self.stats)
+        acc.update(numpy.array([('A1', 'A2')], dtype=[('ID', '<U5'), ('DS_ID', '<U5')]))
+
+    @nt.raises(ValueError)
+    def test_edit_unknown_field(self):
+        acc = analysis.UpstreamAccumulator(self.subcatchments, 'ID', 'DS_ID', self.stats)
+        acc.update(numpy.array([('A1', 1.0)], dtype=[('ID', '<U5'), ('Junk', '<f8')]))
@@ -0,0 +1,284 @@
+import os
+import shutil
+import tempfile
+from pkg_resources import resource_filename
+
+import numpy
+
+import nose.tools as nt
+import numpy.testing as nptest
+
+from propagator import backends
+from propagator import shapefile
+from propagator import utils
+
+
+class Test_NumpyBackend(object):
+    def setup(self):
+        self.backend = backends.NumpyBackend()
+        self.subcatchments = resource_filename('propagator.testing.load_attribute_table', 'subcatchments.shp')
+        self.workspace = resource_filename('propagator.testing', 'update_attribute_table')
+        self.backend.env.workspace = self.workspace
+        self.new_attributes = numpy.array(
+            [
+                (1, 0, u'Cu_1', 'Pb_1'), (2, 0, u'Cu_2', 'Pb_2'),
+                (3, 0, u'Cu_3', 'Pb_3'), (4, 0, u'Cu_4', 'Pb_4'),
+            ], dtype=[('id', int), ('ds_id', int), ('Cu', '<U5'), ('Pb', '<U5'),]
+        )
+
+    def teardown(self):
+        self.backend.delete('test.shp')
+
+    def test_get_field_names(self):
+        expected = [u'FID', u'Shape', u'Station', u'Latitude', u'Longitude']
+        layer = resource_filename('propagator.testing.get_field_names', 'input.shp')
+        nt.assert_list_equal(self.backend.get_field_names(layer), expected)
+
+    def test_load_attribute_table(self):
+        expected_top_five = numpy.array(
+            [
+                (u'541', u'571', u'San Juan Creek'),
+                (u'754', u'618', u'San Juan Creek'),
+                (u'561', u'577', u'San Juan Creek'),
+                (u'719', u'770', u'San Juan Creek'),
+                (u'766', u'597', u'San Juan Creek'),
+            ],
+            dtype=[
+                ('CatchID', '<U20'),
+                ('DwnCatchID', '<U20'),
+                ('Watershed', '<U50'),
+            ]
+        )
+
+        fields = ['CatchID', 'DwnCatchID', 'Watershed']
+        result = self.backend.load_attribute_table(self.subcatchments, fields)
+        nptest.assert_array_equal(result[:5], expected_top_five)
+
+    def test_load_geometry_fields(self):
+        areas = resource_filename("propagator.testing.groupby_and_aggregate", "intersect_input1.shp")
+        known_areas = {2: 1327042.1024, 7: 1355433.0192, 12: 1054529.2882}
+
+        table = self.backend.load_attribute_table(areas, ['FID', 'GeoID', 'SHAPE@AREA'])
+        nptest.assert_array_equal(table['FID'], numpy.arange(table.shape[0]))
+        for geoid, area in known_areas.items():
+            rows = table['GeoID'] == geoid
+            nptest.assert_almost_equal(table['SHAPE@AREA'][rows].sum(), area, decimal=3)
+
+    def test_iter_attribute_table(self):
+        areas = resource_filename("propagator.testing.groupby_and_aggregate", "intersect_input1.shp")
+        fields = ['FID', 'GeoID', 'SHAPE@AREA']
+        expected = self.backend.load_attribute_table(areas, fields)
+
+        chunks = list(self.backend.iter_attribute_table(areas, fields, 3))
+        nt.assert_equal(chunks[0].shape[0], 3)
+        nptest.assert_array_equal(numpy.hstack(chunks), expected)
+
+    def test_count_features(self):
+        layer = resource_filename('propagator.testing.count_features', 'monitoring_locations.shp')
+        nt.assert_equal(self.backend.count_features(layer), 14)
+
+    def test_copy_and_delete(self):
+        result = self.backend.copy_layer('input.shp', 'test.shp')
+        nt.assert_equal(result, 'test.shp')
+        nt.assert_true(shapefile.exists(self.backend.path('test.shp')))
+        nt.assert_equal(self.backend.count_features('test'), self.backend.count_features('input'))
+
+        self.backend.delete('test.shp')
+        nt.assert_false(shapefile.exists(self.backend.path('test.shp')))
+
+    @nt.raises(ValueError)
+    def test_copy_no_overwrite(self):
+        self.backend.copy_layer('input.shp', 'test.shp')
+        self.backend.copy_layer('input.shp', 'test.shp')
+
+    def test_update_attribute_table(self):
+        self.backend.copy_layer('input.shp', 'test.shp')
+        index = utils.RowIndex(self.new_attributes, 'id')
+        self.backend.update_attribute_table('test.shp', index, 'id', ['Cu', 'Pb'], ['Cu', 'Pb'])
+
+        result = shapefile.read_dbf(self.backend.path('test.shp'))
+        expected = shapefile.read_dbf(self.backend.path('expected_output.shp'))
+        nptest.assert_array_equal(result, expected)
+
+    def test_add_and_populate_field(self):
+        self.backend.copy_layer('input.shp', 'test.shp')
+        self.backend.add_field('test.shp', 'Zn', 'DOUBLE')
+        self.backend.populate_field('test.shp', lambda row: row[0] * 1.5, ['id', 'Zn'])
+
+        table = self.backend.load_attribute_table('test.shp', ['id', 'Zn'])
+        nptest.assert_array_almost_equal(table['Zn'], table['id'] * 1.5)
+
+    def test_populate_field_with_geometry(self):
+        self.backend.copy_layer('input.shp', 'test.shp')
+        self.backend.populate_field('test.shp', lambda row: row[0] + 10, ['FID', 'ds_id'])
+
+        table = self.backend.load_attribute_table('test.shp', ['FID', 'ds_id'])
+        nptest.assert_array_equal(table['ds_id'], table['FID'] + 10)
+
+    def test_write_columns(self):
+        self.backend.copy_layer('input.shp', 'test.shp')
+        self.backend.write_columns('test.shp', {'Cu': 'Cu_x', 'ds_id': [4, 3, 2, 1]})
+
+        table = self.backend.load_attribute_table('test.shp', ['Cu', 'ds_id', 'Pb'])
+        nptest.assert_array_equal(table['Cu'], ['Cu_x'] * 4)
+        nptest.assert_array_equal(table['ds_id'], [4, 3, 2, 1])
+        nptest.assert_array_equal(table['Pb'], ['', 'Pb_2', '', 'Pb_4'])
+
+    def test_delete_columns(self):
+        self.backend.copy_layer('input.shp', 'test.shp')
+        self.backend.delete_columns('test.shp', ['Cu', 'Pb'])
+        nt.assert_list_equal(
+            self.backend.get_field_names('test.shp'),
+            ['FID', 'Shape', 'id', 'ds_id']
+        )
+
+
+class Test_MemoryWorkspace(object):
+    def setup(self):
+        self.backend = backends.NumpyBackend()
+        self.workspace = resource_filename('propagator.testing', 'update_attribute_table')
+        self.backend.env.workspace = self.workspace
+        self.backend.copy_layer('input.shp', 'memory:test')
+        self.new_attributes = numpy.array(
+            [
+                (1, 0, u'Cu_1', 'Pb_1'), (2, 0, u'Cu_2', 'Pb_2'),
+                (3, 0, u'Cu_3', 'Pb_3'), (4, 0, u'Cu_4', 'Pb_4'),
+            ], dtype=[('id', int), ('ds_id', int), ('Cu', '<U5'), ('Pb', '<U5'),]
+        )
+
+    def teardown(self):
+        backends.MEMORY.clear()
+        self.backend.delete('test.shp')
+
+    def test_is_memory(self):
+        nt.assert_true(backends.is_memory('memory:test'))
+        nt.assert_true(backends.is_memory('MEMORY:test'))
+        nt.assert_false(backends.is_memory('test.shp'))
+        nt.assert_false(backends.is_memory(None))
+
+    def test_load_attribute_table(self):
+        expected = self.backend.load_attribute_table('input.shp', ['FID', 'id', 'Cu', 'Shape'])
+        result = self.backend.load_attribute_table('memory:test', ['FID', 'id', 'Cu', 'Shape'])
+        nptest.assert_array_equal(result, expected)
+        nt.assert_equal(result.dtype, expected.dtype)
+
+    def test_get_field_names(self):
+        nt.assert_list_equal(
+            self.backend.get_field_names('memory:TEST'),
+            self.backend.get_field_names('input.shp')
+        )
+
+    def test_iter_attribute_table(self):
+        expected = self.backend.load_attribute_table('memory:test', ['FID', 'id', 'SHAPE@XY'])
+        chunks = list(self.backend.iter_attribute_table('memory:test', ['FID', 'id', 'SHAPE@XY'], 3))
+        nt.assert_equal(chunks[0].shape[0], 3)
+        nptest.assert_array_equal(numpy.hstack(chunks), expected)
+
+    def test_update_attribute_table(self):
+        index = utils.RowIndex(self.new_attributes, 'id')
+        self.backend.update_attribute_table('memory:test', index, 'id', ['Cu', 'Pb'], ['Cu', 'Pb'])
+
+        result = self.backend.load_attribute_table('memory:test', ['id', 'ds_id', 'Cu', 'Pb'])
+        expected = shapefile.read_dbf(self.backend.path('expected_output.shp'))
+        nptest.assert_array_equal(result, expected)
+
+    def test_add_populate_and_delete_columns(self):
+        self.backend.add_field('memory:test', 'Zn', 'DOUBLE')
+        self.backend.populate_field('memory:test', lambda row: row[0] * 1.5, ['id', 'Zn'])
+        table = self.backend.load_attribute_table('memory:test', ['id', 'Zn'])
+        nptest.assert_array_almost_equal(table['Zn'], table['id'] * 1.5)
+
+        self.backend.delete_columns('memory:test', ['Cu', 'Pb', 'Zn'])
+        nt.assert_list_equal(
+            self.backend.get_field_names('memory:test'),
+            ['FID', 'Shape', 'id', 'ds_id']
+        )
+
+    def test_write_columns(self):
+        self.backend.write_columns('memory:test', {'Cu': 'Cu_x', 'ds_id': [4, 3, 2, 1]})
+        table = self.backend.load_attribute_table('memory:test', ['Cu', 'ds_id'])
+        nptest.assert_array_equal(table['Cu'], ['Cu_x'] * 4)
+        nptest.assert_array_equal(table['ds_id'], [4, 3, 2, 1])
+
+    def test_copy_to_disk(self):
+        self.backend.write_columns('memory:test', {'ds_id': [4, 3, 2, 1]})
+        self.backend.copy_layer('memory:test', 'test.shp')
+
+        nt.assert_equal(self.backend.count_features('test.shp'), 4)
+        nt.assert_equal(
+            shapefile.read_projection(self.backend.path('test.shp')),
+            shapefile.read_projection(self.backend.path('input.shp'))
+        )
+        nptest.assert_array_equal(shapefile.read_dbf(self.backend.path('test.shp'))['ds_id'],
+                                  [4, 3, 2, 1])
+        nptest.assert_array_equal(
+            self.backend.load_attribute_table('test.shp', ['Shape'])['Shape'],
+            self.backend.load_attribute_table('input.shp', ['Shape'])['Shape'],
+        )
+
+    def test_copy_in_memory(self):
+        self.backend.copy_layer('memory:test', 'memory:other')
+        self.backend.write_columns('memory:other', {'ds_id': 7})
+        nptest.assert_array_equal(
+            self.backend.load_attribute_table('memory:test', ['ds_id']),
+            self.backend.load_attribute_table('input.shp', ['ds_id'])
+        )
+        nt.assert_equal(len(backends.MEMORY), 2)
+
+    @nt.raises(ValueError)
+    def test_copy_no_overwrite(self):
+        self.backend.copy_layer('input.shp', 'memory:test')
+
+    def test_delete(self):
+        nt.assert_true('memory:test' in backends.MEMORY)
+        self.backend.delete('memory:test')
+        nt.assert_false('memory:test' in backends.MEMORY)
+
+    @nt.raises(ValueError)
+    def test_missing(self):
+        self.backend.count_features('memory:junk')
+
+    def test_utils(self):
+        with backends.UseBackend(self.backend):
+            temp = utils.create_temp_filename('test.shp', filetype='memory')
+            nt.assert_equal(temp, 'memory:_temp_test')
+
+            utils.copy_layer('memory:test', temp)
+            utils.add_field_with_value(temp, 'Zn', 2.5)
+            table = utils.load_attribute_table(temp, 'id', 'Zn')
+            nptest.assert_array_equal(table['Zn'], [2.5] * 4)
+
+            utils.cleanup_temp_results(temp)
+            nt.assert_false(temp in backends.MEMORY)
+
+
+def test_set_backend():
+    backend = backends.NumpyBackend()
+    with backends.UseBackend(backend) as current:
+        nt.assert_true(current is backend)
+        nt.assert_true(backends.get_backend() is backend)
+    nt.assert_false(backends.get_backend() is backend)
+
+
+@nt.raises(ValueError)
+def test_set_backend_unknown():
+    with backends.UseBackend('junk'):
+        pass
+
+
+def test_geodatabase_marker():
+    folder = tempfile.mkdtemp()
+    try:
+        gdb = os.path.join(folder, 'test.gdb')
+        layer = os.path.join(gdb, 'dataset', 'layer')
+        nt.assert_true(backends.geodatabase_marker(layer) is None)
+
+        os.mkdir(gdb)
+        nt.assert_equal(backends.geodatabase_marker(layer), gdb)
+
+        timestamps = os.path.join(gdb, 'timestamps')
+        open(timestamps, 'w').close()
+        nt.assert_equal(backends.geodatabase_marker(layer), timestamps)
+        nt.assert_true(backends.geodatabase_marker(os.path.join(folder, 'layer.shp')) is None)
+    finally:
+        shutil.rmtree(folder)
@@ -0,0 +1,154 @@
+import os
+import json
+import shutil
+import tempfile
+
+import numpy
+
+import nose.tools as nt
+import numpy.testing as nptest
+
+from propagator import topology
+from propagator import shapefile
+from propagator import backends
+from propagator.benchmarks import kernels
+from propagator.benchmarks import table_io
+
+
+class Test_random_watershed(object):
+    def setup(self):
+        self.n = 2000
+        self.subcatchments = kernels.random_watershed(self.n, depth=25, empty_fraction=0.3, seed=7)
+        self.graph = topology.WatershedGraph(self.subcatchments, 'ID', 'DS_ID')
+
+    def test_size(self):
+        nt.assert_equal(self.subcatchments.shape[0], self.n)
+        nt.assert_equal(numpy.unique(self.subcatchments['ID']).shape[0], self.n)
+
+    def test_depth(self):
+        nt.assert_equal(len(self.graph.levels), 25)
+
+    def test_outlets(self):
+        outlets = self.subcatchments['DS_ID'] == kernels.OUTLET_ID
+        nptest.assert_array_equal(numpy.sort(self.graph.outlets), numpy.flatnonzero(outlets))
+
+    def test_empty_fraction(self):
+        empty = (self.subcatchments['WQ_1'] == 0).mean()
+        nt.assert_almost_equal(empty, 0.3, delta=0.05)
+
+    def test_seeded(self):
+        again = kernels.random_watershed(self.n, depth=25, empty_fraction=0.3, seed=7)
+        nptest.assert_array_equal(again, self.subcatchments)
+
+        other = kernels.random_watershed(self.n, depth=25, empty_fraction=0.3, seed=8)
+        nt.assert_false(numpy.array_equal(other['DS_ID'], self.subcatchments['DS_ID']))
+
+    def test_chain(self):
+        chain = kernels.random_watershed(100, branching=1)
+        graph = topology.WatershedGraph(chain, 'ID', 'DS_ID')
+        nt.assert_equal(len(graph.levels), 100)
+
+    def test_branching(self):
+        graph = topology.WatershedGraph(kernels.random_watershed(1000, branching=3), 'ID', 'DS_ID')
+        sizes = [level.shape[0] for level in graph.levels]
+        nt.assert_equal(len(sizes), 7)
+        nt.assert_list_equal(sizes, sorted(sizes))
+        nt.assert_almost_equal(sizes[-1] / float(sizes[-2]), 3, delta=0.1)
+
+
+@nt.raises(ValueError)
+def test_random_watershed_empty():
+    kernels.random_watershed(0)
+
+
+def test_complexity_exponent():
+    sizes = [10, 100, 1000]
+    nt.assert_almost_equal(kernels.complexity_exponent(sizes, [1., 10., 100.]), 1.)
+    nt.assert_almost_equal(kernels.complexity_exponent(sizes, [1., 100., None]), 2.)
+    nt.assert_true(kernels.complexity_exponent(sizes, [1., None, None]) is None)
+
+
+def test_run():
+    report = kernels.run(sizes=[200, 100], kernels=['find_tops', 'rec_groupby'], repeat=1)
+    nt.assert_list_equal(list(report['kernels'].keys()), ['find_tops', 'rec_groupby'])
+
+    timings = report['kernels']['find_tops']['timings']
+    nt.assert_list_equal([t['n'] for t in timings], [100, 200])
+    nt.assert_true(timings[0]['exponent'] is None)
+    nt.assert_true(timings[1]['seconds'] > 0)
+
+    path = os.path.join(tempfile.mkdtemp(), 'kernels.json')
+    kernels.save(report, path)
+    with open(path) as f:
+        nt.assert_equal(json.load(f)['parameters']['sizes'], [100, 200])
+
+
+def test_run_max_seconds():
+    report = kernels.run(sizes=[100, 200], kernels=['mark_edges'], repeat=1, max_seconds=0)
+    seconds = [t['seconds'] for t in report['kernels']['mark_edges']['timings']]
+    nt.assert_true(seconds[0] is not None)
+    nt.assert_true(seconds[1] is None)
+
+
+@nt.raises(ValueError)
+def test_run_unknown_kernel():
+    kernels.run(sizes=[100], kernels=['junk'])
+
+
+class Test_table_io(object):
+    def setup(self):
+        self.workspace = tempfile.mkdtemp()
+        self.path = table_io.random_table(os.path.join(self.workspace, 'table.shp'), 50,
+                                          n_fields=5, seed=3)
+        self.backend = backends.set_backend('numpy')
+
+    def teardown(self):
+        backends.set_backend(self.backend)
+        shutil.rmtree(self.workspace)
+
+    def test_random_table(self):
+        nt.assert_equal(shapefile.count_records(self.path), 50)
+        table = shapefile.read_dbf(self.path)
+        nt.assert_list_equal(list(table.dtype.names), ['ID', 'V000', 'V001', 'V002', 'V003', 'V004'])
+        nt.assert_equal(numpy.unique(table['ID']).shape[0], 50)
+        nt.assert_equal(table.dtype['V000'].kind, 'U')
+        nt.assert_equal(table.dtype['V001'].kind, 'f')
+
+    def test_time_operation(self):
+        for name, operation in table_io.OPERATIONS.items():
+            seconds = table_io.time_operation(operation, self.path, self.workspace, repeat=2)
+            nt.assert_true(seconds > 0)
+
+        # the original table is never changed
+        fields = list(shapefile.read_dbf(self.path).dtype.names)
+        nt.assert_list_equal(fields, ['ID', 'V000', 'V001', 'V002', 'V003', 'V004'])
+        nt.assert_false(shapefile.exists(os.path.join(self.workspace, 'work.shp')))
+
+    def test_run_in_memory(self):
+        report = table_io.run(rows=[20], fields=[3], operations=['update_attribute_table'],
+                              repeat=1, in_memory=True)
+        nt.assert_equal(report['environment']['backend'], 'numpy')
+        result, = report['results']
+        nt.assert_equal(result['rows'], 20)
+        nt.assert_true(result['in_memory'])
+        nt.assert_almost_equal(result['rows_per_second'], 20 / result['seconds'])
+        nt.assert_equal(len(backends.MEMORY), 0)
+
+    def test_compare(self):
+        report = table_io.run(rows=[20], fields=[3], operations=['load_attribute_table'],
+                              repeat=1, workspace=self.workspace)
+        path = table_io.save(report, os.path.join(self.workspace, 'baseline.json'))
+        baseline = table_io.load(path)
+        nt.assert_list_equal(table_io.compare(report, baseline), [])
+
+        baseline['results'][0]['rows_per_second'] *= 2
+        regression, = table_io.compare(report, baseline)
+        nt.assert_equal(regression['operation'], 'load_attribute_table')
+        nt.assert_almost_equal(regression['ratio'], 0.5)
+
+        report['results'][0]['in_memory'] = True
+        nt.assert_list_equal(table_io.compare(report, baseline), [])
+
+    @nt.raises(ValueError)
+    def test_run_unknown_operation(self):
+        table_io.run(rows=[10], fields=[2], operations=['junk'])
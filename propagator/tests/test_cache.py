@@ -0,0 +1,166 @@
+import os
+import time
+import shutil
+import tempfile
+from pkg_resources import resource_filename
+
+import numpy
+
+import nose.tools as nt
+import numpy.testing as nptest
+
+from propagator import cache
+from propagator import backends
+from propagator import shapefile
+from propagator import utils
+
+
+CALLS = []
+
+
+@cache.cached(inputs=('layer',), ignore=('verbose',))
+def double_ids(layer=None, output_layer=None, factor=2, verbose=False):
+    CALLS.append(output_layer)
+    utils.copy_layer(layer, output_layer)
+    ids = utils.load_attribute_table(output_layer, 'id')['id']
+    backends.get_backend().write_columns(output_layer, {'ds_id': ids * factor})
+    return (output_layer,)
+
+
+@cache.cached(inputs=('layer',))
+def copy_input(layer=None, output_layer=None):
+    CALLS.append(output_layer)
+    return utils.copy_layer(layer, output_layer)
+
+
+class Test_ResultCache(object):
+    def setup(self):
+        del CALLS[:]
+        self.workspace = tempfile.mkdtemp()
+        self.cachedir = os.path.join(self.workspace, 'cache')
+        source = resource_filename('propagator.testing.update_attribute_table', 'input.shp')
+        shapefile.copy(source, os.path.join(self.workspace, 'input.shp'))
+
+        self.backend = backends.set_backend('numpy')
+        self.results = cache.ResultCache(self.cachedir)
+
+    def teardown(self):
+        backends.set_backend(self.backend)
+        shutil.rmtree(self.workspace)
+
+    def run(self, **kwargs):
+        options = dict(layer='input.shp', output_layer='output.shp', cache=self.results)
+        options.update(kwargs)
+        with utils.WorkSpace(self.workspace), utils.OverwriteState(True):
+            return double_ids(**options)
+
+    def check_output(self, factor=2):
+        table = shapefile.read_dbf(os.path.join(self.workspace, 'output.shp'))
+        nptest.assert_array_equal(table['ds_id'], table['id'] * factor)
+
+    def test_hit(self):
+        result = self.run()
+        shapefile.delete(os.path.join(self.workspace, 'output.shp'))
+
+        nt.assert_tuple_equal(self.run(verbose=True), result)
+        nt.assert_equal(len(CALLS), 1)
+        nt.assert_equal(self.results.hits, 1)
+        nt.assert_equal(self.results.misses, 1)
+        self.check_output()
+
+    def test_single_layer(self):
+        with utils.WorkSpace(self.workspace), utils.OverwriteState(True):
+            copy_input(layer='input.shp', output_layer='copy.shp', cache=self.results)
+            result = copy_input(layer='input.shp', output_layer='copy.shp', cache=self.results)
+        nt.assert_equal(result, 'copy.shp')
+        nt.assert_equal(len(CALLS), 1)
+
+    def test_without_cache(self):
+        self.run(cache=None)
+        self.run(cache=None)
+        nt.assert_equal(len(CALLS), 2)
+        nt.assert_equal(len(self.results), 0)
+
+    def test_params_change_key(self):
+        self.run()
+        self.run(factor=3)
+        nt.assert_equal(len(CALLS), 2)
+        self.check_output(factor=3)
+
+        self.run()
+        nt.assert_equal(len(CALLS), 2)
+        self.check_output(factor=2)
+
+    def test_input_change(self):
+        self.run()
+
+        # make sure the modification time changes
+        dbf = os.path.join(self.workspace, 'input.dbf')
+        later = os.path.getmtime(dbf) + 10
+        os.utime(dbf, (later, later))
+
+        self.run()
+        nt.assert_equal(len(CALLS), 2)
+
+    def test_contents(self):
+        self.results = cache.ResultCache(self.cachedir, contents=True)
+        self.run()
+
+        # touching the files does not change their contents
+        dbf = os.path.join(self.workspace, 'input.dbf')
+        later = os.path.getmtime(dbf) + 10
+        os.utime(dbf, (later, later))
+        self.run()
+        nt.assert_equal(len(CALLS), 1)
+
+        shapefile.update_dbf(dbf, {'Cu': 'x'})
+        self.run()
+        nt.assert_equal(len(CALLS), 2)
+
+    def test_lru_eviction(self):
+        self.run()
+        entry_size = self.results.stats['bytes']
+        self.results.max_bytes = 2 * entry_size
+
+        self.run(factor=3)
+        time.sleep(0.01)
+        self.run()  # `factor=3` is now the least recently used
+        self.run(factor=4)
+        nt.assert_equal(len(self.results), 2)
+        nt.assert_equal(len(CALLS), 3)
+
+        self.run()
+        nt.assert_equal(len(CALLS), 3)
+        self.run(factor=3)
+        nt.assert_equal(len(CALLS), 4)
+
+    def test_clear(self):
+        self.run()
+        self.results.clear()
+        nt.assert_equal(len(self.results), 0)
+        nt.assert_equal(self.results.hits, 0)
+
+        self.run()
+        nt.assert_equal(len(CALLS), 2)
+
+    def test_missing_input(self):
+        nt.assert_true(self.results.key(['junk.shp'], {}) is None)
+
+
+def test_normalize_closures():
+    def make_filter(types):
+        return lambda row: row['Type'] in types
+
+    nt.assert_equal(cache.normalize(make_filter(['A'])), cache.normalize(make_filter(['A'])))
+    nt.assert_not_equal(cache.normalize(make_filter(['A'])), cache.normalize(make_filter(['B'])))
+    nt.assert_not_equal(
+        cache.normalize(lambda row: row['Type'] == 'A'),
+        cache.normalize(lambda row: row['Type'] != 'A'),
+    )
+
+
+def test_normalize():
+    nt.assert_equal(
+        cache.normalize({'b': (1, numpy.float64(2.5)), 'a': numpy.array([1, 2])}),
+        [['a', [1, 2]], ['b', [1, 2.5]]]
+    )
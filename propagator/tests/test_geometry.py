@@ -0,0 +1,362 @@
+import os
+import shutil
+import tempfile
+from pkg_resources import resource_filename
+
+import numpy
+
+import nose.tools as nt
+import numpy.testing as nptest
+import mock
+
+from propagator import geometry
+from propagator import shapefile
+
+
+def square(x0, y0, size):
+    points = numpy.array([
+        (x0, y0), (x0, y0 + size), (x0 + size, y0 + size),
+        (x0 + size, y0), (x0, y0),
+    ], dtype=float)
+    return shapefile.Shape(shapefile.POLYGON, numpy.array([0]), points, None)
+
+
+def donut(x0, y0, size, hole):
+    outer, inner = square(x0, y0, size), square(x0 + hole, y0 + hole, size - 2 * hole)
+    points = numpy.vstack([outer.points, inner.points[::-1]])
+    return shapefile.Shape(shapefile.POLYGON, numpy.array([0, 5]), points, None)
+
+
+class Test_SpatialIndex(object):
+    def setup(self):
+        numpy.random.seed(0)
+        corners = numpy.random.uniform(0, 100, size=(200, 2))
+        self.bboxes = numpy.hstack([corners, corners + numpy.random.uniform(0, 5, size=(200, 2))])
+        self.bboxes[::50] = numpy.nan
+        self.index = geometry.SpatialIndex(self.bboxes)
+
+        self.workspace = tempfile.mkdtemp()
+        self.layer = shapefile.copy(
+            resource_filename('propagator.testing.intersect_layers', 'subcatchments.shp'),
+            os.path.join(self.workspace, 'test.shp')
+        )
+
+    def teardown(self):
+        shutil.rmtree(self.workspace)
+
+    def brute_force(self, queries):
+        b, q = self.bboxes[None, :, :], queries[:, None, :]
+        hits = (q[..., 0] <= b[..., 2]) & (q[..., 2] >= b[..., 0]) & \
+               (q[..., 1] <= b[..., 3]) & (q[..., 3] >= b[..., 1])
+        return numpy.nonzero(hits)
+
+    def test_levels(self):
+        nt.assert_equal(len(self.index), 196)
+        nt.assert_equal(self.index.levels[-1].shape[0], 1)
+        nptest.assert_array_almost_equal(
+            self.index.levels[-1][0],
+            [numpy.nanmin(self.bboxes[:, 0]), numpy.nanmin(self.bboxes[:, 1]),
+             numpy.nanmax(self.bboxes[:, 2]), numpy.nanmax(self.bboxes[:, 3])]
+        )
+
+    def test_query_bboxes(self):
+        corners = numpy.random.uniform(0, 100, size=(50, 2))
+        queries = numpy.hstack([corners, corners + 10])
+        query, feature = self.index.query_bboxes(queries)
+        expected_query, expected_feature = self.brute_force(queries)
+        nptest.assert_array_equal(query, expected_query)
+        nptest.assert_array_equal(feature, expected_feature)
+
+    def test_padding_is_quiet(self):
+        # 196 boxes do not fill the nodes, so the queries compare NaNs
+        with numpy.errstate(all='raise'):
+            self.index.query_points([50.0], [50.0])
+            self.index.query_segments([0.0], [0.0], [100.0], [100.0])
+
+    def test_query_points(self):
+        points = numpy.random.uniform(0, 100, size=(50, 2))
+        query, feature = self.index.query_points(points[:, 0], points[:, 1])
+        expected_query, expected_feature = self.brute_force(numpy.hstack([points, points]))
+        nptest.assert_array_equal(query, expected_query)
+        nptest.assert_array_equal(feature, expected_feature)
+
+    def test_query_segments(self):
+        index = geometry.SpatialIndex([(0, 0, 1, 1), (2, 2, 3, 3), (0, 2, 1, 3)])
+        query, feature = index.query_segments([-1, 1.5, 0.5], [-1, 0, 2.5], [4, 1.5, 0.5], [4, 4, 4])
+        nptest.assert_array_equal(query, [0, 0, 2])
+        nptest.assert_array_equal(feature, [0, 1, 2])
+
+    def test_from_shapefile(self):
+        sidecar = os.path.join(self.workspace, 'test.sidx.npz')
+        index = geometry.SpatialIndex.from_shapefile(self.layer)
+        nt.assert_true(os.path.exists(sidecar))
+        nt.assert_equal(len(index), 10)
+
+        loaded = geometry.SpatialIndex.load(sidecar, checksum=geometry._checksum(self.layer))
+        nptest.assert_array_equal(loaded.order, index.order)
+        for a, b in zip(loaded.levels, index.levels):
+            nptest.assert_array_equal(a, b)
+
+        # a stale index is not reused
+        nt.assert_true(geometry.SpatialIndex.load(sidecar, checksum='junk') is None)
+
+
+class Test_PolygonSet(object):
+    def setup(self):
+        self.polygons = geometry.PolygonSet([donut(0, 0, 4, 1), square(10, 0, 2)])
+
+    def test_attributes(self):
+        nt.assert_equal(len(self.polygons), 2)
+        nptest.assert_array_equal(self.polygons.vertex_ptr, [0, 10, 15])
+        nptest.assert_array_equal(self.polygons.bbox, [[0, 0, 4, 4], [10, 0, 12, 2]])
+
+    def test_edges(self):
+        # the edge between the outer ring and the hole is skipped
+        x1, y1, x2, y2 = self.polygons.edges(0)
+        nt.assert_equal(x1.shape[0], 8)
+
+    def test_contains(self):
+        px = numpy.array([0.5, 2.0, 3.5, 5.0])
+        py = numpy.array([0.5, 2.0, 3.5, 2.0])
+        nptest.assert_array_equal(self.polygons.contains(0, px, py), [True, False, True, False])
+
+    def test_contains_blocks(self):
+        px = numpy.random.uniform(-1, 5, size=500)
+        py = numpy.random.uniform(-1, 5, size=500)
+        nptest.assert_array_equal(
+            self.polygons.contains(0, px, py, blocksize=16),
+            self.polygons.contains(0, px, py)
+        )
+
+
+class Test_points_in_polygons(object):
+    def setup(self):
+        self.polygons = [donut(0, 0, 4, 1), square(10, 0, 2), square(1.5, 1.5, 1)]
+        self.points = numpy.array([
+            (0.5, 0.5), (2.0, 2.0), (11.0, 1.0), (20.0, 20.0), (3.5, 3.5), (5.0, 2.0),
+        ])
+        self.expected = [0, 2, 1, -1, 0, -1]
+
+    def test_baseline(self):
+        index = geometry.points_in_polygons(self.points, self.polygons)
+        nptest.assert_array_equal(index, self.expected)
+
+    def test_parallel(self):
+        index = geometry.points_in_polygons(self.points, self.polygons, n_workers=3)
+        nptest.assert_array_equal(index, self.expected)
+
+    def test_overlapping(self):
+        polygons = [square(0, 0, 4), square(1, 1, 1)]
+        index = geometry.points_in_polygons([(1.5, 1.5)], polygons, n_workers=2)
+        nptest.assert_array_equal(index, [0])
+
+
+class Test_join_points_to_polygons(object):
+    def setup(self):
+        self.points = resource_filename('propagator.testing.intersect_layers', 'monitoring_locations.shp')
+        self.polygons = resource_filename('propagator.testing.intersect_layers', 'subcatchments.shp')
+        self.expected = resource_filename('propagator.testing.intersect_layers', 'expected.shp')
+        self.workspace = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.workspace)
+
+    def check(self, n_workers):
+        result = geometry.join_points_to_polygons(
+            self.points, self.polygons,
+            point_fields=['Station', 'Dry_B'],
+            polygon_fields=['CID', 'DS_CID'],
+            n_workers=n_workers,
+            persist=False,
+        )
+        expected = shapefile.read_dbf(self.expected, fields=['CID', 'Station', 'Dry_B'])
+
+        nt.assert_tuple_equal(result.dtype.names, ('CID', 'DS_CID', 'Station', 'Dry_B'))
+        result.sort(order='Station')
+        expected.sort(order='Station')
+        nptest.assert_array_equal(result['CID'], expected['CID'])
+        nptest.assert_array_equal(result['Station'], expected['Station'])
+        nptest.assert_array_almost_equal(result['Dry_B'], expected['Dry_B'])
+
+    def test_baseline(self):
+        self.check(1)
+
+    def test_parallel(self):
+        self.check(4)
+
+    def test_no_point_fields(self):
+        result = geometry.join_points_to_polygons(self.points, self.polygons, ['CID'], ['CID'],
+                                                  persist=False)
+        nt.assert_tuple_equal(result.dtype.names, ('CID',))
+        nt.assert_equal(result.shape[0], 14)
+
+    def test_checksum_once(self):
+        points = shapefile.copy(self.points, os.path.join(self.workspace, 'test_points.shp'))
+        polygons = shapefile.copy(self.polygons, os.path.join(self.workspace, 'test.shp'))
+        with mock.patch.object(geometry, '_checksum', wraps=geometry._checksum) as checksum:
+            geometry.join_points_to_polygons(points, polygons, ['Station'], ['CID'])
+
+        # the polygons' checksum is shared with their spatial index
+        nt.assert_equal(checksum.call_count, 2)
+        nt.assert_true(os.path.exists(os.path.join(self.workspace, 'test.sidx.npz')))
+
+    def test_persist(self):
+        points = shapefile.copy(self.points, os.path.join(self.workspace, 'test_points.shp'))
+        polygons = shapefile.copy(self.polygons, os.path.join(self.workspace, 'test.shp'))
+        sidecar = os.path.join(self.workspace, 'test_points.join.npz')
+
+        original = geometry.points_in_polygons
+        try:
+            first = geometry.join_points_to_polygons(points, polygons, ['Station'], ['CID'])
+            nt.assert_true(os.path.exists(sidecar))
+
+            # new attributes reuse the stored join
+            shapefile.update_dbf(polygons, {'CID': 'X'})
+            geometry.points_in_polygons = None
+            second = geometry.join_points_to_polygons(points, polygons, ['Station'], ['CID'])
+            nptest.assert_array_equal(second['Station'], first['Station'])
+            nptest.assert_array_equal(second['CID'], ['X'] * first.shape[0])
+        finally:
+            geometry.points_in_polygons = original
+            shapefile.delete(points)
+            shapefile.delete(polygons)
+
+        nt.assert_false(os.path.exists(sidecar))
+
+
+class Test_clip_lines(object):
+    def setup(self):
+        self.polygons = [square(0, 0, 2), square(2, 0, 2)]
+        self.lines = [
+            shapefile.Shape(shapefile.POLYLINE, numpy.array([0]),
+                            numpy.array([(-1, 1), (1, 1), (3, 1), (5, 1)], dtype=float), None),
+            shapefile.Shape(shapefile.POLYLINE, numpy.array([0]),
+                            numpy.array([(2, -1), (2, 3)], dtype=float), None),
+        ]
+
+    def test_split(self):
+        features, polygons, paths = geometry.clip_lines(self.lines[:1], self.polygons)
+        nptest.assert_array_equal(features, [0, 0])
+        nptest.assert_array_equal(polygons, [0, 1])
+        nptest.assert_array_almost_equal(paths[0], [(0, 1), (1, 1), (2, 1)])
+        nptest.assert_array_almost_equal(paths[1], [(2, 1), (3, 1), (4, 1)])
+
+    def test_on_boundary(self):
+        # lines on a shared boundary are kept in both polygons
+        features, polygons, paths = geometry.clip_lines(self.lines[1:], self.polygons, n_workers=2)
+        nptest.assert_array_equal(polygons, [0, 1])
+        for path in paths:
+            nptest.assert_array_almost_equal(path, [(2, 0), (2, 2)])
+
+    def test_outside(self):
+        features, polygons, paths = geometry.clip_lines(self.lines, [square(10, 10, 1)])
+        nt.assert_equal(features.shape[0], 0)
+        nt.assert_list_equal(paths, [])
+
+
+class Test_dissolve_paths(object):
+    def test_split_at_junction(self):
+        main = numpy.array([(0, 0), (1, 0), (2, 0)], dtype=float)
+        tributary = numpy.array([(1, 1), (1, 0)], dtype=float)
+        shape = geometry.dissolve_paths([main, tributary])
+        nptest.assert_array_equal(shape.parts, [0, 2, 4])
+        nptest.assert_array_equal(shape.points, [(0, 0), (1, 0), (1, 0), (2, 0), (1, 1), (1, 0)])
+
+    def test_merge_continuations(self):
+        first = numpy.array([(0, 0), (1, 0)], dtype=float)
+        second = numpy.array([(1, 0), (2, 1)], dtype=float)
+        shape = geometry.dissolve_paths([second, first])
+        nptest.assert_array_equal(shape.parts, [0])
+        nptest.assert_array_equal(shape.points, [(0, 0), (1, 0), (2, 1)])
+
+
+class Test_aggregate_lines_by_polygons(object):
+    def setup(self):
+        data = resource_filename('propagator.testing', 'agg_stream_in_subc')
+        self.streams = os.path.join(data, 'streams.shp')
+        self.subcatchments = os.path.join(data, 'subc.shp')
+        self.expected = os.path.join(data, 'expected.shp')
+        self.workspace = tempfile.mkdtemp()
+        self.output = os.path.join(self.workspace, 'test.shp')
+
+    def teardown(self):
+        shutil.rmtree(self.workspace)
+
+    def test_baseline(self):
+        result = geometry.aggregate_lines_by_polygons(
+            self.streams, self.subcatchments, self.output,
+            by_fields=['CID', 'DS_CID'],
+            field_stat_tuples=[('WQ_1', 'first'), ('WQ_2', 'first')],
+            persist=False,
+        )
+        nt.assert_equal(result, self.output)
+        nt.assert_list_equal(shapefile.read_dbf_header(self.output)[0],
+                             shapefile.read_dbf_header(self.expected)[0])
+        nptest.assert_array_equal(shapefile.read_dbf(self.output), shapefile.read_dbf(self.expected))
+
+        for r, e in zip(shapefile.read_shapes(self.output), shapefile.read_shapes(self.expected)):
+            nptest.assert_array_equal(r.parts, e.parts)
+            nptest.assert_allclose(r.points, e.points, atol=0.001)
+
+    def test_statistics(self):
+        geometry.aggregate_lines_by_polygons(
+            self.streams, self.subcatchments, self.output,
+            by_fields=['DS_CID'],
+            field_stat_tuples=[('WQ_1', 'count'), ('Id', 'max')],
+            persist=False,
+        )
+        table = shapefile.read_dbf(self.output)
+        nt.assert_tuple_equal(table.dtype.names, ('DS_CID', 'COUNT_WQ_1', 'MAX_Id'))
+        nptest.assert_array_equal(table['COUNT_WQ_1'], [2, 4, 2, 2])
+
+    def test_truncated_names(self):
+        geometry.aggregate_lines_by_polygons(
+            self.streams, self.subcatchments, self.output,
+            by_fields=['CID'],
+            field_stat_tuples=[('DS_CID', 'first'), ('DS_CID', 'first'), ('DS_CID', 'count')],
+            persist=False,
+        )
+        names = shapefile.read_dbf(self.output).dtype.names
+        nt.assert_tuple_equal(names, ('CID', 'FIRST_DS_C', 'FIRST_DS_1', 'COUNT_DS_C'))
+
+        field = shapefile.DbfField('DS_CID', 'C', 10, 0)
+        taken = ['FIRST_DS_C', 'FIRST_DS_1']
+        nt.assert_equal(geometry._stat_field(field, 'FIRST', None, taken).name, 'FIRST_DS_2')
+
+    def test_persist(self):
+        streams = shapefile.copy(self.streams, os.path.join(self.workspace, 'streams.shp'))
+        subcatchments = shapefile.copy(self.subcatchments, os.path.join(self.workspace, 'subc.shp'))
+        sidecar = os.path.join(self.workspace, 'streams.clip.npz')
+        options = dict(by_fields=['CID', 'DS_CID'], field_stat_tuples=[('WQ_1', 'first')])
+        geometry.aggregate_lines_by_polygons(streams, subcatchments, self.output, **options)
+        expected = shapefile.read_shapes(self.output)
+
+        original = geometry.clip_lines
+        try:
+            geometry.clip_lines = None
+            geometry.aggregate_lines_by_polygons(streams, subcatchments, self.output, **options)
+        finally:
+            geometry.clip_lines = original
+
+        for r, e in zip(shapefile.read_shapes(self.output), expected):
+            nptest.assert_array_equal(r.points, e.points)
+
+        # stored pieces are not reused with another tolerance
+        key = '{}:{}:{!r}'.format(geometry._checksum(streams),
+                                  geometry._checksum(subcatchments), 0.001)
+        nt.assert_true(geometry._load_sidecar(sidecar, key) is not None)
+        nt.assert_true(geometry._load_sidecar(sidecar, key.replace('0.001', '0.01')) is None)
+
+    @nt.raises(ValueError)
+    def test_bad_statistic(self):
+        geometry.aggregate_lines_by_polygons(
+            self.streams, self.subcatchments, self.output,
+            by_fields=['CID'], field_stat_tuples=[('WQ_1', 'junk')],
+        )
+
+    @nt.raises(ValueError)
+    def test_bad_field(self):
+        geometry.aggregate_lines_by_polygons(
+            self.streams, self.subcatchments, self.output,
+            by_fields=['CID'], field_stat_tuples=[('JUNK', 'first')],
+        )
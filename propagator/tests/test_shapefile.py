@@ -0,0 +1,180 @@
+import os
+from pkg_resources import resource_filename
+
+import numpy
+
+import nose.tools as nt
+import numpy.testing as nptest
+
+from propagator import shapefile
+
+
+def square(x0, y0, size):
+    points = numpy.array([
+        (x0, y0), (x0, y0 + size), (x0 + size, y0 + size),
+        (x0 + size, y0), (x0, y0),
+    ], dtype=float)
+    return shapefile.Shape(shapefile.POLYGON, numpy.array([0]), points, None)
+
+
+class Test_dbf(object):
+    def setup(self):
+        self.workspace = resource_filename('propagator.testing', 'update_attribute_table')
+        self.outputpath = os.path.join(self.workspace, 'test.dbf')
+        self.table = numpy.array(
+            [(1, 1.25, u'A1', True), (22, -0.5, u'B2', False), (333, numpy.nan, u'', True)],
+            dtype=[('ID', '<i4'), ('Value', float), ('Name', '<U10'), ('Flag', bool)]
+        )
+
+    def teardown(self):
+        if os.path.exists(self.outputpath):
+            os.remove(self.outputpath)
+
+    def test_read_dbf_header(self):
+        fields, n_records, _, _ = shapefile.read_dbf_header(os.path.join(self.workspace, 'input.shp'))
+        nt.assert_equal(n_records, 4)
+        nt.assert_list_equal([f.name for f in fields], ['id', 'ds_id', 'Cu', 'Pb'])
+        nt.assert_equal(fields[2], shapefile.DbfField('Cu', 'C', 5, 0))
+
+    def test_read_dbf_fields(self):
+        table = shapefile.read_dbf(os.path.join(self.workspace, 'input.shp'), fields=['Pb', 'id'])
+        nt.assert_tuple_equal(table.dtype.names, ('Pb', 'id'))
+        nptest.assert_array_equal(table['Pb'], ['', 'Pb_2', '', 'Pb_4'])
+        nptest.assert_array_equal(table['id'], [1, 2, 3, 4])
+
+    @nt.raises(ValueError)
+    def test_read_dbf_bad_field(self):
+        shapefile.read_dbf(os.path.join(self.workspace, 'input.shp'), fields=['JUNK'])
+
+    def test_round_trip(self):
+        shapefile.write_dbf(self.outputpath, self.table)
+        result = shapefile.read_dbf(self.outputpath)
+        for name in self.table.dtype.names:
+            nptest.assert_array_equal(result[name], self.table[name])
+
+    def test_round_trip_with_fields(self):
+        fields = [
+            shapefile.DbfField('ID', 'N', 5, 0),
+            shapefile.DbfField('Value', 'N', 8, 2),
+            shapefile.DbfField('Name', 'C', 1, 0),
+            shapefile.DbfField('Flag', 'L', 1, 0),
+        ]
+        shapefile.write_dbf(self.outputpath, self.table, fields=fields)
+        result = shapefile.read_dbf(self.outputpath)
+        nptest.assert_array_equal(result['ID'], self.table['ID'])
+        nptest.assert_array_equal(result['Value'], self.table['Value'])
+        nptest.assert_array_equal(result['Name'], ['A', 'B', ''])
+        nt.assert_equal(result.dtype['Name'], numpy.dtype('<U1'))
+
+    def test_DbfTable(self):
+        with shapefile.DbfTable(os.path.join(self.workspace, 'input.shp')) as dbf:
+            nt.assert_equal(len(dbf), 4)
+            nt.assert_list_equal(dbf.names, ['id', 'ds_id', 'Cu', 'Pb'])
+            nt.assert_true(isinstance(dbf.records, numpy.memmap))
+            nt.assert_equal(dbf.records['Cu'][1], b'Cu_2 ')
+            nptest.assert_array_equal(dbf.deleted, [False] * 4)
+
+            # columns are decoded on first access, then reused
+            nt.assert_equal(len(dbf._columns), 0)
+            nptest.assert_array_equal(dbf['Cu'], ['', 'Cu_2', '', 'Cu_4'])
+            nt.assert_true(dbf['Cu'] is dbf.column('Cu'))
+            nt.assert_list_equal(list(dbf._columns.keys()), ['Cu'])
+
+    @nt.raises(ValueError)
+    def test_DbfTable_bad_field(self):
+        with shapefile.DbfTable(os.path.join(self.workspace, 'input.shp')) as dbf:
+            dbf['JUNK']
+
+    def test_update_dbf(self):
+        shapefile.write_dbf(self.outputpath, self.table)
+        size = os.path.getsize(self.outputpath)
+
+        shapefile.update_dbf(self.outputpath, {'Value': [9.5, 10.5], 'Name': u'X'}, rows=[0, 2])
+        result = shapefile.read_dbf(self.outputpath)
+        nt.assert_equal(os.path.getsize(self.outputpath), size)
+        nptest.assert_array_equal(result['Value'], [9.5, -0.5, 10.5])
+        nptest.assert_array_equal(result['Name'], ['X', 'B2', 'X'])
+        nptest.assert_array_equal(result['ID'], self.table['ID'])
+
+    @nt.raises(ValueError)
+    def test_update_dbf_bad_field(self):
+        shapefile.write_dbf(self.outputpath, self.table)
+        shapefile.update_dbf(self.outputpath, {'JUNK': 1})
+
+    def test_update_dbf_no_rows(self):
+        shapefile.write_dbf(self.outputpath, self.table)
+        shapefile.update_dbf(self.outputpath, {'Value': [], 'ID': []}, rows=[])
+        result = shapefile.read_dbf(self.outputpath)
+        nptest.assert_array_equal(result['Value'], self.table['Value'])
+
+    def test_field_dtype(self):
+        nt.assert_equal(shapefile.field_dtype(shapefile.DbfField('x', 'C', 20, 0)), numpy.dtype('<U20'))
+        nt.assert_equal(shapefile.field_dtype(shapefile.DbfField('x', 'N', 9, 0)), numpy.dtype('<i4'))
+        nt.assert_equal(shapefile.field_dtype(shapefile.DbfField('x', 'N', 10, 0)), numpy.dtype('<f8'))
+        nt.assert_equal(shapefile.field_dtype(shapefile.DbfField('x', 'F', 19, 11)), numpy.dtype('<f8'))
+
+
+class Test_shapes(object):
+    def setup(self):
+        self.workspace = resource_filename('propagator.testing', 'update_attribute_table')
+        self.outputpath = os.path.join(self.workspace, 'test.shp')
+        self.shapes = [square(0, 0, 2), square(5, 5, 1)]
+
+    def teardown(self):
+        shapefile.delete(self.outputpath)
+
+    def test_round_trip(self):
+        shapefile.write_shapes(self.outputpath, shapefile.POLYGON, self.shapes)
+        nt.assert_equal(shapefile.count_records(self.outputpath), 2)
+
+        shapetype, bbox = shapefile.read_shp_header(self.outputpath)
+        nt.assert_equal(shapetype, shapefile.POLYGON)
+        nt.assert_tuple_equal(bbox, (0., 0., 6., 6.))
+
+        result = shapefile.read_shapes(self.outputpath)
+        for r, s in zip(result, self.shapes):
+            nptest.assert_array_equal(r.parts, s.parts)
+            nptest.assert_array_equal(r.points, s.points)
+
+    def test_read_existing(self):
+        path = os.path.join(self.workspace, 'input.shp')
+        shapes = shapefile.read_shapes(path)
+        nt.assert_equal(len(shapes), shapefile.count_records(path))
+
+    def test_read_bboxes(self):
+        shapefile.write_shapes(self.outputpath, shapefile.POLYGON, self.shapes)
+        nptest.assert_array_equal(shapefile.read_bboxes(self.outputpath), [[0, 0, 2, 2], [5, 5, 6, 6]])
+
+    def test_read_bboxes_points(self):
+        path = resource_filename('propagator.testing.intersect_layers', 'monitoring_locations.shp')
+        expected = numpy.vstack([s.points[[0, 0]].ravel() for s in shapefile.read_shapes(path)])
+        nptest.assert_array_equal(shapefile.read_bboxes(path), expected)
+
+    def test_read_projection(self):
+        path = resource_filename('propagator.testing.tbx_propagate', 'subcatchments.shp')
+        nt.assert_true(shapefile.read_projection(path).startswith('PROJCS['))
+
+        shapefile.write_shapes(self.outputpath, shapefile.POLYGON, self.shapes)
+        nt.assert_true(shapefile.read_projection(self.outputpath) is None)
+
+    def test_same_projection(self):
+        ws = resource_filename('propagator.testing', 'tbx_propagate')
+        subcatchments = os.path.join(ws, 'subcatchments.shp')
+        nt.assert_true(shapefile.same_projection(subcatchments, os.path.join(ws, 'expected_subc.shp')))
+        nt.assert_false(shapefile.same_projection(subcatchments, os.path.join(ws, 'monitoring_locations.shp')))
+
+    def test_area(self):
+        nt.assert_equal(shapefile.shape_area(self.shapes[0]), 4.)
+
+    def test_area_with_hole(self):
+        hole = square(0.5, 0.5, 1)
+        points = numpy.vstack([self.shapes[0].points, hole.points[::-1]])
+        donut = shapefile.Shape(shapefile.POLYGON, numpy.array([0, 5]), points, None)
+        nt.assert_equal(shapefile.shape_area(donut), 3.)
+
+    def test_length(self):
+        nt.assert_equal(shapefile.shape_length(self.shapes[1]), 4.)
+
+    def test_centroid(self):
+        nptest.assert_array_almost_equal(shapefile.shape_centroid(self.shapes[0]), (1., 1.))
+        nptest.assert_array_almost_equal(shapefile.shape_centroid(self.shapes[1]), (5.5, 5.5))
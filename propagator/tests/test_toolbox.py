@@ -139,11 +139,35 @@ class Test_propagate_baseline(object):
                 ds_col='DS_CID',
                 value_columns=self.columns,
                 streams='streams.shp',
-                output_path='test.shp'
+                output_path='test.shp',
+                persist=False,
             )
 
         self.check(subc_layer, stream_layer, self.subc_expected_base, self.stream_expected_base)
 
+    @nptest.dec.skipif(not pptest.has_fiona)
+    def test_parallel(self):
+        analysis = propagator.analysis
+        with utils.WorkSpace(self.ws), utils.OverwriteState(True), \
+                mock.patch.object(analysis, 'preprocess_wq', wraps=analysis.preprocess_wq) as pwq, \
+                mock.patch.object(analysis, 'aggregate_streams_by_subcatchment',
+                                  wraps=analysis.aggregate_streams_by_subcatchment) as agg:
+            subc_layer, stream_layer = propagator.toolbox.propagate(
+                subcatchments='subcatchments.shp',
+                monitoring_locations='monitoring_locations.shp',
+                id_col='CID',
+                ds_col='DS_CID',
+                value_columns=self.columns,
+                streams='streams.shp',
+                output_path='test.shp',
+                n_workers=2,
+                persist=False,
+            )
+
+        nt.assert_equal(pwq.call_args[1]['n_workers'], 2)
+        nt.assert_equal(agg.call_args[1]['n_workers'], 2)
+        self.check(subc_layer, stream_layer, self.subc_expected_base, self.stream_expected_base)
+
     @nptest.dec.skipif(not pptest.has_fiona)
     def test_filtered(self):
         stacol = 'StationTyp'
@@ -157,7 +181,8 @@ class Test_propagate_baseline(object):
                 ml_filter_cols=stacol,
                 value_columns=self.columns,
                 streams='streams.shp',
-                output_path='test.shp'
+                output_path='test.shp',
+                persist=False,
             )
 
         self.check(subc_layer, stream_layer, self.subc_expected_filtered, self.stream_expected_filtered)
@@ -175,12 +200,167 @@ class Test_propagate_baseline(object):
                 ml_filter_cols=stacol,
                 value_columns=self.muli_agg_columns,
                 streams='streams.shp',
-                output_path='test.shp'
+                output_path='test.shp',
+                persist=False,
             )
 
         self.check(subc_layer, stream_layer, self.subc_expected_multi_agg, self.stream_expected_multi_agg)
 
 
+class Test_propagate_scenarios(object):
+    def setup(self):
+        self.ws = resource_filename('propagator.testing', 'tbx_propagate')
+        self.columns = [
+            ['Dry_B', 'averAgE'],
+            ['Dry_M', 'MEDIAN'],
+            ['Dry_N', 'MINIMUM'],
+            ['Wet_B', 'MAXIMum'],
+            ['Wet_M', 'averAgE'],
+            ['Wet_N', 'Median'],
+        ]
+        stacol = 'StationTyp'
+        self.scenarios = [
+            dict(name='base', value_columns=self.columns),
+            dict(name='filt', value_columns=self.columns, ml_filter_cols=stacol,
+                 ml_filter=lambda row: row[stacol] in ['Channel', 'Outfall', 'Outfall, Coastal']),
+        ]
+        self.results = []
+
+    def teardown(self):
+        utils.cleanup_temp_results(*[os.path.join(self.ws, r) for r in self.results])
+
+    @nptest.dec.skipif(not pptest.has_fiona)
+    def test_separate(self):
+        with utils.WorkSpace(self.ws), utils.OverwriteState(True):
+            outputs = propagator.toolbox.propagate_scenarios(
+                subcatchments='subcatchments.shp',
+                monitoring_locations='monitoring_locations.shp',
+                id_col='CID',
+                ds_col='DS_CID',
+                scenarios=self.scenarios,
+                streams='streams.shp',
+                output_path='test.shp',
+                persist=False,
+            )
+        self.results = [r for output in outputs.values() for r in output[:2]]
+
+        nt.assert_list_equal(list(outputs.keys()), ['base', 'filt'])
+        nt.assert_tuple_equal(outputs['base'][:2], ('test_base_subcatchments.shp', 'test_base_streams.shp'))
+        nt.assert_equal(outputs['base'][2]['aveDry_B'], 'aveDry_B')
+        pptest.assert_shapefiles_are_close(
+            os.path.join(self.ws, 'expected_subc.shp'),
+            os.path.join(self.ws, outputs['base'][0]),
+        )
+        pptest.assert_shapefiles_are_close(
+            os.path.join(self.ws, 'expected_filtered_subc.shp'),
+            os.path.join(self.ws, outputs['filt'][0]),
+        )
+
+    @nptest.dec.skipif(not pptest.has_fiona)
+    def test_combined(self):
+        with utils.WorkSpace(self.ws), utils.OverwriteState(True):
+            outputs = propagator.toolbox.propagate_scenarios(
+                subcatchments='subcatchments.shp',
+                monitoring_locations='monitoring_locations.shp',
+                id_col='CID',
+                ds_col='DS_CID',
+                scenarios=self.scenarios[:1],
+                streams='streams.shp',
+                output_path='test.shp',
+                combine=True,
+                persist=False,
+            )
+            self.results = list(outputs['base'][:2])
+
+            nt.assert_tuple_equal(outputs['base'][:2], ('test_subcatchments.shp', 'test_streams.shp'))
+            nt.assert_equal(outputs['base'][2]['aveDry_B'], 'aveDry_B_b')
+            nt.assert_equal(outputs['base'][2]['medWet_N'], 'medWet_N_b')
+            for layer in outputs['base'][:2]:
+                fields = utils.get_field_names(layer)
+                nt.assert_true('aveDry_B_b' in fields)
+                nt.assert_true('medWet_N_b' in fields)
+
+    @nptest.dec.skipif(not pptest.has_fiona)
+    def test_combined_truncated_names(self):
+        self.scenarios[0]['name'] = 'filtered_all'
+        self.scenarios[1]['name'] = 'filtered'
+        with utils.WorkSpace(self.ws), utils.OverwriteState(True):
+            outputs = propagator.toolbox.propagate_scenarios(
+                subcatchments='subcatchments.shp',
+                monitoring_locations='monitoring_locations.shp',
+                id_col='CID',
+                ds_col='DS_CID',
+                scenarios=self.scenarios,
+                streams='streams.shp',
+                output_path='test.shp',
+                combine=True,
+                persist=False,
+            )
+            self.results = list(outputs['filtered'][:2])
+
+            nt.assert_tuple_equal(outputs['filtered'][:2], outputs['filtered_all'][:2])
+            nt.assert_equal(outputs['filtered_all'][2]['aveDry_B'], 'aveDry_B_f')
+            nt.assert_equal(outputs['filtered'][2]['aveDry_B'], 'aveDry_B_1')
+
+            fields = utils.get_field_names(outputs['filtered'][0])
+            nt.assert_true('aveDry_B_f' in fields)
+            nt.assert_true('aveDry_B_1' in fields)
+
+
+def test__shapefile_field_names():
+    names = toolbox._shapefile_field_names(
+        ['aveDry_B_base', 'aveDry_B_both', 'Dry_B', 'medWet_N_base'],
+        taken=['Dry_B']
+    )
+    nt.assert_list_equal(names, ['aveDry_B_b', 'aveDry_B_1', 'Dry_B_1', 'medWet_N_b'])
+
+
+@nptest.dec.skipif(not pptest.has_fiona)
+def test_update_propagation():
+    ws = resource_filename('propagator.testing', 'tbx_propagate')
+    columns = [
+        ['Dry_B', 'averAgE'],
+        ['Dry_M', 'MEDIAN'],
+        ['Dry_N', 'MINIMUM'],
+        ['Wet_B', 'MAXIMum'],
+        ['Wet_M', 'averAgE'],
+        ['Wet_N', 'Median'],
+    ]
+
+    with utils.WorkSpace(ws), utils.OverwriteState(True):
+        subc_layer, stream_layer = propagator.toolbox.propagate(
+            subcatchments='subcatchments.shp',
+            monitoring_locations='monitoring_locations.shp',
+            id_col='CID',
+            ds_col='DS_CID',
+            value_columns=columns,
+            streams='streams.shp',
+            output_path='test.shp',
+            persist=False,
+        )
+
+        # zero out the propagated scores of a whole basin, then restore them
+        utils.populate_field(subc_layer, lambda row: 0.0, 'aveDry_B')
+        result = propagator.toolbox.update_propagation(
+            subcatchments=subc_layer,
+            id_col='CID',
+            ds_col='DS_CID',
+            monitoring_locations='monitoring_locations.shp',
+            ml_id_col='Station',
+            changed_ids=[],
+            value_columns=columns,
+            subcatchment_ids=['O728SJ', 'O12106DP'],
+            persist=False,
+        )
+        nt.assert_tuple_equal(result, (subc_layer, None))
+
+    pptest.assert_shapefiles_are_close(
+        os.path.join(ws, 'expected_subc.shp'),
+        os.path.join(ws, subc_layer),
+    )
+    utils.cleanup_temp_results(os.path.join(ws, subc_layer), os.path.join(ws, stream_layer))
+
+
 def test_accumulate():
     ws = resource_filename('propagator.testing', 'score_accumulator')
 
@@ -201,14 +381,84 @@ def test_accumulate():
             ],
             streams_layer='streams.shp',
             output_layer='output.shp',
+            persist=False,
         )
 
+        # the expected values keep the 6 significant digits of their
+        # 13-character source fields
         pptest.assert_shapefiles_are_close(os.path.join(ws, 'expected_results.shp'),
-                                           os.path.join(ws, results))
+                                           os.path.join(ws, results), rtol=1e-5)
 
         utils.cleanup_temp_results(os.path.join(ws, results))
 
 
+def test_update_accumulation():
+    ws = resource_filename('propagator.testing', 'score_accumulator')
+    options = dict(
+        id_col='Catch_ID_a',
+        ds_col='Dwn_Catch_',
+        value_columns=[
+            ('DryM', 'maximum', 'n/a'),
+            ('WetB', 'weighted_average', 'imp_ar'),
+            ('WetN', 'average', 'n/a'),
+            ('Area', 'sum', 'n/a'),
+        ],
+    )
+    result_cols = ['MAXDryM', 'WEIWetB', 'AVEWetN', 'SUMArea']
+
+    with utils.WorkSpace(ws), utils.OverwriteState(True):
+        subcatchments = utils.copy_layer('subcatchment_wq.shp', 'test_subcatchments.shp')
+        updated = toolbox.accumulate(
+            subcatchments_layer=subcatchments,
+            streams_layer='streams.shp',
+            output_layer='test_updated.shp',
+            persist=False,
+            **options
+        )
+
+        edits = utils.load_attribute_table(subcatchments, 'Catch_ID_a', 'DryM', 'Area')[:3]
+        edits['DryM'] += 5
+        edits['Area'] *= 2
+        toolbox.update_accumulation(
+            subcatchments_layer=subcatchments,
+            output_layer=updated,
+            edits=edits,
+            **options
+        )
+
+        # later rounds reuse the accumulated values in memory
+        accumulator = toolbox.load_accumulator(subcatchments_layer=subcatchments, **options)
+        for n in range(2):
+            edits = utils.load_attribute_table(subcatchments, 'Catch_ID_a', 'WetN')[n + 3:n + 5]
+            edits['WetN'] -= 1
+            with mock.patch.object(utils, 'load_attribute_table') as lat:
+                toolbox.update_accumulation(
+                    subcatchments_layer=subcatchments,
+                    output_layer=updated,
+                    edits=edits,
+                    accumulator=accumulator,
+                    id_col=options['id_col'],
+                    ds_col=options['ds_col'],
+                )
+                nt.assert_equal(lat.call_count, 0)
+
+        expected = toolbox.accumulate(
+            subcatchments_layer=subcatchments,
+            streams_layer='streams.shp',
+            output_layer='test_expected.shp',
+            persist=False,
+            **options
+        )
+
+        result_table = utils.load_attribute_table(updated, 'Catch_ID_a', *result_cols)
+        expected_table = utils.load_attribute_table(expected, 'Catch_ID_a', *result_cols)
+        nptest.assert_array_equal(result_table['Catch_ID_a'], expected_table['Catch_ID_a'])
+        for col in result_cols:
+            nptest.assert_array_almost_equal(result_table[col], expected_table[col])
+
+        utils.cleanup_temp_results(*[os.path.join(ws, lyr) for lyr in (subcatchments, updated, expected)])
+
+
 class BaseToolboxChecker_Mixin(object):
     mockMap = mock.Mock(spec=utils.EasyMapDoc)
     mockLayer = mock.Mock(spec=arcpy.mapping.Layer)
@@ -524,7 +774,8 @@ class Test_Propagator_Tbx(BaseToolboxChecker_Mixin):
                 value_columns=columns,
                 output_layer='test.shp',
                 streams='streams.shp',
-                add_output_to_map=True
+                add_output_to_map=True,
+                persist=False,
             )
 
             nt.assert_equal(subc_layer, 'test_subcatchments.shp')
@@ -565,7 +816,8 @@ class Test_Propagator_Tbx(BaseToolboxChecker_Mixin):
                 value_columns=columns,
                 output_layer='test_filtered.shp',
                 streams='streams.shp',
-                add_output_to_map=True
+                add_output_to_map=True,
+                persist=False,
             )
 
             nt.assert_equal(subc_layer, 'test_filtered_subcatchments.shp')
@@ -679,7 +931,8 @@ class Test_Accumulator_Tbx(BaseToolboxChecker_Mixin):
                 value_columns=vc,
                 streams='streams.shp',
                 output_layer='output.shp',
-                add_output_to_map=True
+                add_output_to_map=True,
+                persist=False,
             )
 
             nt.assert_equal(stream_layer, 'output.shp')
@@ -687,6 +940,7 @@ class Test_Accumulator_Tbx(BaseToolboxChecker_Mixin):
             pptest.assert_shapefiles_are_close(
                 os.path.join(ws, 'expected_results.shp'),
                 os.path.join(ws, stream_layer),
+                rtol=1e-5,
             )
 
             utils.cleanup_temp_results(
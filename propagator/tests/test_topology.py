@@ -0,0 +1,220 @@
+import numpy
+
+import nose.tools as nt
+import numpy.testing as nptest
+
+from propagator import topology
+
+
+SUBCATCHMENTS = numpy.array(
+    [
+        ('A1', 'Ocean'), ('A2', 'Ocean'), ('B1', 'A1'), ('B2', 'A1'),
+        ('B3', 'A2'), ('C1', 'B2'), ('C2', 'B3'), ('C3', 'B3'),
+        ('D1', 'C1'), ('D2', 'C3'), ('E1', 'D1'), ('E2', 'D2'),
+        ('F1', 'E1'), ('F2', 'E1'), ('F3', 'E1'), ('G1', 'F1'),
+        ('G2', 'F3'), ('H1', 'G2'),
+    ], dtype=[('ID', '<U5'), ('DS_ID', '<U5')]
+)
+
+
+class Test_WatershedGraph(object):
+    def setup(self):
+        self.subcatchments = SUBCATCHMENTS.copy()
+        self.graph = topology.WatershedGraph(self.subcatchments, 'ID', 'DS_ID')
+
+    def test_size(self):
+        nt.assert_equal(len(self.graph), 18)
+        nt.assert_equal(self.graph.size, 18)
+
+    def test_parents(self):
+        expected = numpy.array([
+            -1, -1, 0, 0, 1, 3, 4, 4, 5, 7, 8, 9, 10, 10, 10, 12, 14, 16
+        ])
+        nptest.assert_array_equal(self.graph.parents, expected)
+
+    def test_codes(self):
+        codes = self.graph.codes(['C1', 'A1', 'Ocean', 'H1'])
+        nptest.assert_array_equal(codes, [5, 0, -1, 17])
+
+    def test_code(self):
+        nt.assert_equal(self.graph.code('E1'), 10)
+        nt.assert_equal(self.graph.code('Junk'), -1)
+
+    def test_children(self):
+        nptest.assert_array_equal(self.graph.children(10), [12, 13, 14])
+        nptest.assert_array_equal(self.graph.ids[self.graph.children(0)], ['B1', 'B2'])
+        nptest.assert_array_equal(self.graph.children(2), [])
+
+    def test_csr(self):
+        nt.assert_equal(self.graph.child_ptr.shape[0], 19)
+        nt.assert_equal(self.graph.child_idx.shape[0], 16)
+        nptest.assert_array_equal(self.graph.n_children.sum(), 16)
+
+    def test_outlets(self):
+        nptest.assert_array_equal(self.graph.outlets, [0, 1])
+
+    def test_tops(self):
+        expected = ['B1', 'C2', 'E2', 'F2', 'G1', 'H1']
+        nptest.assert_array_equal(self.graph.ids[self.graph.tops], expected)
+
+    @nt.raises(ValueError)
+    def test_duplicate_ids(self):
+        subcatchments = numpy.hstack([self.subcatchments, self.subcatchments[:1]])
+        topology.WatershedGraph(subcatchments, 'ID', 'DS_ID')
+
+    def test_empty(self):
+        graph = topology.WatershedGraph(self.subcatchments[:0], 'ID', 'DS_ID')
+        nt.assert_equal(graph.size, 0)
+        nptest.assert_array_equal(graph.codes(['A1']), [-1])
+
+    def test_integer_ids(self):
+        subcatchments = numpy.array(
+            [(10, 0), (20, 10), (30, 10), (40, 30)],
+            dtype=[('ID', int), ('DS_ID', int)]
+        )
+        graph = topology.WatershedGraph(subcatchments, 'ID', 'DS_ID')
+        nptest.assert_array_equal(graph.parents, [-1, 0, 0, 2])
+
+    def test_preorder(self):
+        expected = [
+            'A1', 'B1', 'B2', 'C1', 'D1', 'E1', 'F1', 'G1', 'F2',
+            'F3', 'G2', 'H1', 'A2', 'B3', 'C2', 'C3', 'D2', 'E2',
+        ]
+        nptest.assert_array_equal(self.graph.ids[self.graph.preorder], expected)
+
+    def test_preorder_rank(self):
+        rank = self.graph.preorder_rank
+        nptest.assert_array_equal(self.graph.preorder[rank], numpy.arange(18))
+
+    def test_levels(self):
+        expected = [
+            ['A1', 'A2'], ['B1', 'B2', 'B3'], ['C1', 'C2', 'C3'], ['D1', 'D2'],
+            ['E1', 'E2'], ['F1', 'F2', 'F3'], ['G1', 'G2'], ['H1'],
+        ]
+        levels = self.graph.levels
+        nt.assert_equal(len(levels), len(expected))
+        for level, ids in zip(levels, expected):
+            nptest.assert_array_equal(self.graph.ids[level], ids)
+
+    @nt.raises(ValueError)
+    def test_levels_loop(self):
+        subcatchments = numpy.array(
+            [('A1', 'Ocean'), ('B1', 'C1'), ('C1', 'B1')],
+            dtype=[('ID', '<U5'), ('DS_ID', '<U5')]
+        )
+        topology.WatershedGraph(subcatchments, 'ID', 'DS_ID').levels
+
+    def test_basins(self):
+        expected = [0, 1, 0, 0, 1, 0, 1, 1, 0, 1, 0, 1, 0, 0, 0, 0, 0, 0]
+        nptest.assert_array_equal(self.graph.basins, expected)
+
+    def test_partition(self):
+        parts = self.graph.partition(2)
+        nt.assert_equal(len(parts), 2)
+        nptest.assert_array_equal(self.graph.ids[parts[1]], ['A2', 'B3', 'C2', 'C3', 'D2', 'E2'])
+        nt.assert_equal(parts[0].shape[0], 12)
+
+    def test_partition_too_many(self):
+        parts = self.graph.partition(5)
+        nt.assert_equal(len(parts), 2)
+
+        parts = self.graph.partition(1)
+        nt.assert_equal(len(parts), 1)
+        nptest.assert_array_equal(parts[0], numpy.arange(18))
+
+    def test_intervals(self):
+        start, end = self.graph.intervals
+        nptest.assert_array_equal(start, self.graph.preorder_rank)
+        nptest.assert_array_equal(end - start, [
+            12, 6, 1, 10, 5, 9, 1, 3, 8, 2, 7, 1, 2, 1, 3, 1, 2, 1
+        ])
+
+    def test_is_upstream(self):
+        code = self.graph.code
+        nt.assert_true(self.graph.is_upstream(code('H1'), code('A1')))
+        nt.assert_true(self.graph.is_upstream(code('C1'), code('B2')))
+        nt.assert_false(self.graph.is_upstream(code('A1'), code('C1')))
+        nt.assert_false(self.graph.is_upstream(code('C1'), code('C1')))
+        nt.assert_false(self.graph.is_upstream(code('C2'), code('A1')))
+
+    def test_is_upstream_many(self):
+        result = self.graph.is_upstream(self.graph.codes(['B1', 'B3', 'G1']), self.graph.code('A1'))
+        nptest.assert_array_equal(result, [True, False, True])
+
+    def test_upstream_slice(self):
+        ordered = self.graph.reorder(self.subcatchments)
+        upstream = ordered[self.graph.upstream_slice(self.graph.code('E1'))]
+        nptest.assert_array_equal(upstream['ID'], ['F1', 'G1', 'F2', 'F3', 'G2', 'H1'])
+        nt.assert_true(numpy.shares_memory(upstream, ordered))
+
+    def test_upstream_slice_include_base(self):
+        ordered = self.graph.reorder(self.subcatchments['ID'])
+        upstream = ordered[self.graph.upstream_slice(self.graph.code('C3'), include_base=True)]
+        nptest.assert_array_equal(upstream, ['C3', 'D2', 'E2'])
+
+    @nt.raises(ValueError)
+    def test_reorder_wrong_size(self):
+        self.graph.reorder(self.subcatchments[:5])
+
+    def test_upstream(self):
+        upstream = self.graph.upstream(self.graph.code('E1'))
+        nptest.assert_array_equal(
+            self.graph.ids[upstream],
+            ['F1', 'G1', 'F2', 'F3', 'G2', 'H1']
+        )
+
+    def test_upstream_include_base(self):
+        upstream = self.graph.upstream(self.graph.code('C3'), include_base=True)
+        nptest.assert_array_equal(self.graph.ids[upstream], ['C3', 'D2', 'E2'])
+
+    def test_upstream_of_top(self):
+        upstream = self.graph.upstream(self.graph.code('H1'))
+        nt.assert_equal(upstream.shape[0], 0)
+
+    def test_upstream_many(self):
+        upstream = self.graph.upstream(self.graph.codes(['D2', 'G2']), include_base=True)
+        nptest.assert_array_equal(self.graph.ids[upstream], ['G2', 'H1', 'D2', 'E2'])
+
+    def test_downstream(self):
+        downstream = self.graph.downstream(self.graph.code('H1'))
+        nptest.assert_array_equal(
+            self.graph.ids[downstream],
+            ['G2', 'F3', 'E1', 'D1', 'C1', 'B2', 'A1']
+        )
+
+    def test_downstream_of_outlet(self):
+        downstream = self.graph.downstream(self.graph.code('A2'), include_base=True)
+        nptest.assert_array_equal(self.graph.ids[downstream], ['A2'])
+
+    def test_downstream_many(self):
+        downstream = self.graph.downstream(self.graph.codes(['E2', 'F1', 'C1']), include_base=True)
+        nt.assert_set_equal(
+            set(self.graph.ids[downstream]),
+            set(['E2', 'D2', 'C3', 'B3', 'A2', 'F1', 'E1', 'D1', 'C1', 'B2', 'A1'])
+        )
+
+        # every subcatchment comes before the one it drains into
+        position = dict((node, n) for n, node in enumerate(downstream.tolist()))
+        for node in downstream.tolist():
+            parent = self.graph.parents[node]
+            if parent >= 0:
+                nt.assert_less(position[node], position[parent])
+
+    @nt.raises(ValueError)
+    def test_loop(self):
+        subcatchments = numpy.array(
+            [('A1', 'Ocean'), ('B1', 'C1'), ('C1', 'B1')],
+            dtype=[('ID', '<U5'), ('DS_ID', '<U5')]
+        )
+        topology.WatershedGraph(subcatchments, 'ID', 'DS_ID').preorder
+
+
+def test_upstream_deep_chain():
+    n = 1000000
+    chain = numpy.empty(n, dtype=[('ID', int), ('DS_ID', int)])
+    chain['ID'] = numpy.arange(n)
+    chain['DS_ID'] = chain['ID'] - 1
+
+    graph = topology.WatershedGraph(chain, 'ID', 'DS_ID')
+    upstream = graph.upstream(0, include_base=True)
+    nptest.assert_array_equal(upstream, chain['ID'])
@@ -1,4 +1,6 @@
 import os
+import shutil
+import tempfile
 from pkg_resources import resource_filename
 import time
 
@@ -297,6 +299,25 @@ class Test_create_temp_filename():
             temp_shape = utils.create_temp_filename(filename + '.shp', filetype='shape', num=4)
             nt.assert_equal(temp_shape, known_shape)
 
+    def test_memory(self):
+        with utils.WorkSpace(self.folderworkspace):
+            temp = utils.create_temp_filename(os.path.join('subfolder', 'test.shp'), filetype='memory')
+            nt.assert_equal(temp, 'memory:_temp_test')
+
+            temp = utils.create_temp_filename('memory:test', filetype='memory', num=3)
+            nt.assert_equal(temp, 'memory:_temp_test_3')
+
+    def test_memory_persisted(self):
+        persist = utils.PERSIST_TEMP_RESULTS
+        utils.PERSIST_TEMP_RESULTS = True
+        try:
+            with utils.WorkSpace(self.folderworkspace):
+                known_shape = os.path.join(self.folderworkspace, '_temp_test.shp')
+                temp_shape = utils.create_temp_filename('test.shp', filetype='memory')
+                nt.assert_equal(temp_shape, known_shape)
+        finally:
+            utils.PERSIST_TEMP_RESULTS = persist
+
 
 class Test_check_fields(object):
     table = resource_filename("propagator.testing.check_fields", "test_file.shp")
@@ -558,12 +579,35 @@ def test_load_attribute_table():
     nptest.assert_array_equal(result[:5], expected_top_five)
 
 
+def test_iter_attribute_table():
+    path = resource_filename('propagator.testing.load_attribute_table', 'subcatchments.shp')
+    fields = ('CatchID', 'DwnCatchID', 'Watershed')
+    expected = utils.load_attribute_table(path, *fields)
+
+    chunks = list(utils.iter_attribute_table(path, *fields, chunksize=7))
+    nt.assert_true(all(chunk.shape[0] <= 7 for chunk in chunks))
+    nt.assert_equal(len(chunks), -(-expected.shape[0] // 7))
+    nptest.assert_array_equal(numpy.hstack(chunks), expected)
+
+
+@nt.raises(ValueError)
+def test_iter_attribute_table_bad_field():
+    path = resource_filename('propagator.testing.load_attribute_table', 'subcatchments.shp')
+    utils.iter_attribute_table(path, 'JUNK', chunksize=7)
+
+
 def test_unique_field_values():
     path = resource_filename('propagator.testing.load_attribute_table', 'subcatchments.shp')
     result = utils.unique_field_values(path, 'Watershed')
     nptest.assert_array_equal(result, numpy.array(['San Clemente', 'San Juan Creek']))
 
 
+def test_unique_field_values_chunked():
+    path = resource_filename('propagator.testing.load_attribute_table', 'subcatchments.shp')
+    result = utils.unique_field_values(path, 'Watershed', chunksize=5)
+    nptest.assert_array_equal(result, numpy.array(['San Clemente', 'San Juan Creek']))
+
+
 class Test_groupby_and_aggregate():
     known_counts = {16.0: 32, 150.0: 2}
     buildings = resource_filename("propagator.testing.groupby_and_aggregate", "flooded_buildings.shp")
@@ -598,6 +642,54 @@ class Test_groupby_and_aggregate():
                 delta=0.01
             )
 
+    def test_defaults_chunked(self):
+        counts = utils.groupby_and_aggregate(
+            self.buildings,
+            self.group_col,
+            self.count_col,
+            chunksize=5
+        )
+
+        nt.assert_dict_equal(counts, self.known_counts)
+
+    def test_count_distinct_in_chunks(self):
+        dtype = [('GeoID', '<U4'), ('ID', int)]
+        chunks = [
+            numpy.array([('A', 1), ('B', 1), ('A', 1)], dtype=dtype),
+            numpy.array([], dtype=dtype),
+            numpy.array([('B', 2), ('A', 2), ('A', 1)], dtype=dtype),
+            numpy.array([('C', 5), ('B', 1), ('A', 3)], dtype=dtype),
+        ]
+        counts = utils._count_distinct_in_chunks(iter(chunks), 'GeoID', 'ID', chunksize=2)
+        nt.assert_dict_equal(counts, {'A': 3, 'B': 2, 'C': 1})
+
+    def test_area_chunked(self):
+        areadict = utils.groupby_and_aggregate(
+            self.areas,
+            self.group_col,
+            self.area_op,
+            aggfxn=lambda g: sum([row[1] for row in g]),
+            chunksize=2,
+            combine=lambda a, b: a + b
+        )
+        nt.assert_equal(sorted(areadict.keys()), sorted(self.known_areas.keys()))
+        for key in areadict.keys():
+            nt.assert_almost_equal(
+                areadict[key],
+                self.known_areas[key],
+                delta=0.01
+            )
+
+    @nt.raises(ValueError)
+    def test_chunked_no_combine(self):
+        utils.groupby_and_aggregate(
+            self.areas,
+            self.group_col,
+            self.area_op,
+            aggfxn=lambda g: sum([row[1] for row in g]),
+            chunksize=2
+        )
+
     def test_recarry_sort_no_args(self):
         known = numpy.array([
             ('A', 1.), ('A', 2.), ('A', 3.), ('A', 4.),
@@ -686,6 +778,23 @@ class Test_populate_field(object):
             for row in cur:
                 nt.assert_equal(row[0], row[1] ** 2)
 
+    def test_with_constant(self):
+        utils.add_field_with_value(self.testfile, self.field_added, field_type="LONG")
+        utils.populate_field(self.testfile, 7, self.field_added)
+
+        with arcpy.da.SearchCursor(self.testfile, [self.field_added]) as cur:
+            for row in cur:
+                nt.assert_equal(row[0], 7)
+
+    def test_with_array(self):
+        utils.add_field_with_value(self.testfile, self.field_added, field_type="LONG")
+        values = numpy.arange(utils.count_features(self.testfile)) * 3
+        utils.populate_field(self.testfile, values, self.field_added)
+
+        with arcpy.da.SearchCursor(self.testfile, [self.field_added, "FID"]) as cur:
+            for row in cur:
+                nt.assert_equal(row[0], row[1] * 3)
+
 
 def test_copy_layer():
     with mock.patch.object(arcpy.management, 'Copy') as _copy:
@@ -713,6 +822,12 @@ def test_intersect_layers():
     utils.cleanup_temp_results(os.path.join(ws, 'test.shp'))
 
 
+@nt.raises(ImportError)
+def test_intersect_layers_without_arcpy():
+    with mock.patch.object(utils, 'arcpy', None):
+        utils.intersect_layers(['subcatchments.shp', 'monitoring_locations.shp'], 'test.shp')
+
+
 @nptest.dec.skipif(not pptest.has_fiona)
 def test_concat_results():
     known = resource_filename('propagator.testing.concat_results', 'known.shp')
@@ -773,6 +888,85 @@ def test_get_field_names():
     nt.assert_list_equal(result, expected)
 
 
+class Test_SchemaCache(object):
+    def setup(self):
+        self.cache = utils.SchemaCache()
+        self.layer = resource_filename('propagator.testing.get_field_names', 'input.shp')
+        self.fields = [u'FID', u'Shape', u'Station', u'Latitude', u'Longitude']
+        self.loader = mock.Mock(return_value=self.fields)
+
+        workspace = resource_filename('propagator.testing', 'get_field_names')
+        self.testdbf = os.path.join(workspace, 'test.dbf')
+
+    def teardown(self):
+        if os.path.exists(self.testdbf):
+            os.remove(self.testdbf)
+
+    def test_hit(self):
+        nt.assert_list_equal(self.cache.get(self.layer, self.loader), self.fields)
+        nt.assert_list_equal(self.cache.get(self.layer, self.loader), self.fields)
+        self.loader.assert_called_once_with(self.layer)
+        nt.assert_dict_equal(self.cache.stats, {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_invalidate(self):
+        self.cache.get(self.layer, self.loader)
+        self.cache.invalidate(self.layer)
+        self.cache.get(self.layer, self.loader)
+        nt.assert_equal(self.loader.call_count, 2)
+        nt.assert_equal(self.cache.misses, 2)
+
+    def test_modified(self):
+        shutil.copy(self.layer.replace('.shp', '.dbf'), self.testdbf)
+        layer = self.testdbf.replace('.dbf', '.shp')
+        self.cache.get(layer, self.loader)
+
+        stat = os.stat(self.testdbf)
+        os.utime(self.testdbf, (stat.st_atime, stat.st_mtime + 10))
+        self.cache.get(layer, self.loader)
+        nt.assert_equal(self.loader.call_count, 2)
+
+    def test_not_a_file(self):
+        self.cache.get('fake.gdb/layer', self.loader)
+        self.cache.get('fake.gdb/layer', self.loader)
+        nt.assert_equal(self.loader.call_count, 2)
+        nt.assert_equal(len(self.cache), 0)
+
+    def test_geodatabase(self):
+        folder = tempfile.mkdtemp()
+        try:
+            gdb = os.path.join(folder, 'test.gdb')
+            os.mkdir(gdb)
+            timestamps = os.path.join(gdb, 'timestamps')
+            with open(timestamps, 'w') as f:
+                f.write('1')
+
+            layer = os.path.join(gdb, 'dataset', 'layer')
+            self.cache.get(layer, self.loader)
+            self.cache.get(layer, self.loader)
+            nt.assert_equal(self.loader.call_count, 1)
+
+            # only the timestamps are checked
+            with open(os.path.join(gdb, 'a00000009.gdbtable'), 'w') as f:
+                f.write('fields')
+            self.cache.get(layer, self.loader)
+            nt.assert_equal(self.loader.call_count, 1)
+
+            with open(timestamps, 'a') as f:
+                f.write('2')
+            self.cache.get(layer, self.loader)
+            nt.assert_equal(self.loader.call_count, 2)
+        finally:
+            shutil.rmtree(folder)
+
+    def test_get_field_names(self):
+        utils.SCHEMA_CACHE.clear()
+        utils.get_field_names(self.layer)
+        result = utils.get_field_names(self.layer)
+        nt.assert_list_equal(result, self.fields)
+        nt.assert_equal(utils.SCHEMA_CACHE.hits, 1)
+        nt.assert_equal(utils.SCHEMA_CACHE.misses, 1)
+
+
 class Test_aggregate_geom(object):
     def setup(self):
         self.workspace = resource_filename('propagator.testing', 'aggregate_geom')
@@ -815,6 +1009,16 @@ class Test_aggregate_geom(object):
 
         self.check(results, self.expected_dual)
 
+    @nt.raises(ImportError)
+    def test_without_arcpy(self):
+        with utils.WorkSpace(self.workspace), mock.patch.object(utils, 'arcpy', None):
+            utils.aggregate_geom(
+                layerpath=self.input_file,
+                by_fields='CID',
+                field_stat_tuples=self.stats,
+                outputpath=self.output,
+            )
+
 
 def test_count_features():
     layer = resource_filename('propagator.testing.count_features', 'monitoring_locations.shp')
@@ -878,6 +1082,65 @@ class Test_find_row_in_array(object):
     def test_too_man_rows(self):
          row = utils.find_row_in_array(self.input_array, 'DS_ID', 'A1')
 
+    def test_with_index(self):
+        index = utils.RowIndex(self.input_array, 'ID')
+        row = utils.find_row_in_array(self.input_array, 'ID', 'B2', index=index)
+        nt.assert_tuple_equal(tuple(row), tuple(self.input_array[3]))
+
+    def test_no_rows_returned_with_index(self):
+        index = utils.RowIndex(self.input_array, 'ID')
+        row = utils.find_row_in_array(self.input_array, 'ID', 'Junk', index=index)
+        nt.assert_true(row is None)
+
+    @nt.raises(ValueError)
+    def test_too_man_rows_with_index(self):
+        index = utils.RowIndex(self.input_array, 'DS_ID')
+        utils.find_row_in_array(self.input_array, 'DS_ID', 'A1', index=index)
+
+
+class Test_RowIndex(object):
+    def setup(self):
+        self.input_array = numpy.array(
+            [
+                ('A1', 'Ocean', 'A1_x'), ('A2', 'Ocean', 'A2_x'),
+                ('B1', 'A1', 'None'), ('B2', 'A1', 'B2_x'),
+            ], dtype=[('ID', '<U5'), ('DS_ID', '<U5'), ('Cu', '<U5'),]
+        )
+        self.index = utils.RowIndex(self.input_array, 'ID')
+
+    def test_len(self):
+        nt.assert_equal(len(self.index), 4)
+
+    def test_contains(self):
+        nt.assert_true('B1' in self.index)
+        nt.assert_false('Junk' in self.index)
+
+    def test_position(self):
+        nt.assert_equal(self.index.position('B1'), 2)
+        nt.assert_true(self.index.position('Junk') is None)
+
+    def test_find(self):
+        row = self.index.find('A2')
+        nt.assert_tuple_equal(tuple(row), tuple(self.input_array[1]))
+
+    def test_unique_values_of_duplicated_column(self):
+        index = utils.RowIndex(self.input_array, 'Cu')
+        nt.assert_equal(index.position('B2_x'), 3)
+
+    @nt.raises(ValueError)
+    def test_duplicates(self):
+        index = utils.RowIndex(self.input_array, 'DS_ID')
+        index.find('Ocean')
+
+    def test_positions(self):
+        positions = self.index.positions(['B2', 'Junk', 'A1'])
+        nptest.assert_array_equal(positions, [3, -1, 0])
+
+    @nt.raises(ValueError)
+    def test_positions_duplicates(self):
+        index = utils.RowIndex(self.input_array, 'DS_ID')
+        index.positions(['B1', 'Ocean'])
+
 
 def test_Statistic():
     x = utils.Statistic('Cu', numpy.mean, 'MaxCu')
@@ -936,6 +1199,73 @@ class Test_rec_groupby(object):
         nptest.assert_array_equal(result, expected)
 
 
+class Test_sorted_groupby(object):
+    def setup(self):
+        self.data = numpy.array([
+            (u'050SC', u'A', 88.3, 0.25), (u'050SC', 'B', 0.0, 0.50),
+            (u'050SC', u'A', 98.3, 0.75), (u'050SC', 'B', 1.0, 1.00),
+            (u'045SC', u'A', 49.2, 0.04), (u'045SC', 'B', 0.0, 0.08),
+            (u'045SC', u'A', 69.2, 0.08), (u'045SC', 'B', 2.0, 0.16),
+        ], dtype=[('ID', '<U5'), ('DS_ID', '<U5'), ('Cu', '<f8'), ('Pb', '<f8'),])
+
+        self.stats = [
+            utils.Statistic('Cu', 'maximum', 'MaxCu'),
+            utils.Statistic('Pb', 'average', 'AvgPb'),
+        ]
+
+    def test_one_group_col(self):
+        expected = numpy.rec.fromrecords([
+            (u'045SC', 69.2, 0.090),
+            (u'050SC', 98.3, 0.625),
+        ], names=['ID', 'MaxCu', 'AvgPb'])
+
+        result = utils.sorted_groupby(self.data, 'ID', self.stats)
+        nptest.assert_array_equal(result['ID'], expected['ID'])
+        nptest.assert_array_almost_equal(result['MaxCu'], expected['MaxCu'])
+        nptest.assert_array_almost_equal(result['AvgPb'], expected['AvgPb'])
+
+    def test_two_group_col(self):
+        result = utils.sorted_groupby(self.data, ['ID', 'DS_ID'], self.stats)
+        nptest.assert_array_equal(result['ID'], [u'045SC', u'045SC', u'050SC', u'050SC'])
+        nptest.assert_array_equal(result['DS_ID'], [u'A', u'B', u'A', u'B'])
+        nptest.assert_array_almost_equal(result['MaxCu'], [69.2, 2.0, 98.3, 1.0])
+        nptest.assert_array_almost_equal(result['AvgPb'], [0.06, 0.12, 0.50, 0.75])
+
+    def test_order_statistics(self):
+        stats = [
+            utils.Statistic('Pb', 'first', 'FirPb'),
+            utils.Statistic('Pb', 'last', 'LasPb'),
+            utils.Statistic('Pb', 'median', 'MedPb'),
+            utils.Statistic('Pb', 'p25', 'P25Pb'),
+            utils.Statistic('Pb', 'count', 'CouPb'),
+        ]
+        result = utils.sorted_groupby(self.data, 'ID', stats)
+        for n, group in enumerate([u'045SC', u'050SC']):
+            pb = self.data['Pb'][self.data['ID'] == group]
+            nt.assert_equal(result['FirPb'][n], pb[0])
+            nt.assert_equal(result['LasPb'][n], pb[-1])
+            nt.assert_almost_equal(result['MedPb'][n], numpy.median(pb))
+            nt.assert_almost_equal(result['P25Pb'][n], numpy.percentile(pb, 25))
+            nt.assert_equal(result['CouPb'][n], 4)
+
+    def test_ignored_value(self):
+        stats = [utils.Statistic('Cu', 'average', 'AvgCu')]
+        data = self.data[self.data['DS_ID'] == 'B']
+        data['Cu'][data['ID'] == u'050SC'] = 0.
+        result = utils.sorted_groupby(data, 'ID', stats, ignored_value=0)
+        nptest.assert_array_equal(result['AvgCu'], [2.0, 0.0])
+
+    @nt.raises(ValueError)
+    def test_bad_method(self):
+        stats = [utils.Statistic('Cu', 'junk', 'JunkCu')]
+        utils.sorted_groupby(self.data, 'ID', stats)
+
+    def test_rec_groupby_dispatch(self):
+        result = utils.rec_groupby(self.data, 'ID', *self.stats)
+        expected = utils.sorted_groupby(self.data, 'ID', self.stats)
+        nptest.assert_array_equal(result, expected)
+
+
 class Test_stats_with_ignored_values(object):
     def setup(self):
         self.x1 = [1., 2., 3., 4., 5.]
@@ -992,6 +1322,62 @@ class Test_stats_with_ignored_values(object):
         nt.assert_equal(result, expected)
 
 
+class Test_grouped_stats_with_ignored_values(object):
+    def setup(self):
+        # the groups are x1, x2, and x3 from Test_stats_with_ignored_values
+        self.values = numpy.array([
+            1., 2., 3., 4., 5.,
+            5., 5., 5., 5., 5.,
+            1., 1., 1., 1., 5.,
+        ])
+        self.codes = numpy.array([0] * 5 + [1] * 5 + [2] * 5)
+
+    def check(self, expected, **kwargs):
+        result = utils.grouped_stats_with_ignored_values(
+            self.values, self.codes, 'average', **kwargs
+        )
+        nptest.assert_array_almost_equal(result, expected)
+
+        # must be the same as looping through the groups
+        for n, group_result in enumerate(result):
+            values = self.values[self.codes == n]
+            single = utils.stats_with_ignored_values(values, numpy.mean, **kwargs)
+            nt.assert_almost_equal(group_result, single)
+
+    def test_defaults(self):
+        self.check([3., 5., 1.8])
+
+    def test_with_ignore(self):
+        self.check([2.5, 5., 1.], ignored_value=5)
+
+    def test_with_terminator(self):
+        self.check([3.5, 5., 5.], terminator_value=1)
+
+    def test_ignored_and_terminated(self):
+        self.check([2., 5., 1.], ignored_value=4., terminator_value=5.)
+
+    def test_everything_ignored_or_terminated(self):
+        self.check([3., 5., 5.], ignored_value=1., terminator_value=5.)
+
+    def test_unsorted_codes(self):
+        order = numpy.array([14, 3, 7, 0, 11, 1, 9, 13, 2, 5, 12, 4, 6, 10, 8])
+        result = utils.grouped_stats_with_ignored_values(
+            self.values[order], self.codes[order], 'maximum', ignored_value=5
+        )
+        nptest.assert_array_equal(result, [4., 5., 1.])
+
+    def test_empty_groups(self):
+        result = utils.grouped_stats_with_ignored_values(
+            self.values, self.codes, 'sum', ignored_value=0, n_groups=4
+        )
+        nptest.assert_array_equal(result, [15., 25., 9., 0.])
+
+    @nt.raises(ValueError)
+    def test_ignored_equals_terminator(self):
+        utils.grouped_stats_with_ignored_values(self.values, self.codes, 'sum',
+                                                ignored_value=1, terminator_value=1)
+
+
 def test_weighted_average():
     raw_data = numpy.array(
         [
@@ -12,23 +12,48 @@ Written by Paul Hobson (phobson@geosyntec.com)
 """
 
 
-from functools import partial
+import os
 from textwrap import dedent
+from collections import OrderedDict
 
 import numpy
 
-import arcpy
+try:
+    import arcpy
+except ImportError:  # pragma: no cover
+    arcpy = None
 
 from propagator import analysis
 from propagator import validate
 from propagator import utils
 from propagator import base_tbx
+from propagator import topology
+from propagator import cache
 
 
+def _normalized_value_columns(value_columns):
+    """ ``value_columns`` with lower-case aggregation methods, so that
+    equivalent calls share their cache keys. """
+
+    normalized = []
+    for vc in validate.value_column_stats(value_columns, None):
+        vc = list(vc)
+        if vc[1] is not None:
+            vc[1] = vc[1].lower()
+        normalized.append(vc)
+    return normalized
+
+
+@cache.cached(
+    inputs=('subcatchments', 'monitoring_locations', 'streams'),
+    ignore=('n_workers', 'persist', 'verbose', 'asMessage'),
+    normalizers={'value_columns': _normalized_value_columns},
+)
 def propagate(subcatchments=None, id_col=None, ds_col=None,
               monitoring_locations=None, ml_filter=None,
               ml_filter_cols=None, value_columns=None, streams=None,
-              output_path=None, verbose=False, asMessage=False):
+              output_path=None, n_workers=1, persist=True, verbose=False,
+              asMessage=False):
     """
     Propagate water quality scores upstream from the subcatchments of
     a watershed.
@@ -60,6 +85,19 @@ def propagate(subcatchments=None, id_col=None, ds_col=None,
     output_path : str
         Path to where the the new subcatchments feature class with the
         propagated water quality scores should be saved.
+    n_workers : int, optional (1)
+        Number of workers used to locate the monitoring locations
+        within the subcatchments and to split the streams (threads),
+        and among which the independent drainage basins are split when
+        propagating the scores (processes).
+    persist : bool, optional (True)
+        Toggles saving the spatial indexes and spatial joins of
+        shapefile inputs next to them, so that later calls can reuse
+        them.
+    cache : propagator.cache.ResultCache, optional
+        When provided, the outputs of a previous call with the same
+        inputs and parameters are restored from ``cache`` instead of
+        being recomputed.
 
     Returns
     -------
@@ -104,32 +142,39 @@ def propagate(subcatchments=None, id_col=None, ds_col=None,
         id_col=id_col,
         ds_col=ds_col,
         output_path=subcatchment_output,
+        n_workers=n_workers,
+        persist=persist,
         verbose=verbose,
         asMessage=asMessage,
         msg="Aggregating water quality data in subcatchments"
     )
 
+    # the drainage network is compiled once and shared by every step
+    graph = topology.WatershedGraph(wq, id_col=id_col, ds_col=ds_col)
+
     wq = analysis.mark_edges(
         wq,
         id_col=id_col,
         ds_col=ds_col,
         edge_ID='EDGE',
+        graph=graph,
         verbose=verbose,
         asMessage=asMessage,
         msg="Marking all subcatchments that flow out of the watershed"
     )
 
-    for n, res_col in enumerate(result_columns, 1):
-        wq = analysis.propagate_scores(
-            subcatchment_array=wq,
-            id_col=id_col,
-            ds_col=ds_col,
-            value_column=res_col,
-            edge_ID='EDGE',
-            verbose=verbose,
-            asMessage=asMessage,
-            msg="{} of {}: Propagating {} scores".format(n, len(result_columns), res_col)
-        )
+    wq = analysis.propagate_scores(
+        subcatchment_array=wq,
+        id_col=id_col,
+        ds_col=ds_col,
+        value_column=result_columns,
+        edge_ID='EDGE',
+        graph=graph,
+        n_workers=n_workers,
+        verbose=verbose,
+        asMessage=asMessage,
+        msg="Propagating {} scores".format(", ".join(result_columns))
+    )
 
     utils.update_attribute_table(subcatchment_output, wq, id_col, result_columns)
 
@@ -141,6 +186,8 @@ def propagate(subcatchments=None, id_col=None, ds_col=None,
         other_cols=result_columns,
         agg_method='first',
         output_layer=stream_output,
+        n_workers=n_workers,
+        persist=persist,
         verbose=verbose,
         asMessage=asMessage,
         msg='Aggregating and associating scores with streams.',
@@ -149,10 +196,387 @@ def propagate(subcatchments=None, id_col=None, ds_col=None,
     return subcatchment_output, stream_output
 
 
+def _shapefile_field_names(columns, taken=()):
+    """ Unique names of at most 10 characters for ``columns``. Like
+    arcpy, the ends of names that collide after truncation are replaced
+    with a counter. """
+
+    taken = set(taken)
+    names = []
+    for col in columns:
+        name = col[:10]
+        n = 0
+        while name in taken:
+            n += 1
+            suffix = '_{}'.format(n)
+            name = col[:10 - len(suffix)] + suffix
+        taken.add(name)
+        names.append(name)
+    return names
+
+
+def propagate_scenarios(subcatchments=None, id_col=None, ds_col=None,
+                        monitoring_locations=None, scenarios=None,
+                        streams=None, output_path=None, combine=False,
+                        n_workers=1, persist=True, verbose=False,
+                        asMessage=False):
+    """
+    Propagate water quality scores upstream for several scenarios,
+    sharing the expensive steps among all of them.
+
+    The monitoring locations are joined to the subcatchments, and the
+    streams are split by the subcatchments, only once. Each scenario is
+    then aggregated and propagated in memory.
+
+    Parameters
+    ----------
+    subcatchments : str
+        Path to the feature class containing the subcatchments.
+        Attribute table must contain fields for the subcatchment ID
+        and the ID of the downstream subcatchment.
+    id_col, ds_col : str
+        Names of the fields in the ``subcatchments`` feature class that
+        specifies the subcatchment ID and the ID of the downstream
+        subcatchment, respectively.
+    monitoring_locations : str
+        Path to the feature class containing the monitoring locations
+        and water quality scores.
+    scenarios : list of analysis.Scenario or dict
+        The monitoring location filters and value columns of each
+        scenario. Dictionaries are passed to
+        :class:`propagator.analysis.Scenario` as keyword arguments.
+    streams : str
+        Path to the feature class containing the streams.
+    output_path : str
+        Path from which the names of the new subcatchments and streams
+        feature classes are derived.
+    combine : bool, optional (False)
+        When False, each scenario is saved in its own pair of feature
+        classes named after ``output_path`` and the scenario. When
+        True, all of the scenarios are saved as extra columns of a
+        single pair, named after the columns and the scenario (see
+        :meth:`propagator.analysis.Scenario.column`). Names that are
+        too long for a shapefile are truncated to 10 characters and
+        made unique.
+    n_workers : int, optional (1)
+        Number of workers used to locate the monitoring locations
+        within the subcatchments and to split the streams (threads),
+        and among which the independent drainage basins are split when
+        propagating the scores (processes).
+    persist : bool, optional (True)
+        Toggles saving the spatial indexes and spatial joins of
+        shapefile inputs next to them, so that later calls can reuse
+        them.
+
+    Returns
+    -------
+    outputs : OrderedDict
+        Maps the name of each scenario to a three-tuple: the
+        subcatchments and streams feature classes that hold its
+        results, and an OrderedDict mapping each of its result columns
+        (e.g., ``'aveDry_B'``) to the field in which it was saved.
+
+    Examples
+    --------
+    >>> import propagator
+    >>> from propagator import utils
+    >>> with utils.WorkSpace('C:/gis/SOC.gdb'):
+    ...     propagator.propagate_scenarios(
+    ...         subcatchments='subbasins',
+    ...         id_col='Catch_ID',
+    ...         ds_col='DS_ID',
+    ...         monitoring_locations='wq_data',
+    ...         scenarios=[
+    ...             dict(name='all', value_columns=['Dry_Metals', 'Wet_Metals']),
+    ...             dict(name='inland', value_columns=['Dry_Metals', 'Wet_Metals'],
+    ...                  ml_filter=lambda row: row['StationType'] != 'Coastal',
+    ...                  ml_filter_cols=['StationType']),
+    ...         ],
+    ...         streams='SOC_streams',
+    ...         output_path='propagated_metals'
+    ...     )
+
+    See also
+    --------
+    propagate
+    propagator.analysis.preprocess_wq_scenarios
+
+    """
+
+    wq, columns = analysis.preprocess_wq_scenarios(
+        monitoring_locations=monitoring_locations,
+        subcatchments=subcatchments,
+        id_col=id_col,
+        ds_col=ds_col,
+        scenarios=scenarios,
+        n_workers=n_workers,
+        persist=persist,
+        verbose=verbose,
+        asMessage=asMessage,
+        msg="Aggregating water quality data in subcatchments"
+    )
+
+    wq_columns = [col for _, cols in columns.values() for col in cols]
+
+    graph = topology.WatershedGraph(wq, id_col=id_col, ds_col=ds_col)
+
+    wq = analysis.mark_edges(
+        wq,
+        id_col=id_col,
+        ds_col=ds_col,
+        edge_ID='EDGE',
+        graph=graph,
+        verbose=verbose,
+        asMessage=asMessage,
+        msg="Marking all subcatchments that flow out of the watershed"
+    )
+
+    # every scenario is propagated in the same pass
+    wq = analysis.propagate_scores(
+        subcatchment_array=wq,
+        id_col=id_col,
+        ds_col=ds_col,
+        value_column=wq_columns,
+        edge_ID='EDGE',
+        graph=graph,
+        n_workers=n_workers,
+        verbose=verbose,
+        asMessage=asMessage,
+        msg="Propagating scores of {} scenarios".format(len(columns))
+    )
+
+    split_streams = analysis.aggregate_streams_by_subcatchment(
+        stream_layer=streams,
+        subcatchment_layer=subcatchments,
+        id_col=id_col,
+        ds_col=ds_col,
+        other_cols=[],
+        output_layer=utils.create_temp_filename(output_path, filetype='memory'),
+        n_workers=n_workers,
+        persist=persist,
+        verbose=verbose,
+        asMessage=asMessage,
+        msg='Splitting streams by subcatchment.',
+    )
+
+    # (subcatchment output, stream output, fields, columns of `wq`)
+    if combine:
+        fields = wq_columns
+        if os.path.splitext(output_path)[1].lower() == '.shp':
+            taken = utils.get_field_names(subcatchments) + utils.get_field_names(split_streams)
+            fields = _shapefile_field_names(wq_columns, taken=taken)
+
+        layers = [(
+            utils.add_suffix_to_filename(output_path, 'subcatchments'),
+            utils.add_suffix_to_filename(output_path, 'streams'),
+            fields, wq_columns,
+        )]
+    else:
+        layers = []
+        for name, (res_columns, cols) in columns.items():
+            prefix = utils.add_suffix_to_filename(output_path, name)
+            layers.append((
+                utils.add_suffix_to_filename(prefix, 'subcatchments'),
+                utils.add_suffix_to_filename(prefix, 'streams'),
+                res_columns, cols,
+            ))
+
+    for subcatchment_output, stream_output, fields, cols in layers:
+        utils.copy_layer(subcatchments, subcatchment_output)
+        utils.copy_layer(split_streams, stream_output)
+        for layer in (subcatchment_output, stream_output):
+            for field in fields:
+                utils.add_field_with_value(layer, field, field_type='DOUBLE',
+                                           overwrite=True)
+            utils.update_attribute_table(layer, wq, id_col, fields, cols)
+
+    utils.cleanup_temp_results(split_streams)
+
+    outputs = OrderedDict()
+    for n, (name, (res_columns, cols)) in enumerate(columns.items()):
+        subcatchment_output, stream_output, fields, layer_cols = layers[0 if combine else n]
+        saved_as = dict(zip(layer_cols, fields))
+        outputs[name] = (
+            subcatchment_output,
+            stream_output,
+            OrderedDict((rescol, saved_as[col]) for rescol, col in zip(res_columns, cols)),
+        )
+    return outputs
+
+
+def update_propagation(subcatchments=None, id_col=None, ds_col=None,
+                       monitoring_locations=None, ml_id_col=None,
+                       changed_ids=None, value_columns=None, ml_filter=None,
+                       ml_filter_cols=None, subcatchment_ids=None,
+                       streams=None, stream_columns=None, n_workers=1,
+                       persist=True, verbose=False, asMessage=False):
+    """
+    Update the output of :func:`propagate` in place after some of the
+    monitoring locations have changed.
+
+    Only the subcatchments containing the changed monitoring locations
+    and those upstream of them are recomputed and rewritten.
+
+    Parameters
+    ----------
+    subcatchments : str
+        The subcatchments output of a previous call to
+        :func:`propagate`. Its features are also used to locate the
+        monitoring locations.
+    id_col, ds_col : str
+        Names of the fields in the ``subcatchments`` feature class that
+        specifies the subcatchment ID and the ID of the downstream
+        subcatchment, respectively.
+    monitoring_locations : str
+        Path to the feature class containing the monitoring locations
+        and their current water quality scores.
+    ml_id_col : str
+        Name of the field in ``monitoring_locations`` that identifies
+        each monitoring location.
+    changed_ids : list
+        The IDs of the monitoring locations that were added or whose
+        scores have changed.
+    value_columns, ml_filter, ml_filter_cols
+        The same as were given to :func:`propagate`.
+    subcatchment_ids : list, optional
+        IDs of any other subcatchments to recompute, such as those that
+        contained monitoring locations that have since been removed.
+    streams : str, optional
+        The streams output of the same call to :func:`propagate`, to be
+        updated as well.
+    stream_columns : list of str, optional
+        The names of the fields in ``streams`` that hold each of the
+        result columns (e.g., ``'FIRST_aveD'`` for ``'aveDry_B'``), in
+        the same order. Defaults to the names of the result columns.
+    n_workers : int, optional (1)
+        Number of threads used to locate the monitoring locations
+        within the subcatchments.
+    persist : bool, optional (True)
+        Toggles saving the spatial indexes and spatial joins of
+        shapefile inputs next to them, so that later calls can reuse
+        them.
+
+    Returns
+    -------
+    subcatchments, streams : str
+        The updated feature classes.
+
+    Examples
+    --------
+    >>> import propagator
+    >>> from propagator import utils
+    >>> with utils.WorkSpace('C:/gis/SOC.gdb'):
+    ...     propagator.update_propagation(
+    ...         subcatchments='propagated_metals_subcatchments',
+    ...         id_col='Catch_ID',
+    ...         ds_col='DS_ID',
+    ...         monitoring_locations='wq_data',
+    ...         ml_id_col='Station',
+    ...         changed_ids=['SJC01', 'SJC07'],
+    ...         value_columns=['Dry_Metals', 'Wet_Metals', 'Wet_TSS'],
+    ...     )
+
+    See also
+    --------
+    propagate
+    propagator.analysis.preprocess_wq_changes
+    propagator.analysis.repropagate_scores
+
+    """
+
+    scores, result_columns, changed = analysis.preprocess_wq_changes(
+        monitoring_locations=monitoring_locations,
+        subcatchments=subcatchments,
+        id_col=id_col,
+        ds_col=ds_col,
+        ml_id_col=ml_id_col,
+        changed_ids=changed_ids,
+        value_columns=value_columns,
+        ml_filter=ml_filter,
+        ml_filter_cols=ml_filter_cols,
+        n_workers=n_workers,
+        persist=persist,
+        verbose=verbose,
+        asMessage=asMessage,
+        msg="Aggregating water quality data in subcatchments"
+    )
+
+    changed = changed.tolist()
+    if subcatchment_ids is not None:
+        changed.extend(subcatchment_ids)
+
+    propagated = utils.load_attribute_table(subcatchments, id_col, ds_col, *result_columns)
+    updated, rows = analysis.repropagate_scores(
+        propagated_array=propagated,
+        scores_array=scores,
+        id_col=id_col,
+        ds_col=ds_col,
+        value_column=result_columns,
+        changed=changed,
+        verbose=verbose,
+        asMessage=asMessage,
+        msg="Propagating {} scores in affected subcatchments".format(", ".join(result_columns))
+    )
+
+    # only the recomputed rows are written back
+    patch = updated[rows]
+    utils.update_attribute_table(subcatchments, patch, id_col, result_columns)
+    if streams is not None:
+        if stream_columns is None:
+            stream_columns = result_columns
+        utils.update_attribute_table(streams, patch, id_col, stream_columns, result_columns)
+
+    return subcatchments, streams
+
+
+def _accumulation_stats(value_columns, default_aggfxn):
+    """ The statistics computed by :func:`accumulate` and the fields
+    of the subcatchments that they need. """
+
+    # Separate value columns into field name and aggregation method
+    value_columns = validate.value_column_stats(value_columns, default_aggfxn)
+    value_columns_aggmethods = [i[1] for i in value_columns]
+    vc_field_wfactor = []
+    for col, aggmethod, wfactor in value_columns:
+        if aggmethod.lower() == 'weighted_average':
+            vc_field_wfactor.append([col, wfactor])
+        else:
+            vc_field_wfactor.append(col)
+
+    # define the Statistic objects that will be passed to
+    # `accumulate_upstream`, which expects the names of the methods
+    aggmethods = [agg.lower() for agg in value_columns_aggmethods]
+    res_columns = [
+        '{}{}'.format(prefix[:3].upper(), col)
+        for col, prefix, _ in value_columns
+    ]
+    stats = [
+        utils.Statistic(srccol, aggmethod, rescol)
+        for srccol, aggmethod, rescol in zip(vc_field_wfactor, aggmethods, res_columns)
+    ]
+
+    # create a unique list of columns we need
+    # from the subcatchment layer
+    target_fields = []
+    for s in stats:
+        if numpy.isscalar(s.srccol):
+            target_fields.append(s.srccol)
+        else:
+            target_fields.extend(s.srccol)
+    target_fields = numpy.unique(target_fields)
+    return stats, target_fields
+
+
+@cache.cached(
+    inputs=('subcatchments_layer', 'streams_layer'),
+    ignore=('n_workers', 'persist', 'verbose', 'asMessage'),
+    normalizers={'value_columns': _normalized_value_columns},
+)
 def accumulate(subcatchments_layer=None, id_col=None, ds_col=None,
                value_columns=None, streams_layer=None,
                output_layer=None, default_aggfxn='sum',
-               ignored_value=None, verbose=False, asMessage=False):
+               ignored_value=None, n_workers=1, persist=True, verbose=False,
+               asMessage=False):
     """
     Accumulate upstream subcatchment properties in each stream segment.
 
@@ -182,6 +606,18 @@ def accumulate(subcatchments_layer=None, id_col=None, ds_col=None,
         on-the-fly if not provided.
     output_layer : str, optional
         Names of the new layer where the results should be saved.
+    n_workers : int, optional (1)
+        Number of workers used to split the streams (threads), and
+        among which the independent drainage basins are split when
+        accumulating the properties (processes).
+    persist : bool, optional (True)
+        Toggles saving the spatial indexes and spatial joins of
+        shapefile inputs next to them, so that later calls can reuse
+        them.
+    cache : propagator.cache.ResultCache, optional
+        When provided, the output of a previous call with the same
+        inputs and parameters is restored from ``cache`` instead of
+        being recomputed.
 
     Returns
     -------
@@ -192,48 +628,11 @@ def accumulate(subcatchments_layer=None, id_col=None, ds_col=None,
     See also
     --------
     propagator.analysis.aggregate_streams_by_subcatchment
-    propagator.analysis.collect_upstream_attributes
-    propagator.utils.rec_groupby
+    propagator.analysis.accumulate_upstream
 
     """
 
-    # Separate value columns into field name and aggregation method
-    value_columns = validate.value_column_stats(value_columns, default_aggfxn)
-    value_columns_aggmethods = [i[1] for i in value_columns]
-    vc_field_wfactor = []
-    for col, aggmethod, wfactor in value_columns:
-        if aggmethod.lower() == 'weighted_average':
-            vc_field_wfactor.append([col, wfactor])
-        else:
-            vc_field_wfactor.append(col)
-
-    # define the Statistic objects that will be passed to `rec_groupby`
-    statfxns = []
-    for agg in value_columns_aggmethods:
-        statfxns.append(partial(
-            utils.stats_with_ignored_values,
-            statfxn=analysis.AGG_METHOD_DICT[agg.lower()],
-            ignored_value=ignored_value
-        ))
-
-    res_columns = [
-        '{}{}'.format(prefix[:3].upper(), col)
-        for col, prefix, _ in value_columns
-    ]
-    stats = [
-        utils.Statistic(srccol, statfxn, rescol)
-        for srccol, statfxn, rescol in zip(vc_field_wfactor, statfxns, res_columns)
-    ]
-
-    # create a unique list of columns we need
-    # from the subcatchment layer
-    target_fields = []
-    for s in stats:
-        if numpy.isscalar(s.srccol):
-            target_fields.append(s.srccol)
-        else:
-            target_fields.extend(s.srccol)
-    target_fields = numpy.unique(target_fields)
+    stats, target_fields = _accumulation_stats(value_columns, default_aggfxn)
 
     # split the stream at the subcatchment boundaries and then
     # aggregate all of the stream w/i each subcatchment
@@ -246,6 +645,8 @@ def accumulate(subcatchments_layer=None, id_col=None, ds_col=None,
         other_cols=target_fields,
         output_layer=output_layer,
         agg_method="first",  # first works b/c all values are equal
+        n_workers=n_workers,
+        persist=persist,
     )
 
     # Add target_field columns back to spilt_stream_layer.
@@ -268,14 +669,18 @@ def accumulate(subcatchments_layer=None, id_col=None, ds_col=None,
         subcatchments_layer, id_col, ds_col, *target_fields
     )
 
-    upstream_attributes = analysis.collect_upstream_attributes(
+    aggregated_properties = analysis.accumulate_upstream(
         subcatchments_table=subcatchments_table,
         target_subcatchments=split_streams_table,
         id_col=id_col,
         ds_col=ds_col,
-        preserved_fields=target_fields
+        stats=stats,
+        ignored_value=ignored_value,
+        n_workers=n_workers,
+        verbose=verbose,
+        asMessage=asMessage,
+        msg="Accumulating upstream properties"
     )
-    aggregated_properties = utils.rec_groupby(upstream_attributes, id_col, *stats)
 
     # Update output layer with aggregated values.
     utils.update_attribute_table(
@@ -289,13 +694,149 @@ def accumulate(subcatchments_layer=None, id_col=None, ds_col=None,
     required_columns = [id_col, ds_col, 'FID', 'Shape', 'Shape_Length', 'Shape_Area', 'OBJECTID']
     fields_to_remove = filter(
         lambda name: name not in required_columns and name not in final_fields,
-        [f.name for f in arcpy.ListFields(split_streams_layer)]
+        utils.get_field_names(split_streams_layer)
     )
     utils.delete_columns(split_streams_layer, *fields_to_remove)
 
     return split_streams_layer
 
 
+def load_accumulator(subcatchments_layer=None, id_col=None, ds_col=None,
+                     value_columns=None, default_aggfxn='sum',
+                     ignored_value=None):
+    """
+    Loads the subcatchments and accumulates their properties in memory,
+    so that :func:`update_accumulation` can apply rounds of edits
+    without reading and folding the whole table again.
+
+    Parameters
+    ----------
+    subcatchments_layer : str
+        Name of the feature class containing the subcatchments.
+    id_col, ds_col : str
+        Names of the fields in ``subcatchment_layer`` that contain the
+        subcatchment ID and downstream subcatchment ID, respectively.
+    value_columns, default_aggfxn, ignored_value
+        The same as are given to :func:`accumulate`.
+
+    Returns
+    -------
+    accumulator : propagator.analysis.UpstreamAccumulator
+
+    See also
+    --------
+    update_accumulation
+
+    """
+
+    stats, target_fields = _accumulation_stats(value_columns, default_aggfxn)
+    subcatchments_table = utils.load_attribute_table(
+        subcatchments_layer, id_col, ds_col, *target_fields
+    )
+    return analysis.UpstreamAccumulator(
+        subcatchments_table, id_col, ds_col, stats,
+        ignored_value=ignored_value
+    )
+
+
+def update_accumulation(subcatchments_layer=None, id_col=None, ds_col=None,
+                        value_columns=None, output_layer=None, edits=None,
+                        default_aggfxn='sum', ignored_value=None,
+                        accumulator=None, verbose=False, asMessage=False):
+    """
+    Update the output of :func:`accumulate` in place after the
+    attributes of some subcatchments have been edited.
+
+    An edit can only change the accumulated values on the path from
+    the edited subcatchment to its outlet, so only the stream records
+    on those paths are recomputed and rewritten.
+
+    Parameters
+    ----------
+    subcatchments_layer : str
+        Name of the feature class containing the subcatchments. The
+        edits are saved to it as well.
+    id_col, ds_col : str
+        Names of the fields in ``subcatchment_layer`` that contain the
+        subcatchment ID and downstream subcatchment ID, respectively.
+    value_columns, default_aggfxn, ignored_value
+        The same as were given to :func:`accumulate`. Not used when
+        ``accumulator`` is provided.
+    output_layer : str
+        The output of a previous call to :func:`accumulate`.
+    edits : numpy.recarray
+        The new attribute values, with an ``id_col`` field and any of
+        the fields being accumulated.
+    accumulator : propagator.analysis.UpstreamAccumulator, optional
+        The accumulated properties of ``subcatchments_layer`` (see
+        :func:`load_accumulator`), which are updated with ``edits``.
+        Pass the same accumulator to every call so that each round of
+        edits only visits the affected subcatchments. If not
+        provided, one is loaded from ``subcatchments_layer``.
+
+    Returns
+    -------
+    output_layer : str
+        The updated feature class.
+
+    Examples
+    --------
+    >>> import propagator
+    >>> from propagator import utils
+    >>> with utils.WorkSpace('C:/gis/SOC.gdb'):
+    ...     acc = propagator.load_accumulator(
+    ...         subcatchments_layer='subbasins',
+    ...         id_col='Catch_ID',
+    ...         ds_col='DS_ID',
+    ...         value_columns=[('Imp', 'weighted_average', 'Area')],
+    ...     )
+    ...     for edits in what_if_edits:
+    ...         propagator.update_accumulation(
+    ...             subcatchments_layer='subbasins',
+    ...             id_col='Catch_ID',
+    ...             ds_col='DS_ID',
+    ...             output_layer='accumulated_streams',
+    ...             edits=edits,
+    ...             accumulator=acc,
+    ...         )
+
+    See also
+    --------
+    accumulate
+    load_accumulator
+    propagator.analysis.UpstreamAccumulator
+
+    """
+
+    if accumulator is None:
+        accumulator = load_accumulator(
+            subcatchments_layer=subcatchments_layer,
+            id_col=id_col,
+            ds_col=ds_col,
+            value_columns=value_columns,
+            default_aggfxn=default_aggfxn,
+            ignored_value=ignored_value,
+        )
+    elif (accumulator.id_col, accumulator.ds_col) != (id_col, ds_col):
+        raise ValueError("`accumulator` was not built with the same ID columns")
+
+    final_fields = [s.rescol for s in accumulator.stats]
+    changed = accumulator.update(edits)
+
+    edited_fields = [name for name in edits.dtype.names if name != id_col]
+    utils.update_attribute_table(subcatchments_layer, edits, id_col, edited_fields)
+
+    # only the records on the changed paths are written back
+    utils.update_attribute_table(
+        layerpath=output_layer,
+        attribute_array=accumulator.results(changed),
+        id_column=id_col,
+        orig_columns=final_fields,
+    )
+
+    return output_layer
+
+
 class Propagator(base_tbx.BaseToolbox_Mixin):
     """
     ArcGIS Python toolbox to propagate water quality metrics upstream
@@ -455,6 +996,8 @@ class Propagator(base_tbx.BaseToolbox_Mixin):
         ws = params.pop('workspace', '.')
         overwrite = params.pop('overwrite', True)
         add_output_to_map = params.pop('add_output_to_map', False)
+        persist = params.pop('persist', True)
+        n_workers = params.pop('n_workers', 1)
         output_layer = params.pop('output_layer', None)
 
         # subcatchment info
@@ -495,6 +1038,8 @@ class Propagator(base_tbx.BaseToolbox_Mixin):
                 value_columns=value_columns,
                 output_path=output_layer,
                 streams=streams,
+                n_workers=n_workers,
+                persist=persist,
                 verbose=True,
                 asMessage=True,
             )
@@ -612,6 +1157,8 @@ class Accumulator(base_tbx.BaseToolbox_Mixin):
         ws = params.pop('workspace', '.')
         overwrite = params.pop('overwrite', True)
         add_output_to_map = params.pop('add_output_to_map', False)
+        persist = params.pop('persist', True)
+        n_workers = params.pop('n_workers', 1)
 
         # input parameters
         sc = params.pop('subcatchments', None)
@@ -632,6 +1179,8 @@ class Accumulator(base_tbx.BaseToolbox_Mixin):
                 value_columns=value_columns,
                 streams_layer=streams,
                 output_layer=output_layer,
+                n_workers=n_workers,
+                persist=persist,
                 verbose=True,
                 asMessage=True,
             )
@@ -17,7 +17,10 @@ Written by Paul Hobson (phobson@geosyntec.com)
 
 
 import os
+import heapq
+import shutil
 import itertools
+import tempfile
 from functools import wraps
 from contextlib import contextmanager
 from collections import namedtuple
@@ -26,21 +29,35 @@ import warnings
 
 import numpy
 
-import arcpy
+try:
+    import arcpy
+except ImportError:  # pragma: no cover
+    arcpy = None
 
 from propagator import validate
+from propagator import backends
 import pdb
 
 
 # basic named tuple for recarray aggregation
 Statistic = namedtuple("Statistic", ("srccol", "aggfxn", "rescol"))
 
+# toggles writing the intermediate results that would be held in memory
+# (see `create_temp_filename`) to disk and keeping them, for debugging
+PERSIST_TEMP_RESULTS = bool(os.environ.get('PROPAGATOR_PERSIST_TEMP'))
+
+# aggregation methods that `sorted_groupby` computes without calling a
+# python function for each group.
+SORTED_GROUPBY_METHODS = ('sum', 'average', 'minimum', 'maximum', 'count',
+                          'first', 'last', 'median', 'p10', 'p25', 'p50',
+                          'p75', 'p90')
+
 
 def _status(msg, verbose=False, asMessage=False, addTab=False):  # pragma: no cover
     if verbose:
         if addTab:
             msg = '\t' + msg
-        if asMessage:
+        if asMessage and arcpy is not None:
             arcpy.AddMessage(msg)
         else:
             print(msg)
@@ -325,10 +342,11 @@ def OverwriteState(state):
     """ Context manager to temporarily set the ``overwriteOutput``
     environment variable.
 
-    Inside the context manager, the ``arcpy.env.overwriteOutput`` will
+    Inside the context manager, the ``overwriteOutput`` setting of the
+    current backend (``arcpy.env.overwriteOutput`` with ``arcpy``) will
     be set to the given value. Once the interpreter leaves the code
     block by any means (e.g., successful execution, raised exception),
-    ``arcpy.env.overwriteOutput`` will reset to its original value.
+    it will reset to its original value.
 
     Parameters
     ----------
@@ -343,10 +361,11 @@ def OverwriteState(state):
 
     """
 
-    orig_state = arcpy.env.overwriteOutput
-    arcpy.env.overwriteOutput = bool(state)
+    env = backends.get_backend().env
+    orig_state = env.overwriteOutput
+    env.overwriteOutput = bool(state)
     yield state
-    arcpy.env.overwriteOutput = orig_state
+    env.overwriteOutput = orig_state
 
 
 @contextmanager
@@ -374,10 +393,11 @@ def WorkSpace(path):
 
     """
 
-    orig_workspace = arcpy.env.workspace
-    arcpy.env.workspace = path
+    env = backends.get_backend().env
+    orig_workspace = env.workspace
+    env.workspace = path
     yield path
-    arcpy.env.workspace = orig_workspace
+    env.workspace = orig_workspace
 
 
 def create_temp_filename(filepath, filetype=None, prefix='_temp_', num=None):
@@ -389,8 +409,11 @@ def create_temp_filename(filepath, filetype=None, prefix='_temp_', num=None):
     filepath : str
         The file path/name of what the final output will eventually be.
     filetype : str, optional
-        The type of file to be created. Valid values: "Raster" or
-        "Shape".
+        The type of file to be created. Valid values: "Raster",
+        "Shape", or "Memory". "Memory" layers are held in memory by
+        the backend (see :class:`propagator.backends.MemoryWorkspace`)
+        unless ``PERSIST_TEMP_RESULTS`` is True, in which case they
+        are shapefiles (or feature classes) like "Shape" layers.
     prefix : str, optional ('_temp_')
         The prefix that will be applied to ``filepath``.
     num : int, optional
@@ -416,6 +439,9 @@ def create_temp_filename(filepath, filetype=None, prefix='_temp_', num=None):
     >>> utils.create_temp_filename('path.gdb/DEM', filetype='raster')
     path.gbd/_temp_DEM
 
+    >>> utils.create_temp_filename('path/to/streams.shp', filetype='memory')
+    memory:_temp_streams
+
     """
 
     file_extensions = {
@@ -428,7 +454,16 @@ def create_temp_filename(filepath, filetype=None, prefix='_temp_', num=None):
     else:
         num = '_{}'.format(num)
 
-    ws = arcpy.env.workspace or '.'
+    if backends.is_memory(filepath):
+        filepath = filepath[len(backends.MEMORY_PREFIX):]
+
+    if filetype is not None and filetype.lower() == 'memory':
+        if not PERSIST_TEMP_RESULTS:
+            filename, _ = os.path.splitext(os.path.basename(filepath))
+            return backends.MEMORY_PREFIX + prefix + filename + num
+        filetype = 'shape'
+
+    ws = backends.get_backend().env.workspace or '.'
     filename, _ = os.path.splitext(os.path.basename(filepath))
     folder = os.path.dirname(filepath)
     if folder != '':
@@ -651,21 +686,17 @@ def add_field_with_value(table, field_name, field_value=None,
     if field_value is None and field_type is None:
         raise ValueError("must provide a `field_type` if not providing a value.")
 
-    # see http://goo.gl/66QD8c
-    arcpy.management.AddField(
-        in_table=table,
-        field_name=field_name,
-        field_type=field_type,
-        **field_opts
-    )
+    backends.get_backend().add_field(table, field_name, field_type, **field_opts)
+    SCHEMA_CACHE.invalidate(table)
 
     # set the value in all rows
     if field_value is not None:
-        populate_field(table, lambda row: field_value, field_name)
+        populate_field(table, field_value, field_name)
 
 
 def cleanup_temp_results(*results):
-    """ Deletes temporary results from the current workspace.
+    """ Deletes temporary results from the current workspace or from
+    memory. Nothing is deleted when ``PERSIST_TEMP_RESULTS`` is True.
 
     Relies on `arcpy.management.Delete`_.
 
@@ -682,9 +713,14 @@ def cleanup_temp_results(*results):
 
     """
 
+    if PERSIST_TEMP_RESULTS:
+        return
+
     for r in results:
         if isinstance(r, basestring):
             path = r
+        elif arcpy is None:
+            raise ValueError("Input must be paths")
         elif isinstance(r, arcpy.Result):
             path = r.getOutput(0)
         elif isinstance(r, arcpy.mapping.Layer):
@@ -697,8 +733,13 @@ def cleanup_temp_results(*results):
         else:
             raise ValueError("Input must be paths, Results, Rasters, or Layers")
 
-        fullpath = os.path.join(os.path.abspath(arcpy.env.workspace), path)
-        arcpy.management.Delete(fullpath)
+        backend = backends.get_backend()
+        if backends.is_memory(path):
+            fullpath = path
+        else:
+            fullpath = os.path.join(os.path.abspath(backend.env.workspace or '.'), path)
+        backend.delete(fullpath)
+        SCHEMA_CACHE.invalidate(fullpath)
 
 
 def intersect_polygon_layers(destination, layers, **intersect_options):
@@ -737,8 +778,8 @@ def intersect_polygon_layers(destination, layers, **intersect_options):
     """
 
     result = arcpy.analysis.Intersect(
-        in_features=layers,
-        out_feature_class=destination,
+        in_features=[backends.arcpy_path(layer) for layer in validate.non_empty_list(layers)],
+        out_feature_class=backends.arcpy_path(destination),
         **intersect_options
     )
 
@@ -750,7 +791,8 @@ def load_attribute_table(input_path, *fields):
     """
     Loads a shapefile's attribute table as a numpy record array.
 
-    Relies on `arcpy.da.TableToNumPyArray`_.
+    Relies on `arcpy.da.TableToNumPyArray`_ or, without ``arcpy``, on
+    :func:`propagator.shapefile.read_dbf`.
 
     .. _arcpy.da.TableToNumPyArray: http://goo.gl/NzS6sB
 
@@ -787,23 +829,72 @@ def load_attribute_table(input_path, *fields):
           dtype=[('CatchID', '<U20'), ('DwnCatchID', '<U20'),
                  ('Watershed', '<U50')])
     """
-    # load the data
-    layer = load_data(input_path, "layer")
+    fields = _table_fields(input_path, fields)
+    return backends.get_backend().load_attribute_table(input_path, fields)
+
 
+def _table_fields(input_path, fields):
+    # read the schema once to both default and validate the fields
+    existing_fields = get_field_names(input_path)
     if len(fields) == 0:
-        fields = get_field_names(input_path)
+        fields = existing_fields
 
     # remove any duplicate field names
-    fields = numpy.unique(fields)
+    fields = numpy.unique(fields).tolist()
 
     # check that fields are valid
-    check_fields(layer.dataSource, *fields, should_exist=True)
+    bad_names = [f for f in fields if f not in existing_fields and f != 'SHAPE@AREA']
+    if len(bad_names) > 0:
+        raise ValueError('fields {} are not in {}'.format(bad_names, input_path))
+
+    return fields
+
+
+def iter_attribute_table(input_path, *fields, **kwargs):
+    """
+    Reads a shapefile's attribute table as a sequence of numpy record
+    arrays of (at most) ``chunksize`` rows each, so that tables larger
+    than the available memory can be processed.
+
+    Parameters
+    ----------
+    input_path : str
+        Fiilepath to the shapefile or feature class whose table needs
+        to be read.
+    *fields : str
+        Names of the fields that should be included in the resulting
+        arrays.
+    chunksize : int, optional (100000)
+        The maximum number of rows in each chunk.
+
+    Yields
+    ------
+    records : numpy.recarray
+        Record arrays of the selected fields with the same dtype as
+        the output of :func:`load_attribute_table`.
 
-    array = arcpy.da.FeatureClassToNumPyArray(in_table=input_path, field_names=fields)
-    return array
+    See also
+    --------
+    load_attribute_table
 
+    Examples
+    --------
+    >>> from propagator import utils
+    >>> total = 0
+    >>> for chunk in utils.iter_attribute_table('wetlands.shp', 'SHAPE@AREA'):
+    ...     total += chunk['SHAPE@AREA'].sum()
 
-def unique_field_values(input_path, field):
+    """
+
+    chunksize = int(kwargs.pop('chunksize', 100000))
+    if chunksize < 1:
+        raise ValueError('`chunksize` must be a positive integer')
+
+    fields = _table_fields(input_path, fields)
+    return backends.get_backend().iter_attribute_table(input_path, fields, chunksize)
+
+
+def unique_field_values(input_path, field, chunksize=None):
     """
     Get an array of unique values in a table field.
 
@@ -814,6 +905,10 @@ def unique_field_values(input_path, field):
         to be read.
     fields : str
         Name of the field whose unique values will be returned
+    chunksize : int, optional
+        When provided, the table is read ``chunksize`` rows at a time
+        (see :func:`iter_attribute_table`) and only the unique values
+        are kept in memory.
 
     Returns
     -------
@@ -822,12 +917,22 @@ def unique_field_values(input_path, field):
 
     """
 
-    table = load_attribute_table(input_path, field)
-    return numpy.unique(table[field])
+    if chunksize is None:
+        table = load_attribute_table(input_path, field)
+        return numpy.unique(table[field])
+
+    values = None
+    for chunk in iter_attribute_table(input_path, field, chunksize=chunksize):
+        chunk_values = numpy.unique(chunk[field])
+        values = chunk_values if values is None else numpy.union1d(values, chunk_values)
+
+    if values is None:
+        values = numpy.unique(load_attribute_table(input_path, field)[field])
+    return values
 
 
 def groupby_and_aggregate(input_path, groupfield, valuefield,
-                          aggfxn=None):
+                          aggfxn=None, chunksize=None, combine=None):
     """
     Counts the number of distinct values of `valuefield` are associated
     with each value of `groupfield` in a data source found at
@@ -848,6 +953,19 @@ def groupby_and_aggregate(input_path, groupfield, valuefield,
         This function should accept an `itertools._grouper` as its only
         input. If not provided, unique number of value in the group will
         be returned.
+    chunksize : int, optional
+        When provided, the table is read ``chunksize`` rows at a time
+        (see :func:`iter_attribute_table`). Each chunk is aggregated on
+        its own, and the partial aggregates are merged with
+        ``combine``.
+    combine : callable, optional
+        Function that merges two partial aggregates of the same group
+        into one (e.g., ``operator.add`` to merge sums). Required when
+        using both ``chunksize`` and ``aggfxn``. The default count of
+        unique values is merged without it: the sorted, distinct
+        (group, value) pairs of each chunk are written to a temporary
+        file and the files are merged, so that only about
+        ``chunksize`` pairs are held in memory at once.
 
     Returns
     -------
@@ -872,6 +990,17 @@ def groupby_and_aggregate(input_path, groupfield, valuefield,
     ...     valuefield='STRUCT_ID'
     ... )
 
+    >>> # total areas of a table too large to fit in memory
+    >>> import operator
+    >>> wetland_areas = utils.groupby_and_aggregate(
+    ...     input_path='statewide_wetlands.shp',
+    ...     groupfield='GeoID',
+    ...     valuefield='SHAPE@AREA',
+    ...     aggfxn=lambda group: sum([row[1] for row in group]),
+    ...     chunksize=500000,
+    ...     combine=operator.add,
+    ... )
+
     See also
     --------
     itertools.groupby
@@ -880,6 +1009,10 @@ def groupby_and_aggregate(input_path, groupfield, valuefield,
 
     """
 
+    if chunksize is not None:
+        return _chunked_groupby_and_aggregate(input_path, groupfield, valuefield,
+                                              aggfxn, chunksize, combine)
+
     if aggfxn is None:
         aggfxn = lambda x: int(numpy.unique(list(x)).shape[0])
 
@@ -893,6 +1026,73 @@ def groupby_and_aggregate(input_path, groupfield, valuefield,
     return counts
 
 
+def _chunked_groupby_and_aggregate(input_path, groupfield, valuefield,
+                                   aggfxn, chunksize, combine):
+    if aggfxn is not None and combine is None:
+        raise ValueError("must provide `combine` to aggregate in chunks with `aggfxn`")
+
+    chunks = iter_attribute_table(input_path, groupfield, valuefield, chunksize=chunksize)
+    if aggfxn is None:
+        return _count_distinct_in_chunks(chunks, groupfield, valuefield, chunksize)
+
+    results = {}
+    for chunk in chunks:
+        chunk.sort()
+        for groupname, shapes in itertools.groupby(chunk, lambda row: row[groupfield]):
+            partial = aggfxn(shapes)
+            if groupname in results:
+                results[groupname] = combine(results[groupname], partial)
+            else:
+                results[groupname] = partial
+
+    return results
+
+
+def _count_distinct_in_chunks(chunks, groupfield, valuefield, chunksize):
+    """ Counts the distinct values of ``valuefield`` in each group with
+    an external merge sort, so that memory use is bounded by
+    ``chunksize`` rather than by the size of the table. """
+
+    # distinct values can't be counted piecewise, so the sorted
+    # distinct (group, value) pairs of every chunk are spilled to disk
+    folder = tempfile.mkdtemp(prefix='propagator_distinct_')
+    try:
+        runs = []
+        for chunk in chunks:
+            pairs = numpy.empty(chunk.shape[0], dtype=[
+                (groupfield, chunk.dtype[groupfield]),
+                (valuefield, chunk.dtype[valuefield]),
+            ])
+            pairs[groupfield] = chunk[groupfield]
+            pairs[valuefield] = chunk[valuefield]
+            pairs = numpy.unique(pairs)
+            if pairs.shape[0] == 0:
+                continue
+
+            path = os.path.join(folder, '{}.npy'.format(len(runs)))
+            numpy.save(path, pairs)
+            runs.append(path)
+
+        def read(path, blocksize):
+            run = numpy.load(path, mmap_mode='r')
+            for start in range(0, run.shape[0], blocksize):
+                for pair in run[start:start + blocksize].tolist():
+                    yield pair
+
+        # the runs are merged a block at a time, so pairs repeated in
+        # several chunks arrive next to each other
+        blocksize = max(1, chunksize // max(1, len(runs)))
+        counts = {}
+        previous = None
+        for pair in heapq.merge(*[read(path, blocksize) for path in runs]):
+            if pair != previous:
+                counts[pair[0]] = counts.get(pair[0], 0) + 1
+                previous = pair
+        return counts
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
 def rename_column(table, oldname, newname, newalias=None):  # pragma: no cover
     """
     .. warning: Not yet implemented.
@@ -917,6 +1117,11 @@ def populate_field(table, value_fxn, valuefield, keyfields=None):
     field (`valuefield`) based on another field (`keyfield`) by passing
     the entire row through a function (`value_fxn`).
 
+    If `value_fxn` is not callable, it is taken to be the new values
+    themselves (a constant or an array with a value for each row), and
+    the whole column is written at once without any per-row python
+    calls. For shapefiles, the .dbf file is patched in place.
+
     Relies on `arcpy.da.UpdateCursor`_.
 
     .. _arcpy.da.UpdateCursor: http://goo.gl/sa3mW6
@@ -925,9 +1130,9 @@ def populate_field(table, value_fxn, valuefield, keyfields=None):
     ----------
     table : Layer, table, or file path
         This is the layer/file that will have a new field created.
-    value_fxn : callable
+    value_fxn : callable, scalar, or array
         Any function that accepts a row from an `arcpy.da.SearchCursor`
-        and returns a *single* value.
+        and returns a *single* value, or the value(s) themselves.
     valuefield : string
         The name of the field to be computed.
     keyfields : list of str, optional
@@ -948,6 +1153,8 @@ def populate_field(table, value_fxn, valuefield, keyfields=None):
     --------
     >>> # populate field ("Company") with a constant value ("Geosyntec")
     >>> populate_field("wetlands.shp", lambda row: "Geosyntec", "Company")
+    >>> # or, without calling a function for each row
+    >>> populate_field("wetlands.shp", "Geosyntec", "Company")
 
     """
 
@@ -955,10 +1162,10 @@ def populate_field(table, value_fxn, valuefield, keyfields=None):
     fields.append(valuefield)
     check_fields(table, *fields, should_exist=True)
 
-    with arcpy.da.UpdateCursor(table, fields) as cur:
-        for row in cur:
-            row[-1] = value_fxn(row)
-            cur.updateRow(row)
+    if callable(value_fxn):
+        backends.get_backend().populate_field(table, value_fxn, fields)
+    else:
+        backends.get_backend().write_columns(table, {valuefield: value_fxn})
 
 
 def copy_layer(existing_layer, new_layer):
@@ -978,8 +1185,8 @@ def copy_layer(existing_layer, new_layer):
 
     """
 
-    arcpy.management.Copy(in_data=existing_layer, out_data=new_layer)
-    return new_layer
+    SCHEMA_CACHE.invalidate(new_layer)
+    return backends.get_backend().copy_layer(existing_layer, new_layer)
 
 
 def concat_results(destination, input_files):
@@ -1039,25 +1246,12 @@ def update_attribute_table(layerpath, attribute_array, id_column,
     if new_columns is None:
         new_columns = copy(orig_columns)
 
-    # place the ID_column and columnes to be updated
-    # in a single list
-    all_columns = [id_column]
-    all_columns.extend(orig_columns)
+    # index the new array once so that each row is found in O(1)
+    index = RowIndex(attribute_array, id_column)
 
-    # load the existing attributed table, loop through all rows
-    with arcpy.da.UpdateCursor(layerpath, all_columns) as cur:
-        for oldrow in cur:
-            # find the current row in the new array
-            newrow = find_row_in_array(attribute_array, id_column, oldrow[0])
-            # loop through the value colums, setting them to the new values
-            if newrow is not None:
-                for n, col in enumerate(new_columns, 1):
-                    oldrow[n] = newrow[col]
-
-            # update the row
-            cur.updateRow(oldrow)
-
-    return layerpath
+    return backends.get_backend().update_attribute_table(
+        layerpath, index, id_column, orig_columns, new_columns
+    )
 
 
 def delete_columns(layerpath, *columns):
@@ -1077,8 +1271,8 @@ def delete_columns(layerpath, *columns):
 
     """
     if len(columns) > 0:
-        col_str = ";".join(columns)
-        arcpy.management.DeleteField(layerpath, col_str)
+        backends.get_backend().delete_columns(layerpath, columns)
+        SCHEMA_CACHE.invalidate(layerpath)
 
     return layerpath
 
@@ -1095,7 +1289,7 @@ def spatial_join(left, right, outputfile, **kwargs):
 
 
 def count_features(layer):
-    return int(arcpy.management.GetCount(layer).getOutput(0))
+    return backends.get_backend().count_features(layer)
 
 
 def query_layer(inputpath, outputpath, sql):
@@ -1108,6 +1302,19 @@ def query_layer(inputpath, outputpath, sql):
     return outputpath
 
 
+def _require_arcpy(task):
+    """ Raises an informative error when ``task`` needs ``arcpy`` but
+    ArcGIS is not installed. """
+
+    if arcpy is None:
+        raise ImportError(
+            "{} requires arcpy (ArcGIS). Without it, only shapefiles in the "
+            "same coordinate system can be joined, split, and dissolved; "
+            "reproject the inputs or convert them to shapefiles "
+            "first".format(task)
+        )
+
+
 def intersect_layers(input_paths, output_path, how='all'):
     """
     Intersect polygon layers with each other. Basically a thin wrapper
@@ -1121,7 +1328,9 @@ def intersect_layers(input_paths, output_path, how='all'):
         The layers (or their paths) that will be intersected with each
         other.
     output_path : str
-        Filepath where the intersected output will be saved.
+        Filepath where the intersected output will be saved. Layers
+        named ``memory:<name>`` are kept in ``arcpy``'s ``in_memory``
+        workspace.
     how : str
         Method by which the attributes should be joined. Valid values
         are: "all" (all attributes), or "only_fid" (just the feature
@@ -1133,6 +1342,11 @@ def intersect_layers(input_paths, output_path, how='all'):
         The path to the layer containing the successfully intersected
         layers.
 
+    Raises
+    ------
+    ImportError
+        When ``arcpy`` is not installed.
+
     Examples
     --------
     >>> from propagator import utils
@@ -1142,9 +1356,12 @@ def intersect_layers(input_paths, output_path, how='all'):
     ... )
 
     """
+
+    input_paths = validate.non_empty_list(input_paths)
+    _require_arcpy("intersecting {}".format(", ".join(map(str, input_paths))))
     arcpy.analysis.Intersect(
-        in_features=input_paths,
-        out_feature_class=output_path,
+        in_features=[backends.arcpy_path(layer) for layer in input_paths],
+        out_feature_class=backends.arcpy_path(output_path),
         join_attributes=how.upper(),
         output_type="INPUT"
     )
@@ -1152,10 +1369,112 @@ def intersect_layers(input_paths, output_path, how='all'):
     return output_path
 
 
+class SchemaCache(object):
+    """
+    Cache of the field names of datasets, keyed by their absolute
+    paths.
+
+    An entry is reused as long as the modification time and size of
+    the file that holds the dataset's schema (the .dbf file of a
+    shapefile) are unchanged. Feature classes in a file geodatabase
+    are checked against the geodatabase's ``timestamps`` file (see
+    :func:`propagator.backends.geodatabase_marker`), so any change to
+    the geodatabase drops their entries. Other datasets
+    that are not on disk are never cached. Functions that change a
+    schema (e.g., :func:`add_field_with_value` and
+    :func:`delete_columns`) invalidate its entry explicitly.
+
+    Attributes
+    ----------
+    hits, misses : int
+        Number of lookups that were or were not answered by the cache.
+
+    Examples
+    --------
+    >>> from propagator import utils
+    >>> utils.get_field_names('subcatchments.shp')
+    >>> utils.get_field_names('subcatchments.shp')
+    >>> utils.SCHEMA_CACHE.stats
+    {'hits': 1, 'misses': 1, 'size': 1}
+
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self)}
+
+    def _key(self, layerpath):
+        backend = backends.get_backend()
+        path = str(getattr(layerpath, 'dataSource', layerpath))
+        name = getattr(backend, 'name', type(backend).__name__)
+        if backends.is_memory(path):
+            return (name, path.lower())
+        if not os.path.isabs(path) and backend.env.workspace:
+            path = os.path.join(backend.env.workspace, path)
+        return (name, os.path.normcase(os.path.abspath(path)))
+
+    @staticmethod
+    def _signature(path):
+        # feature classes in a geodatabase are keyed on a single file
+        # that changes with every edit to the geodatabase
+        marker = backends.geodatabase_marker(path)
+        if marker is None:
+            candidates = (os.path.splitext(path)[0] + '.dbf', path)
+            marker = next((c for c in candidates if os.path.isfile(c)), None)
+        if marker is None:
+            return None
+
+        stat = os.stat(marker)
+        return (marker, stat.st_mtime, stat.st_size)
+
+    def get(self, layerpath, loader):
+        """ The field names of ``layerpath``, either from the cache or
+        from ``loader(layerpath)``. """
+
+        key = self._key(layerpath)
+        signature = self._signature(key[1])
+        entry = self._entries.get(key)
+        if signature is not None and entry is not None and entry[0] == signature:
+            self.hits += 1
+            return list(entry[1])
+
+        self.misses += 1
+        fieldnames = list(loader(layerpath))
+        if signature is not None:
+            self._entries[key] = (signature, fieldnames)
+        else:
+            self._entries.pop(key, None)
+        return list(fieldnames)
+
+    def invalidate(self, layerpath):
+        """ Drops the cached schema of ``layerpath``. """
+        self._entries.pop(self._key(layerpath), None)
+
+    def clear(self):
+        """ Drops every cached schema and resets the counters. """
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# the schemas read by `get_field_names`
+SCHEMA_CACHE = SchemaCache()
+
+
 def get_field_names(layerpath):
     """
     Gets the names of fields/columns in a feature class or table.
-    Relies on `arcpy.ListFields`_.
+    Relies on `arcpy.ListFields`_ or, without ``arcpy``, on the header
+    of the shapefile's .dbf file. Results are cached in
+    ``SCHEMA_CACHE`` (see :class:`SchemaCache`).
 
     .. _arcpy.ListFields: http://goo.gl/Siq5y7
 
@@ -1170,7 +1489,7 @@ def get_field_names(layerpath):
 
     """
 
-    return [f.name for f in arcpy.ListFields(layerpath)]
+    return SCHEMA_CACHE.get(layerpath, backends.get_backend().get_field_names)
 
 
 def aggregate_geom(layerpath, by_fields, field_stat_tuples, outputpath=None, **kwargs):
@@ -1210,6 +1529,11 @@ def aggregate_geom(layerpath, by_fields, field_stat_tuples, outputpath=None, **k
         Name of the new feature class where the output was sucessfully
         saved.
 
+    Raises
+    ------
+    ImportError
+        When ``arcpy`` is not installed.
+
     Examples
     --------
     >>> from propagator import utils
@@ -1224,9 +1548,10 @@ def aggregate_geom(layerpath, by_fields, field_stat_tuples, outputpath=None, **k
     """
 
     by_fields = validate.non_empty_list(by_fields)
+    _require_arcpy("dissolving {}".format(layerpath))
     arcpy.management.Dissolve(
-        in_features=layerpath,
-        out_feature_class=outputpath,
+        in_features=backends.arcpy_path(layerpath),
+        out_feature_class=backends.arcpy_path(outputpath),
         dissolve_field=by_fields,
         statistics_fields=field_stat_tuples,
         **kwargs
@@ -1235,7 +1560,100 @@ def aggregate_geom(layerpath, by_fields, field_stat_tuples, outputpath=None, **k
     return outputpath
 
 
-def find_row_in_array(array, column, value):
+class RowIndex(object):
+    """
+    Hash index of the rows of a record array by the values in one of
+    its columns. Building the index is O(n), and each lookup is O(1).
+
+    Parameters
+    ----------
+    array : numpy.recarray
+        The record array to be indexed.
+    column : str
+        The name of the column of the array to index.
+
+    Examples
+    --------
+    >>> from propagator import utils
+    >>> import numpy
+    >>> x = numpy.array(
+            [
+                ('A1', 'Ocean', 'A1_x'), ('A2', 'Ocean', 'A2_x'),
+                ('B1', 'A1', 'None'), ('B2', 'A1', 'B2_x'),
+            ], dtype=[('ID', '<U5'), ('DS_ID', '<U5'), ('Cu', '<U5'),]
+        )
+    >>> index = utils.RowIndex(x, 'ID')
+    >>> index.position('B1')
+    2
+    >>> index.find('A1')
+    ('A1', 'Ocean', 'A1_x')
+
+    """
+
+    def __init__(self, array, column):
+        self.array = array
+        self.column = column
+        self._positions = {}
+        self._duplicates = set()
+        for n, value in enumerate(array[column].tolist()):
+            if value in self._positions:
+                self._duplicates.add(value)
+            else:
+                self._positions[value] = n
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, value):
+        return value in self._positions
+
+    def position(self, value):
+        """ The position of the row where ``column == value``, or None
+        if there is no such row.
+
+        Raises
+        ------
+        ValueError
+            An error is raised if more than one row matches.
+
+        """
+
+        if value in self._duplicates:
+            raise ValueError("more than one row where {} == {}".format(self.column, value))
+        return self._positions.get(value, None)
+
+    def positions(self, values):
+        """ The positions of the rows matching each of ``values`` as
+        an array, with -1 where there is no such row.
+
+        Raises
+        ------
+        ValueError
+            An error is raised if more than one row matches any value.
+
+        """
+
+        values = list(values)
+        duplicated = self._duplicates.intersection(values)
+        if len(duplicated) > 0:
+            raise ValueError("more than one row where {} == {}".format(
+                self.column, duplicated.pop()))
+
+        get = self._positions.get
+        return numpy.array([get(value, -1) for value in values], dtype=int)
+
+    def find(self, value):
+        """ The row where ``column == value``, or None if there is no
+        such row. Raises a ``ValueError`` if more than one row
+        matches. """
+
+        position = self.position(value)
+        if position is None:
+            return None
+        return self.array[position]
+
+
+def find_row_in_array(array, column, value, index=None):
     """
     Find a single row in a record array.
 
@@ -1247,6 +1665,10 @@ def find_row_in_array(array, column, value):
         The name of the column of the array to search.
     value : int, str, or float
         The value sought in ``column``
+    index : RowIndex, optional
+        An index of ``array`` by ``column``. When provided, the row is
+        looked up in the index instead of scanning all of ``array``.
+        Build one when searching the same array many times.
 
     Raises
     ------
@@ -1273,6 +1695,9 @@ def find_row_in_array(array, column, value):
 
     """
 
+    if index is not None:
+        return index.find(value)
+
     rows = filter(lambda x: x[column] == value, array)
     if len(rows) == 0:
         row = None
@@ -1338,6 +1763,10 @@ def rec_groupby(array, group_cols, *stats):
     if numpy.isscalar(group_cols):
         group_cols = [group_cols]
 
+    # use the vectorized engine if we can
+    if all(stat.aggfxn in SORTED_GROUPBY_METHODS for stat in stats):
+        return sorted_groupby(array, group_cols, stats)
+
     # build a dictionary from group_cols keys -> list of indices into
     # array with  those keys
     row_dict = dict()
@@ -1369,6 +1798,122 @@ def rec_groupby(array, group_cols, *stats):
     return record_array
 
 
+def sorted_groupby(array, group_cols, stats, ignored_value=None,
+                   terminator_value=None):
+    """
+    Perform a vectorized groupby-apply operation on a numpy record
+    array.
+
+    The group columns are factorized once and the rows are sorted by
+    group, so every group is a contiguous segment of each value column.
+    The statistics are then computed for all of the groups at once
+    instead of calling a function for each group.
+
+    Parameters
+    ----------
+    array : numpy.recarray
+        The data to be grouped and aggregated.
+    group_cols : str or sequence of str
+        The columns that identify each group
+    stats : sequence of Statistic
+        Which columns should be aggregated, how they should be
+        aggregated, and what the resulting column name should be. The
+        ``aggfxn`` of each must be the name of a method in
+        ``SORTED_GROUPBY_METHODS`` (e.g., "median" or "p25").
+    ignored_value, terminator_value : float, optional
+        Values that should be excluded from the statistics, handled
+        exactly like :func:`stats_with_ignored_values` does.
+
+    Returns
+    -------
+    aggregated : numpy.recarray
+        One row per group, sorted by the group columns.
+
+    See also
+    --------
+    rec_groupby
+
+    """
+
+    if numpy.isscalar(group_cols):
+        group_cols = [group_cols]
+
+    # pack the group columns into their own array so that multiple
+    # columns can be factorized together
+    keys = numpy.empty(array.shape[0], dtype=[(c, array.dtype[c]) for c in group_cols])
+    for col in group_cols:
+        keys[col] = array[col]
+
+    groups, codes = numpy.unique(keys, return_inverse=True)
+    order = numpy.argsort(codes, kind='mergesort')
+    codes = codes[order]
+
+    output = [groups[col] for col in group_cols]
+    for stat in stats:
+        values = numpy.asarray(array[stat.srccol])[order]
+        output.append(grouped_stats_with_ignored_values(
+            values, codes, stat.aggfxn,
+            ignored_value=ignored_value,
+            terminator_value=terminator_value,
+            n_groups=groups.shape[0],
+        ))
+
+    names = list(group_cols)
+    names.extend([stat.rescol for stat in stats])
+    return numpy.rec.fromarrays(output, names=names)
+
+
+def _grouped_stat(values, codes, n_groups, method, ignored_value):
+    """
+    Computes a single statistic for every group at once. ``codes`` are
+    the sorted group codes of ``values``.
+    """
+
+    if ignored_value is not None:
+        valid = values != ignored_value
+        values, codes = values[valid], codes[valid]
+
+    counts = numpy.bincount(codes, minlength=n_groups)
+    starts = numpy.cumsum(counts) - counts
+    found = counts > 0
+
+    if method in ('median', 'p10', 'p25', 'p50', 'p75', 'p90'):
+        # sort the values within each group, then interpolate between
+        # the closest ranks like numpy.percentile does.
+        values = values[numpy.lexsort((values, codes))]
+        q = 50 if method == 'median' else int(method[1:])
+        pos = (counts[found] - 1) * (q / 100.)
+        lower = numpy.floor(pos).astype(int)
+        upper = numpy.ceil(pos).astype(int)
+        low = values[starts[found] + lower]
+        high = values[starts[found] + upper]
+        result = low + (high - low) * (pos - lower)
+    elif method == 'first':
+        result = values[starts[found]]
+    elif method == 'last':
+        result = values[starts[found] + counts[found] - 1]
+    elif method == 'count':
+        result = counts[found]
+    elif method == 'minimum':
+        result = numpy.minimum.reduceat(values, starts[found])
+    elif method == 'maximum':
+        result = numpy.maximum.reduceat(values, starts[found])
+    elif method in ('sum', 'average'):
+        result = numpy.bincount(codes, weights=values, minlength=n_groups)[found]
+        if method == 'average':
+            result = result / counts[found]
+    else:
+        raise ValueError("'{}' is not a supported method".format(method))
+
+    if found.all():
+        return result
+
+    output = numpy.empty(n_groups, dtype=numpy.result_type(result, numpy.array(ignored_value)))
+    output[found] = result
+    output[~found] = ignored_value
+    return output
+
+
 def stats_with_ignored_values(array, statfxn, ignored_value=None,
                               terminator_value=None):
     """
@@ -1438,6 +1983,80 @@ def stats_with_ignored_values(array, statfxn, ignored_value=None,
     return res
 
 
+def grouped_stats_with_ignored_values(array, group_codes, method,
+                                      ignored_value=None,
+                                      terminator_value=None,
+                                      n_groups=None):
+    """
+    Compute statistics of many groups at once while ignoring certain
+    values.
+
+    This is a batched version of :func:`stats_with_ignored_values`
+    that gives the same result for every group, without calling it
+    once per group.
+
+    Parameters
+    ----------
+    array : numpy.array (of floats)
+        The values to be summarized
+    group_codes : numpy.array of int
+        The group (0 through ``n_groups - 1``) of each value.
+    method : str
+        The name of the statistic to compute. Must be in
+        ``SORTED_GROUPBY_METHODS``.
+    ignored_value : float, optional
+        The values in ``array`` that should be ignored.
+    terminator_value : float, optional
+        A value that is not propagated unless it is the only
+        non-``ignored_value`` in a group.
+    n_groups : int, optional
+        The total number of groups. Defaults to one more than the
+        largest group code.
+
+    Returns
+    -------
+    res : numpy.array
+        The statistic for each group. If every value in a group is
+        ignored, the result is ``ignored_value``, unless a
+        ``terminator_value`` was given, in which case the result is
+        ``terminator_value`` (the same as ``stats_with_ignored_values``).
+
+    Examples
+    --------
+    >>> import numpy
+    >>> from propagator import utils
+    >>> x = [-99., 0., 1., 2., 3., -99., 0., 0.]
+    >>> groups = [0, 0, 0, 0, 0, 1, 1, 2]
+    >>> utils.grouped_stats_with_ignored_values(x, groups, 'average',
+    ...                                         ignored_value=0,
+    ...                                         terminator_value=-99)
+    array([  2., -99., -99.])
+
+    """
+
+    if ignored_value is not None and ignored_value == terminator_value:
+        raise ValueError("terminator and ignored values must be different.")
+
+    array = numpy.asarray(array)
+    group_codes = numpy.asarray(group_codes, dtype=int)
+    if n_groups is None:
+        n_groups = group_codes.max() + 1 if group_codes.shape[0] > 0 else 0
+
+    # the values of each group need to be contiguous
+    order = numpy.argsort(group_codes, kind='mergesort')
+    array, group_codes = array[order], group_codes[order]
+
+    # with a terminator, the ignored values are simply dropped and then
+    # the terminator values are treated as the ignored ones.
+    if terminator_value is not None:
+        if ignored_value is not None:
+            keep = array != ignored_value
+            array, group_codes = array[keep], group_codes[keep]
+        ignored_value = terminator_value
+
+    return _grouped_stat(array, group_codes, n_groups, method, ignored_value)
+
+
 def weighted_average(arr):
     """
     Computed weighted average from two columns in an array.
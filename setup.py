@@ -37,7 +37,7 @@ CLASSIFIERS = [
 ]
 PACKAGE_DATA = {}
 DATA_FILES = []
-INSTALL_REQUIRES = ['numpy']
+INSTALL_REQUIRES = ['numpy', 'futures; python_version < "3"']
 
 if __name__ == "__main__":
     setup(